@@ -1,206 +1,3747 @@
 #!/bin/python
+import time
+STARTUP_T0 = time.perf_counter()
 import os
+import sys
+import stat
+import errno
+import fcntl
+import mmap
+import lzma
+import tarfile
+import queue
 import shutil
 import re
+import json
+import hashlib
+import math
+import bisect
+import random
+import tempfile
+import zlib
+import operator
+import ctypes
+import select
+import struct
+import sqlite3
+import threading
+import argparse
+import atexit
+import contextlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+STARTUP_MARKS = [("stdlib imports", time.perf_counter())]
+
+def set_home(home):
+    # Every path below lives under the user's home. SDDM_HOME or --home points
+    # them at another tree, e.g. one built by gen-tree for benchmarking.
+    global HOME, STEAM_ROOT, INTERNAL_LIBRARY, LIBRARY_FOLDERS_VDF, COMPATDATA_PATH, SHADERCACHE_PATH, LIBRARYCACHE_PATH
+    global CACHE_DIR, CACHE_DB, DEVICE_SPEEDS, THUMBNAIL_DIR, STATE_DIR, JOURNAL_DB, IO_CONFIG, HASH_DIR, _library_paths, _manifest_index
+    HOME = Path(home)
+    STEAM_ROOT = HOME / ".local/share/Steam"
+    INTERNAL_LIBRARY = STEAM_ROOT / "steamapps"
+    LIBRARY_FOLDERS_VDF = INTERNAL_LIBRARY / "libraryfolders.vdf"
+    COMPATDATA_PATH = HOME / ".steam/steam/steamapps/compatdata"
+    SHADERCACHE_PATH = HOME / ".steam/steam/steamapps/shadercache"
+    LIBRARYCACHE_PATH = HOME / ".steam/steam/appcache/librarycache"
+    CACHE_DIR = HOME / ".cache/steam-deck-data-manager"
+    CACHE_DB = CACHE_DIR / "cache.sqlite3"
+    DEVICE_SPEEDS = CACHE_DIR / "device-speed.json"
+    THUMBNAIL_DIR = CACHE_DIR / "thumbnails"
+    STATE_DIR = HOME / ".local/state/steam-deck-data-manager"
+    JOURNAL_DB = STATE_DIR / "journal.sqlite3"
+    IO_CONFIG = STATE_DIR / "io.json"
+    HASH_DIR = STATE_DIR / "hashes"
+    _library_paths = _manifest_index = None
+
+set_home(os.environ.get("SDDM_HOME", "/home/deck"))
+SCAN_WORKERS = min(8, os.cpu_count() or 4)
+ICON_HEIGHT = 48
+ICON_WORKERS = 2
+ICON_PREFETCH_ROWS = 20
+COPY_CHUNK = 8 * 1024 * 1024
+COPY_WORKERS = 4
+SMALL_FILE_SIZE = 1024 * 1024
+JOB_WORKERS = 1
+RECLAIM_WORKERS = 4
+TRASH_DIRNAME = ".sddm-trash"
+WATCH_DEBOUNCE = 1.0
+WATCH_MAX_DELAY = 5.0
+WATCH_BUDGET_FRACTION = 0.5
+PLAN_BUCKETS = 4096
+PLAN_RECENT_DAYS = 30
+PLAN_RECENT_WEIGHT = 4
+GENERATED_FIRST_APPID = 1000000
+GENERATED_MARKER = ".sddm-generated"
+BENCH_SCHEMA = 1
+BENCH_NOISE_FLOOR = 0.005
+TRACE_SUMMARY_APPS = 15
+DEDUP_MIN_SIZE = 64 * 1024
+DEDUP_WORKERS = 4
+DEDUP_RANGE_CHUNK = 16 * 1024 * 1024
+ARCHIVE_DIRNAME = "sddm-archive"
+ARCHIVE_BLOCK = 8 * 1024 * 1024
+ARCHIVE_WORKERS = min(4, os.cpu_count() or 2)
+ARCHIVE_PRESET = 1
+IO_PAUSE_CHECK = 2.0
+IO_ADAPT_INTERVAL = 1.0
+IO_LATENCY_TOLERANCE = 2.0
+IO_LATENCY_DECAY = 1.02
+SPEED_TEST_SIZE = 64 * 1024 * 1024
+SPEED_TEST_BLOCK = 1024 * 1024
+SPEED_TEST_READS = 256
+SPEED_TEST_MAX_AGE = 30 * 86400
+TIER_KEEP = 5
+TIER_HYSTERESIS = 2
+TARGET_RESERVE = 512 * 1024 * 1024
+SHADER_STALE_DAYS = 30
+SHADER_AGE_DAYS = (7, 30, 90)
+ORPHAN_MAX_APPID = 2 ** 31
+
+TreeSize = namedtuple("TreeSize", "apparent allocated files")
+EMPTY_TREE = TreeSize(0, 0, 0)
+DirRecord = namedtuple("DirRecord", "ino mtime_ns apparent allocated files links subdirs")
+StorageState = namedtuple("StorageState", "prefix_state prefix_target shader_state shader_target")
+TransferStats = namedtuple("TransferStats", "bytes files seconds")
+MoveRecord = namedtuple("MoveRecord", "id kind source target phase copied_files copied_bytes")
+CachedApp = namedtuple("CachedApp", "appid name icon_path location symlink prefix shader")
+
+# Optional tracing. With SDDM_TRACE=FILE (or --trace FILE) spans around
+# manifest parsing, scanning, icon loading, row insertion, moves and deletes
+# are written as Chrome trace-event JSON, which chrome://tracing and
+# ui.perfetto.dev open directly. Without it trace_span costs one global lookup.
+
+class TraceSpan:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        local = self.tracer.local
+        self.depth = getattr(local, "depth", 0)
+        local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self.args
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.tracer.local.depth = self.depth
+        self.tracer.record(self.name, self.start, end, self.depth, self.args)
+        return False
+
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def record(self, name, start, end, depth, args):
+        tid = threading.get_ident()
+        with self.lock:
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+            self.events.append((name, start, end, tid, depth, args))
+
+    def trace_events(self):
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in thread_names.items()]
+        trace += [{"name": name, "cat": "sddm", "ph": "X", "pid": pid, "tid": tid,
+                   "ts": round((start - STARTUP_T0) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                   "args": {key: str(value) if isinstance(value, Path) else value for key, value in args.items()}}
+                  for name, start, end, tid, depth, args in events]
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def slowest_apps(self, limit=TRACE_SUMMARY_APPS):
+        # An app's total only counts outermost spans, so time spent in a nested
+        # span is not counted twice; the per-span columns include nested spans.
+        # Bytes and files are reported by exactly one span per operation; a
+        # repeated operation (a rescan) replaces the earlier figures instead of
+        # adding to them.
+        apps = {}
+        with self.lock:
+            events = list(self.events)
+        for name, start, end, tid, depth, args in events:
+            if "appid" not in args:
+                continue
+            app = apps.setdefault(args["appid"], {"total": 0.0, "bytes": 0, "files": 0, "spans": {}, "sizes": {}})
+            app["spans"][name] = app["spans"].get(name, 0.0) + end - start
+            if depth == 0:
+                app["total"] += end - start
+            if "bytes" in args or "files" in args:
+                app["sizes"][name] = (args.get("bytes", 0), args.get("files", 0))
+        for app in apps.values():
+            app["bytes"] = sum(size[0] for size in app["sizes"].values())
+            app["files"] = sum(size[1] for size in app["sizes"].values())
+        return sorted(apps.items(), key=lambda item: item[1]["total"], reverse=True)[:limit]
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.trace_events(), f)
+        slowest = self.slowest_apps()
+        span_names = sorted({name for _, app in slowest for name in app["spans"]})
+        print(f"Trace written to {self.path}. Slowest apps (ms):", file=sys.stderr)
+        print_table([[appid, f"{app['total'] * 1000:.1f}"] + [f"{app['spans'][name] * 1000:.1f}" if name in app["spans"] else ""
+                                                              for name in span_names]
+                     + [format_size(app["bytes"]), app["files"]] for appid, app in slowest],
+                    ["AppID", "Total"] + span_names + ["Bytes", "Files"], file=sys.stderr)
+
+TRACER = None
+
+def enable_tracing(path):
+    global TRACER
+    if TRACER is None:
+        TRACER = Tracer(path)
+        atexit.register(TRACER.write)
+    return TRACER
+
+def trace_span(name, **args):
+    # Callers may add "bytes" and "files" to the yielded dict before the span ends.
+    if TRACER is None:
+        return contextlib.nullcontext(args)
+    return TraceSpan(TRACER, name, args)
+
+if os.environ.get("SDDM_TRACE"):
+    enable_tracing(os.environ["SDDM_TRACE"])
+
+VDF_TOKEN = re.compile(r'\s+|//[^\n]*|"((?:\\.|[^"\\])*)"|([{}])|([^\s{}"]+)')
+VDF_ESCAPES = {"n": "\n", "t": "\t", "\\": "\\", '"': '"'}
+
+def parse_vdf(text):
+    # Text KeyValues as used by libraryfolders.vdf and appmanifest_*.acf:
+    # quoted or bare tokens, nested {} blocks and // comments.
+    root = {}
+    stack = [root]
+    key = None
+    for match in VDF_TOKEN.finditer(text):
+        quoted, brace, bare = match.groups()
+        if brace == "{":
+            block = {}
+            if key is not None:
+                stack[-1][key] = block
+                key = None
+            stack.append(block)
+        elif brace == "}":
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif quoted is not None or bare is not None:
+            token = bare if quoted is None else quoted
+            if quoted and "\\" in quoted:
+                token = re.sub(r"\\(.)", lambda m: VDF_ESCAPES.get(m.group(1), m.group(1)), quoted)
+            if key is None:
+                key = token
+            else:
+                stack[-1][key] = token
+                key = None
+    return root
+
+def read_vdf(path):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return parse_vdf(f.read())
+    except OSError:
+        return {}
+
+AppManifest = namedtuple("AppManifest", "appid name installdir size_on_disk last_updated last_played library")
+
+_index_lock = threading.Lock()
+_library_paths = None
+_manifest_index = None
+
+def _manifest_int(state, key):
+    try:
+        return int(state.get(key, 0))
+    except (TypeError, ValueError):
+        return 0
+
+def get_steam_library_paths(refresh=False):
+    global _library_paths
+    with _index_lock:
+        if _library_paths is None or refresh:
+            folders = read_vdf(LIBRARY_FOLDERS_VDF).get("libraryfolders", {})
+            paths = [entry["path"] for entry in folders.values() if isinstance(entry, dict) and "path" in entry]
+            external_paths = [Path(p) / "steamapps" for p in paths if not p.startswith(str(STEAM_ROOT))]
+            _library_paths = [p for p in external_paths if p.exists()]
+        return list(_library_paths)
+
+def get_manifest_index(refresh=False):
+    # One pass over every library: each appmanifest_*.acf is read once and
+    # everything else looks apps up here instead of probing the libraries again.
+    global _manifest_index
+    libraries = get_steam_library_paths(refresh) + [INTERNAL_LIBRARY]
+    with _index_lock:
+        if _manifest_index is None or refresh:
+            index = {}
+            with trace_span("manifest_index") as span:
+                for lib_path in libraries:
+                    try:
+                        entries = list(os.scandir(lib_path))
+                    except OSError:
+                        continue
+                    for entry in entries:
+                        if is_manifest_name(entry.name):
+                            manifest = read_manifest(entry.path, lib_path)
+                            index[manifest.appid] = manifest
+                span["files"] = len(index)
+            _manifest_index = index
+        return _manifest_index
+
+def is_manifest_name(name):
+    return name.startswith("appmanifest_") and name.endswith(".acf")
+
+def read_manifest(path, lib_path):
+    appid = os.path.basename(path)[len("appmanifest_"):-len(".acf")]
+    state = read_vdf(path).get("AppState", {})
+    return AppManifest(
+        appid, state.get("name", "Unknown Game"), state.get("installdir", ""),
+        _manifest_int(state, "SizeOnDisk"), _manifest_int(state, "LastUpdated"),
+        _manifest_int(state, "LastPlayed"), lib_path)
+
+def update_manifest_index(lib_path, name):
+    # Re-reads one appmanifest after it changed on disk and returns its appid.
+    # The index is replaced rather than mutated so readers never see it half updated.
+    global _manifest_index
+    get_manifest_index()
+    path = os.path.join(lib_path, name)
+    manifest = read_manifest(path, lib_path) if os.path.exists(path) else None
+    with _index_lock:
+        index = dict(_manifest_index)
+        appid = os.path.basename(path)[len("appmanifest_"):-len(".acf")]
+        if manifest:
+            index[appid] = manifest
+        elif appid in index and index[appid].library == lib_path:
+            del index[appid]
+        _manifest_index = index
+    return appid
+
+# Every external library is a possible target. A move goes to the fastest
+# library (by the cached read speed of its device) that still has TARGET_RESERVE
+# free after taking it, falling back to the one with the most free space.
+# Devices are only measured on request, never when the GUI starts.
+
+LibraryTarget = namedtuple("LibraryTarget", "library device free seq_read random_iops")
+
+def get_mount_source(path):
+    # The filesystem source (e.g. /dev/mmcblk0p1) of the mount holding path,
+    # from the longest matching mount point in /proc/self/mountinfo.
+    path = os.path.realpath(path)
+    best, source = "", None
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                fields = line.split()
+                # The kernel escapes space, tab, newline and backslash as \NNN octal.
+                mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), fields[4])
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                    best, source = mount_point, fields[fields.index("-") + 2]
+    except (OSError, ValueError, IndexError):
+        pass
+    return source
+
+def get_device_label(library):
+    source = get_mount_source(library) or ""
+    name = os.path.basename(source) or str(library)
+    if name.startswith("mmcblk"):
+        return f"microSD {name}"
+    if name.startswith("sd"):
+        return f"USB {name}"
+    return name
+
+def get_library_targets():
+    speeds = load_device_speeds()
+    targets = []
+    for library in get_steam_library_paths():
+        try:
+            free = shutil.disk_usage(library).free
+        except OSError:
+            continue
+        speed = speeds.get(str(library))
+        if speed and speed["dev"] != device_of(library):
+            speed = None
+        targets.append(LibraryTarget(library, get_device_label(library), free,
+                                     speed["seq_read"] if speed else 0.0, speed["random_iops"] if speed else 0.0))
+    return targets
+
+def rank_targets(targets):
+    # Speeds only compare once every library has been measured (targets --measure
+    # or tier); until then the library with the most free space comes first.
+    targets = list(targets)
+    measured = all(target.seq_read for target in targets)
+    return sorted(targets, key=lambda target: (target.seq_read, target.free) if measured else target.free, reverse=True)
+
+def choose_target(size=0, targets=None, reserve=TARGET_RESERVE):
+    # The planners pass their own targets with the free space left after the
+    # moves they already assigned.
+    targets = get_library_targets() if targets is None else list(targets)
+    fitting = [target for target in targets if target.free - size >= reserve]
+    if fitting:
+        return rank_targets(fitting)[0]
+    return max(targets, key=operator.attrgetter("free"), default=None)
+
+def get_microsd_path(size=0):
+    target = choose_target(size)
+    return target.library if target else None
+
+def get_library_dir(library, location_type):
+    return Path(library) / ("compatdata" if location_type == "prefix" else "shadercache")
+
+def get_target_dir(location_type, size=0):
+    microsd_path = get_microsd_path(size)
+    if not microsd_path:
+        return None
+    return get_library_dir(microsd_path, location_type)
+
+def get_target_path(location_type, appid, size=0):
+    # Only moves to an external library need a target; None when none is mounted.
+    target_dir = get_target_dir(location_type, size)
+    return target_dir / appid if target_dir else None
+
+def get_library_of(path):
+    path = os.path.realpath(path)
+    for library in get_steam_library_paths():
+        if path.startswith(os.path.realpath(library) + os.sep):
+            return library
+    return None
+
+def get_game_name(appid):
+    with trace_span("get_game_name", appid=appid):
+        manifest = get_manifest_index().get(appid)
+    return manifest.name if manifest else "Unknown Game"
+
+def scan_directory(path, st):
+    apparent = allocated = files = 0
+    links = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                entry_st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                allocated += entry_st.st_blocks * 512
+                subdirs.append(entry.name)
+            elif entry_st.st_nlink > 1:
+                links.append((entry_st.st_dev, entry_st.st_ino, entry_st.st_size, entry_st.st_blocks * 512))
+            else:
+                apparent += entry_st.st_size
+                allocated += entry_st.st_blocks * 512
+                files += 1
+    return DirRecord(st.st_ino, st.st_mtime_ns, apparent, allocated, files, links, subdirs)
+
+def scan_tree(path, cached=None):
+    # Apparent size is the sum of st_size, allocated size the blocks actually
+    # used on disk. Hardlinked inodes are only counted the first time they are seen.
+    # A directory whose inode and mtime match its cached record has the same
+    # entries as last time, so it is reused without being listed again.
+    cached = cached or {}
+    records = {}
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        dirpath = os.path.join(path, rel) if rel else str(path)
+        try:
+            st = os.stat(dirpath)
+            record = cached.get(rel)
+            if record is None or record.ino != st.st_ino or record.mtime_ns != st.st_mtime_ns:
+                record = scan_directory(dirpath, st)
+        except OSError:
+            continue
+        records[rel] = record
+        stack.extend(os.path.join(rel, name) if rel else name for name in record.subdirs)
+    return tree_totals(records), records
+
+def tree_totals(records):
+    apparent = allocated = files = 0
+    seen_inodes = set()
+    for record in records.values():
+        apparent += record.apparent
+        allocated += record.allocated
+        files += record.files
+        for dev, ino, size, blocks in record.links:
+            if (dev, ino) not in seen_inodes:
+                seen_inodes.add((dev, ino))
+                apparent += size
+                allocated += blocks
+                files += 1
+    return TreeSize(apparent, allocated, files)
+
+class SizeCache:
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=None):
+        path = path or CACHE_DB
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self.db.executescript("""
+                DROP TABLE IF EXISTS apps;
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS hashes;
+                DROP TABLE IF EXISTS dedup_links;
+                CREATE TABLE apps (
+                    appid TEXT PRIMARY KEY, name TEXT, icon_path TEXT, location TEXT, symlink INTEGER,
+                    prefix_apparent INTEGER, prefix_allocated INTEGER, prefix_files INTEGER,
+                    shader_apparent INTEGER, shader_allocated INTEGER, shader_files INTEGER);
+                CREATE TABLE dirs (
+                    root TEXT, rel TEXT, ino INTEGER, mtime_ns INTEGER,
+                    apparent INTEGER, allocated INTEGER, files INTEGER, links TEXT, subdirs TEXT,
+                    PRIMARY KEY (root, rel));
+                CREATE TABLE hashes (
+                    dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT,
+                    PRIMARY KEY (dev, ino));
+                CREATE TABLE dedup_links (dev INTEGER, ino INTEGER, PRIMARY KEY (dev, ino));
+            """)
+            self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self.db.commit()
+
+    def load_apps(self):
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM apps").fetchall()
+        return {row[0]: CachedApp(row[0], row[1], row[2], row[3], bool(row[4]), TreeSize(*row[5:8]), TreeSize(*row[8:11]))
+                for row in rows}
+
+    def save_app(self, appid, name, icon_path, location, symlink, prefix, shader):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO apps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (appid, name, icon_path, location, int(symlink), *prefix, *shader))
+            self.db.commit()
+
+    def load_tree(self, root):
+        with self.lock:
+            rows = self.db.execute("SELECT rel, ino, mtime_ns, apparent, allocated, files, links, subdirs FROM dirs WHERE root = ?",
+                                   (root,)).fetchall()
+        return {rel: DirRecord(ino, mtime_ns, apparent, allocated, files, [tuple(link) for link in json.loads(links)],
+                               subdirs.split("\0") if subdirs else [])
+                for rel, ino, mtime_ns, apparent, allocated, files, links, subdirs in rows}
+
+    def save_tree(self, root, records):
+        with self.lock:
+            self.db.execute("DELETE FROM dirs WHERE root = ?", (root,))
+            self.db.executemany("INSERT INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                ((root, rel, r.ino, r.mtime_ns, r.apparent, r.allocated, r.files,
+                                  json.dumps(r.links), "\0".join(r.subdirs))
+                                 for rel, r in records.items()))
+            self.db.commit()
+
+    def load_hashes(self, dev):
+        with self.lock:
+            rows = self.db.execute("SELECT ino, size, mtime_ns, digest FROM hashes WHERE dev = ?", (dev,)).fetchall()
+        return {ino: (size, mtime_ns, digest) for ino, size, mtime_ns, digest in rows}
+
+    def save_hashes(self, rows):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def load_dedup_links(self, dev):
+        with self.lock:
+            return {(dev, row[0]) for row in self.db.execute("SELECT ino FROM dedup_links WHERE dev = ?", (dev,))}
+
+    def add_dedup_links(self, inodes):
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO dedup_links VALUES (?, ?)", inodes)
+            self.db.commit()
+
+    def prune(self, appids):
+        with self.lock:
+            stale = [row[0] for row in self.db.execute("SELECT appid FROM apps") if row[0] not in appids]
+            for appid in stale:
+                self.db.execute("DELETE FROM apps WHERE appid = ?", (appid,))
+                self.db.execute("DELETE FROM dirs WHERE root = ?", (str(COMPATDATA_PATH / appid),))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def open_size_cache():
+    try:
+        return SizeCache()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Size cache disabled: {e}")
+        return None
+
+def scan_app(appid, folder, cache=None, full=False):
+    # Prefixes are rescanned incrementally from their cached directory records.
+    # Files rewritten in place do not touch their directory's mtime, so a full
+    # rescan is still needed to pick those up. Shader caches are small trees whose
+    # files are appended to in place, so they are always walked in full.
+    with trace_span("scan_app", appid=appid) as span:
+        with trace_span("scan_prefix", appid=appid):
+            cached = cache.load_tree(str(folder)) if cache and not full else None
+            prefix, records = scan_tree(folder, cached)
+            if cache and records != cached:
+                cache.save_tree(str(folder), records)
+        with trace_span("scan_shader", appid=appid):
+            shader_path = SHADERCACHE_PATH / appid
+            shader = scan_tree(shader_path)[0] if shader_path.exists() else EMPTY_TREE
+        span.update(bytes=prefix.apparent + shader.apparent, files=prefix.files + shader.files)
+    return appid, prefix, shader
+
+def scan_apps(app_folders, workers=SCAN_WORKERS, cache=None, full=False):
+    # os.scandir and stat release the GIL, so several prefixes are walked in parallel.
+    # Results are yielded as soon as each app finishes, not in input order.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_app, appid, folder, cache, full) for appid, folder in app_folders.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+def find_icon_source(appid):
+    base_path = LIBRARYCACHE_PATH / appid
+    preferred_files = ["header.jpg", "logo.png", "library_header.png"]
+
+    for filename in preferred_files:
+        icon_path = base_path / filename
+        if icon_path.exists():
+            return icon_path
+
+    if base_path.exists():
+        for file in base_path.iterdir():
+            if file.is_file() and file.suffix.lower() in [".jpg", ".png"]:
+                return file
+
+    return None
+
+def thumbnail_path(icon_path):
+    st = os.stat(icon_path)
+    key = hashlib.sha1(f"{icon_path}:{st.st_mtime_ns}".encode()).hexdigest()
+    return THUMBNAIL_DIR / f"{key}.png"
+
+def is_symlink(path):
+    return os.path.islink(path)
+
+def get_path_state(path):
+    if is_symlink(path):
+        return ("microSD" if path.exists() else "Missing"), os.readlink(path)
+    if path.exists():
+        return "Internal", str(path)
+    archive = find_archive(path)
+    if archive:
+        return "Archived", str(archive)
+    return "N/A", "N/A"
+
+def get_storage_state(appid):
+    prefix_state, prefix_target = get_path_state(COMPATDATA_PATH / appid)
+    shader_state, shader_target = get_path_state(SHADERCACHE_PATH / appid)
+    return StorageState(prefix_state, prefix_target, shader_state, shader_target)
+
+def describe_location(location, target):
+    # Symlinked folders name the device they live on, e.g. "microSD mmcblk0p1".
+    if location == "microSD":
+        library = get_library_of(target)
+        if library:
+            return get_device_label(library)
+    return location
+
+def get_storage_location(appid, state=None):
+    state = state or get_storage_state(appid)
+    prefix_label = f"Prefix: {state.prefix_target} ({describe_location(state.prefix_state, state.prefix_target)})"
+    shader_label = f"Shader: {state.shader_target} ({describe_location(state.shader_state, state.shader_target)})"
+    return f"{prefix_label}\n{shader_label}"
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def format_rate(stats):
+    rate = stats.bytes / stats.seconds if stats.seconds > 0 else 0
+    return f"{format_size(stats.bytes)} at {format_size(rate)}/s"
+
+# I/O scheduling. Moves and background deletes go through one IOScheduler per
+# device: at idle I/O priority, under a token-bucket bandwidth cap, with as many
+# files in flight as the device keeps up with, and paused while a game has a
+# Proton prefix open. Settings are per library in IO_CONFIG (see `io`).
+
+IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289}.get(os.uname().machine)
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IO_DEFAULTS = {"bandwidth": 0, "workers": COPY_WORKERS, "idle": True, "pause": True}
+
+_ioprio = threading.local()
+_io_schedulers = {}
+_io_lock = threading.Lock()
+_prefix_users = (0.0, [])
+
+def set_thread_ioprio(idle):
+    # ioprio_set with who=0 applies to the calling thread only, so every worker
+    # thread sets it for itself. Not every I/O scheduler honours the idle class,
+    # so failures are ignored.
+    ioprio = (IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) if idle else (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 4
+    if IOPRIO_SET is None or getattr(_ioprio, "value", None) == ioprio:
+        return
+    _ioprio.value = ioprio
+    try:
+        ctypes.CDLL(None, use_errno=True).syscall(IOPRIO_SET, IOPRIO_WHO_PROCESS, 0, ioprio)
+    except (OSError, AttributeError):
+        pass
+
+def get_prefix_roots():
+    roots = {os.path.realpath(COMPATDATA_PATH)}
+    roots.update(os.path.realpath(library / "compatdata") for library in get_steam_library_paths())
+    return [root + os.sep for root in roots]
+
+def find_prefix_users(max_age=IO_PAUSE_CHECK):
+    # Other processes with a file under any compatdata folder open, as
+    # (pid, command) pairs. Listing every fd in /proc is not free, so the
+    # answer is reused for max_age seconds.
+    global _prefix_users
+    checked, users = _prefix_users
+    if time.monotonic() - checked < max_age:
+        return users
+    roots = get_prefix_roots()
+    own_pid = os.getpid()
+    users = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == own_pid:
+            continue
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f"{fd_dir}/{fd}")
+            except OSError:
+                continue
+            if target.startswith(tuple(roots)):
+                try:
+                    with open(f"/proc/{pid}/comm") as f:
+                        command = f.read().strip()
+                except OSError:
+                    command = "?"
+                users.append((int(pid), command))
+                break
+    _prefix_users = (time.monotonic(), users)
+    return users
+
+class TokenBucket:
+    # rate bytes per second with up to one second of burst. Bytes are taken after
+    # they were transferred, so the bucket may go into debt; take() returns how
+    # long the caller should wait for the debt to be paid off.
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = max(rate, COPY_CHUNK)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, nbytes):
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, max(self.rate, COPY_CHUNK))
+            self.last = now
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+class IOScheduler:
+    def __init__(self, name, config):
+        self.name = name
+        self.cond = threading.Condition()
+        self.active = 0
+        self.window = [time.monotonic(), 0, 0, 0.0]  # start, ops, bytes, busy seconds
+        self.best_latency = None
+        self.last_rate = 0.0
+        self.configure(config)
+
+    def configure(self, config):
+        with self.cond:
+            self.config = dict(IO_DEFAULTS, **config)
+            self.max_workers = max(int(self.config["workers"]), 1)
+            self.limit = min(getattr(self, "limit", max(self.max_workers // 2, 1)), self.max_workers)
+            self.bucket = TokenBucket(int(self.config["bandwidth"]))
+            self.cond.notify_all()
+
+    def pause_reason(self):
+        if not self.config["pause"]:
+            return None
+        users = find_prefix_users()
+        if not users:
+            return None
+        pid, command = users[0]
+        return f"Paused while {command} ({pid}) has a prefix open"
+
+    def wait(self, seconds=0.0, progress=None):
+        # Sleeps for seconds and then for as long as the pause lasts, reporting the
+        # reason through progress, which also lets a cancelled job raise here.
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            reason = self.pause_reason()
+            if remaining <= 0 and not reason:
+                return
+            if progress:
+                progress(0, reason or f"Throttled to {format_size(self.bucket.rate)}/s")
+            time.sleep(min(max(remaining, 0) or IO_PAUSE_CHECK, IO_PAUSE_CHECK))
+
+    def throttle(self, nbytes, progress=None):
+        self.wait(self.bucket.take(nbytes), progress)
+
+    def wrap(self, progress):
+        def scheduled(nbytes, path=""):
+            self.throttle(nbytes, progress)
+            if progress:
+                progress(nbytes, path)
+        return scheduled
+
+    @contextlib.contextmanager
+    def slot(self, nbytes=0, progress=None):
+        self.wait(0, progress)
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+        set_thread_ioprio(self.config["idle"])
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active -= 1
+                self.record(nbytes, time.monotonic() - start)
+                self.cond.notify()
+
+    def record(self, nbytes, seconds):
+        # Additive increase while more files in flight still raise throughput,
+        # step down as soon as the average latency climbs well above the best
+        # seen, which means requests are queueing inside the device.
+        start, ops, total, busy = self.window
+        ops, total, busy = ops + 1, total + nbytes, busy + seconds
+        now = time.monotonic()
+        if now - start < IO_ADAPT_INTERVAL:
+            self.window = [start, ops, total, busy]
+            return
+        rate = total / (now - start)
+        latency = busy / ops
+        self.best_latency = min(self.best_latency * IO_LATENCY_DECAY, latency) if self.best_latency else latency
+        if latency > self.best_latency * IO_LATENCY_TOLERANCE:
+            self.limit = max(self.limit - 1, 1)
+        elif rate >= self.last_rate * 1.05 and self.limit < self.max_workers:
+            self.limit += 1
+            self.cond.notify_all()
+        self.last_rate = rate
+        self.window = [now, 0, 0, 0.0]
+
+def load_io_config():
+    try:
+        with open(IO_CONFIG) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_io_config(config):
+    IO_CONFIG.parent.mkdir(parents=True, exist_ok=True)
+    tmp = IO_CONFIG.with_name(IO_CONFIG.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp, IO_CONFIG)
+
+def device_of(path):
+    path = Path(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            if path == path.parent:
+                return None
+            path = path.parent
+
+def get_io_scheduler(*paths):
+    # A move touches two devices. It is scheduled on the one that is not
+    # internal storage, since that is where games and downloads compete with it.
+    libraries = {}
+    for library in [INTERNAL_LIBRARY] + get_steam_library_paths():
+        libraries.setdefault(device_of(library), library)
+    internal = device_of(INTERNAL_LIBRARY)
+    devices = [device_of(path) for path in paths]
+    device = next((dev for dev in devices if dev != internal), devices[0])
+    library = libraries.get(device)
+    config = load_io_config().get(str(library), {}) if library else {}
+    with _io_lock:
+        scheduler = _io_schedulers.get(device)
+        if scheduler is None:
+            scheduler = _io_schedulers[device] = IOScheduler(str(library or device), config)
+        elif dict(IO_DEFAULTS, **config) != scheduler.config:
+            scheduler.configure(config)
+    return scheduler
+
+_copy_buffers = threading.local()
+KERNEL_COPY_FALLBACK = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+def copy_file_data(src_fd, dst_fd, progress=None, digest=None):
+    # Prefer in-kernel copies, then fall back to a page-aligned userspace buffer.
+    # The kernel calls advance both file offsets, so a fallback resumes where they stopped.
+    # A digest needs the data in userspace, so it always takes the buffered path
+    # and hashes each chunk between reading and writing it.
+    for kernel_copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if kernel_copy is None or digest is not None:
+            continue
+        try:
+            while True:
+                if kernel_copy is os.sendfile:
+                    copied = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK)
+                else:
+                    copied = kernel_copy(src_fd, dst_fd, COPY_CHUNK)
+                if not copied:
+                    return
+                if progress:
+                    progress(copied)
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_FALLBACK:
+                raise
+    buffer = getattr(_copy_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _copy_buffers.buffer = mmap.mmap(-1, COPY_CHUNK)
+    view = memoryview(buffer)
+    while True:
+        copied = os.readv(src_fd, [view])
+        if not copied:
+            return
+        if digest is not None:
+            digest.update(view[:copied])
+        written = 0
+        while written < copied:
+            written += os.write(dst_fd, view[written:copied])
+        if progress:
+            progress(copied)
+
+def copy_file(src, dst, progress=None, digest=None):
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            copy_file_data(src_fd, dst_fd, (lambda copied: progress(copied, src)) if progress else None, digest)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    copy_metadata(src, dst)
+
+def copy_metadata(src, dst):
+    shutil.copystat(src, dst, follow_symlinks=False)
+    if os.geteuid() == 0:
+        st = os.lstat(src)
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+
+def is_copied(src_st, dst_path):
+    try:
+        dst_st = os.lstat(dst_path)
+    except OSError:
+        return False
+    return dst_st.st_size == src_st.st_size and dst_st.st_mtime_ns == src_st.st_mtime_ns
+
+def copy_tree(src, dst, progress=None, workers=COPY_WORKERS, resume=False, split_links=(), hashes=None, scheduler=None):
+    # Large files are streamed one at a time on the calling thread while small
+    # files are copied concurrently, which keeps SD cards busy without seeking
+    # between several big streams. Hardlinks inside the tree are recreated.
+    # progress(bytes, path) is also called with 0 bytes per directory, so a
+    # callback that raises TransferCancelled stops the walk promptly.
+    # With resume, files already in dst with the same size and mtime are skipped;
+    # copy_metadata sets the mtime last, so a half-written file never matches.
+    # Inodes in split_links (hardlinks made by dedup) get one copy per path instead.
+    # With a hashes dict, the digest of every copied file is stored under its
+    # path relative to src. A scheduler decides how many files are copied at once
+    # and throttles every chunk; workers is then only the upper bound.
+    start = time.monotonic()
+    total_bytes = total_files = 0
+    linked = {}
+    links = []
+    directories = []
+
+    def copy_one(src_path, dst_path, st):
+        digest = hashlib.blake2b() if hashes is not None else None
+        with scheduler.slot(st.st_size, progress) if scheduler else contextlib.nullcontext():
+            copy_file(src_path, dst_path, chunk_progress, digest)
+        if digest is not None:
+            hashes[os.path.relpath(src_path, src)] = digest.hexdigest()
+
+    chunk_progress = scheduler.wrap(progress) if scheduler else progress
+    os.makedirs(dst, exist_ok=resume)
+    directories.append((src, dst))
+    stack = [(str(src), str(dst))]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        while stack:
+            src_dir, dst_dir = stack.pop()
+            if progress:
+                progress(0, src_dir)
+            with os.scandir(src_dir) as it:
+                entries = list(it)
+            for entry in entries:
+                dst_entry = os.path.join(dst_dir, entry.name)
+                st = entry.stat(follow_symlinks=False)
+                if stat.S_ISDIR(st.st_mode):
+                    os.makedirs(dst_entry, exist_ok=resume)
+                    directories.append((entry.path, dst_entry))
+                    stack.append((entry.path, dst_entry))
+                elif stat.S_ISLNK(st.st_mode):
+                    if resume and os.path.lexists(dst_entry):
+                        os.unlink(dst_entry)
+                    os.symlink(os.readlink(entry.path), dst_entry)
+                    copy_metadata(entry.path, dst_entry)
+                elif stat.S_ISREG(st.st_mode):
+                    total_files += 1
+                    if st.st_nlink > 1 and (st.st_dev, st.st_ino) not in split_links:
+                        if (st.st_dev, st.st_ino) in linked:
+                            # The first path may still be queued on the pool, so
+                            # links are made once every copy has finished.
+                            if not (resume and os.path.lexists(dst_entry)):
+                                links.append((linked[(st.st_dev, st.st_ino)], dst_entry))
+                            continue
+                        linked[(st.st_dev, st.st_ino)] = dst_entry
+                    if resume and is_copied(st, dst_entry):
+                        if progress:
+                            progress(st.st_size, entry.path)
+                        continue
+                    total_bytes += st.st_size
+                    if st.st_size <= SMALL_FILE_SIZE:
+                        pending.append(pool.submit(copy_one, entry.path, dst_entry, st))
+                    else:
+                        copy_one(entry.path, dst_entry, st)
+        for future in pending:
+            future.result()
+    for first_path, dst_entry in links:
+        os.link(first_path, dst_entry)
+    for src_dir, dst_dir in reversed(directories):
+        copy_metadata(src_dir, dst_dir)
+    return TransferStats(total_bytes, total_files, time.monotonic() - start)
+
+def transfer_tree(src, dst, progress=None, resume=False, split_links=(), hashes=None, scheduler=None):
+    # A rename is instant when both paths are on the same filesystem; otherwise
+    # the tree is copied and the caller is responsible for removing the source.
+    start = time.monotonic()
+    if not (resume and os.path.exists(dst)):
+        try:
+            os.rename(src, dst)
+            return TransferStats(0, 0, time.monotonic() - start)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    return copy_tree(src, dst, progress, resume=resume, split_links=split_links, hashes=hashes, scheduler=scheduler)
+
+def partial_path(path):
+    return path.with_name(path.name + ".sddm-partial")
+
+def transfer_staged(src, staging, progress=None, resume=False, split_links=(), hashes=None, scheduler=None):
+    # A failed or cancelled copy leaves the source untouched and removes the staging copy.
+    # An interrupted process leaves it in place for the journal to resume.
+    try:
+        return transfer_tree(src, staging, progress, resume, split_links, hashes, scheduler)
+    except BaseException:
+        if staging.exists() and src.exists():
+            shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+# Verified moves. Files are hashed while they are copied; the copy is then read
+# back from the device and compared before the source may be removed. The
+# digests are kept in HASH_DIR, keyed by the moved folder's path, so `verify`
+# can recheck it later without leaving files in Steam's directories.
+
+VerifyReport = namedtuple("VerifyReport", "checked corrupt modified missing added")
+
+class VerifyError(Exception):
+    pass
+
+def hash_manifest_path(path):
+    key = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=16).hexdigest()
+    return HASH_DIR / f"{key}.json"
+
+def write_hash_manifest(path, hashes):
+    manifest = hash_manifest_path(path)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest.with_name(manifest.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"algorithm": "blake2b", "created": time.time(), "path": os.path.abspath(path), "files": hashes}, f)
+    os.replace(tmp, manifest)
+
+def read_hash_manifest(path):
+    try:
+        with open(hash_manifest_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove_hash_manifest(path):
+    try:
+        os.unlink(hash_manifest_path(path))
+    except FileNotFoundError:
+        pass
+
+def readback_digest(path):
+    # The caller syncs first, so every page is clean and can be dropped; the hash
+    # then covers what the device returns instead of what is still cached.
+    with open(path, "rb") as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+def list_tree_files(root):
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if stat.S_ISREG(os.lstat(path).st_mode):
+                files.append(os.path.relpath(path, root))
+    return files
+
+def verify_tree(src, dst, hashes=None, progress=None, workers=COPY_WORKERS):
+    # Files skipped by a resumed copy have no digest yet and are hashed from src.
+    # Returns the digests of every file once all of them match.
+    hashes = hashes or {}
+    os.sync()
+
+    def check(rel):
+        if progress:
+            progress(0, rel)
+        expected = hashes.get(rel) or hash_file(os.path.join(src, rel))
+        try:
+            return rel, expected, readback_digest(os.path.join(dst, rel))
+        except FileNotFoundError:
+            return rel, expected, None
+
+    verified = {}
+    mismatched = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rel, expected, actual in pool.map(check, list_tree_files(src)):
+            if actual != expected:
+                mismatched.append(rel)
+            verified[rel] = expected
+    if mismatched:
+        raise VerifyError(f"{len(mismatched)} files differ after copying, e.g. {mismatched[0]}")
+    return verified
+
+def verify_folder(path, progress=None, workers=COPY_WORKERS):
+    # Rechecks a folder against its hash manifest. A file whose content changed
+    # but whose mtime is newer than the manifest was written to since the move
+    # (the game saved); a change with an older mtime is corruption.
+    path = Path(os.readlink(path)) if is_symlink(path) else path
+    manifest = read_hash_manifest(path)
+    if manifest is None:
+        return None
+    expected = manifest["files"]
+    os.sync()
+
+    def check(rel):
+        if progress:
+            progress(0, rel)
+        file_path = os.path.join(path, rel)
+        try:
+            mtime = os.stat(file_path).st_mtime
+            return rel, readback_digest(file_path), mtime
+        except FileNotFoundError:
+            return rel, None, None
+
+    corrupt, modified, missing = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rel, digest, mtime in pool.map(check, expected):
+            if digest is None:
+                missing.append(rel)
+            elif digest != expected[rel]:
+                (modified if mtime > manifest["created"] else corrupt).append(rel)
+    added = sorted(set(list_tree_files(path)) - set(expected))
+    return VerifyReport(len(expected), corrupt, modified, missing, added)
+
+class MoveJournal:
+    # Write-ahead log of in-flight moves. A move goes through the phases
+    # copying -> swapping -> cleanup and is deleted once finished, so any row
+    # left at startup is an interrupted move. Every step of a phase is safe to
+    # repeat, which is what makes resuming after a crash possible. Files are not
+    # logged: a resumed copy skips what already matches in the staging folder.
+
+    def __init__(self, path=None):
+        path = path or JOURNAL_DB
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS moves (
+                id INTEGER PRIMARY KEY, kind TEXT, source TEXT, target TEXT, phase TEXT, started REAL);
+            DROP TABLE IF EXISTS move_files;
+        """)
+        self.db.commit()
+
+    def begin(self, kind, source, target):
+        with self.lock:
+            cursor = self.db.execute("INSERT INTO moves (kind, source, target, phase, started) VALUES (?, ?, ?, 'copying', ?)",
+                                     (kind, str(source), str(target), time.time()))
+            self.db.commit()
+            return MoveRecord(cursor.lastrowid, kind, str(source), str(target), "copying", 0, 0)
+
+    def set_phase(self, move_id, phase):
+        with self.lock:
+            self.db.execute("UPDATE moves SET phase = ? WHERE id = ?", (phase, move_id))
+            self.db.commit()
+
+    def finish(self, move_id):
+        with self.lock:
+            self.db.execute("DELETE FROM moves WHERE id = ?", (move_id,))
+            self.db.commit()
+
+    def unfinished(self):
+        with self.lock:
+            rows = self.db.execute("SELECT id, kind, source, target, phase FROM moves ORDER BY id").fetchall()
+        moves = []
+        for row in rows:
+            move = MoveRecord(*row, 0, 0)
+            staging = move_paths(move)[1]
+            if move.phase == "copying" and staging.exists():
+                staged = scan_tree(staging)[0]
+                move = move._replace(copied_files=staged.files, copied_bytes=staged.apparent)
+            moves.append(move)
+        return moves
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def open_journal():
+    try:
+        return MoveJournal()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Move journal disabled: {e}")
+        return None
+
+def move_paths(move):
+    # "to_target" moves the internal folder at source to target and leaves a symlink;
+    # "to_internal" brings the symlink target back into the internal source path.
+    source, target = Path(move.source), Path(move.target)
+    if move.kind == "to_target":
+        return source, partial_path(target), target
+    return target, partial_path(source), source
+
+def staged_by_rename(copy_from, staging):
+    # While copying, the source only disappears when transfer_tree renamed it into
+    # staging, which needs both on one filesystem. A source on a removed card has
+    # no parent folder left to compare, so its partial copy is never taken as done.
+    try:
+        return os.stat(copy_from.parent).st_dev == os.stat(staging.parent).st_dev
+    except OSError:
+        return False
+
+def run_move(move, journal=None, progress=None, verify=False):
+    source, target = Path(move.source), Path(move.target)
+    copy_from, staging, copy_to = move_paths(move)
+    phase = move.phase
+    stats = TransferStats(0, 0, 0)
+    verified = None
+    if phase == "copying" and not copy_from.exists():
+        if not staging.exists():
+            if journal:
+                journal.finish(move.id)
+            raise Exception(f"{copy_from} no longer exists!")
+        if not staged_by_rename(copy_from, staging):
+            raise Exception(f"{copy_from} is not available; reconnect its storage and resume the move")
+    if phase == "copying":
+        if copy_from.exists():
+            hashes = {} if verify else None
+            with trace_span("copy", appid=source.name, source=move.source, target=move.target) as span:
+                try:
+                    stats = transfer_staged(copy_from, staging, progress, resume=True, split_links=get_dedup_links(copy_from),
+                                            hashes=hashes,
+                                            scheduler=get_io_scheduler(copy_from, staging.parent))
+                except BaseException:
+                    if journal and not staging.exists():
+                        journal.finish(move.id)
+                    raise
+                span.update(bytes=stats.bytes, files=stats.files)
+            # A rename within one filesystem leaves nothing to verify.
+            if verify and copy_from.exists():
+                with trace_span("verify", appid=source.name) as span:
+                    try:
+                        verified = verify_tree(copy_from, staging, hashes, progress)
+                    except BaseException:
+                        shutil.rmtree(staging, ignore_errors=True)
+                        if journal:
+                            journal.finish(move.id)
+                        raise
+                    span.update(files=len(verified))
+                write_hash_manifest(copy_to, verified)
+            else:
+                remove_hash_manifest(copy_to)
+        phase = "swapping"
+        if journal:
+            journal.set_phase(move.id, phase)
+    if phase == "swapping":
+        if move.kind == "to_target":
+            if staging.exists():
+                os.rename(staging, target)
+            if source.exists() and not is_symlink(source):
+                os.rename(source, source.with_name(source.name + ".sddm-old"))
+            if not os.path.lexists(source):
+                os.symlink(target, source)
+        else:
+            if is_symlink(source):
+                os.unlink(source)
+            if staging.exists():
+                os.rename(staging, source)
+        phase = "cleanup"
+        if journal:
+            journal.set_phase(move.id, phase)
+    if move.kind == "to_target":
+        leftover = source.with_name(source.name + ".sddm-old")
+    else:
+        leftover = target
+    if leftover.exists():
+        trash_tree(leftover)
+    # Digests only describe the copy they were taken from.
+    remove_hash_manifest(copy_from)
+    if journal:
+        journal.finish(move.id)
+    rate = f" ({format_rate(stats)})" if stats.files else ""
+    if verified is not None:
+        rate += f", {len(verified)} files verified"
+    if move.kind == "to_target":
+        return f"Moved to target with symlink{rate}"
+    return f"Moved back to internal storage{rate}"
+
+def rollback_move(move, journal=None):
+    # Only a move that is still copying can be rolled back cheaply: the source is
+    # complete, so dropping the staging copy restores the original state. Later
+    # phases already switched over to the new copy and are finished instead.
+    if move.phase != "copying":
+        return run_move(move, journal)
+    copy_from, staging, _ = move_paths(move)
+    if staging.exists() and copy_from.exists():
+        shutil.rmtree(staging)
+    elif staging.exists():
+        # transfer_tree renamed the source into staging within one filesystem, so
+        # staging holds the only copy. A failed rename keeps the journal entry.
+        if not staged_by_rename(copy_from, staging):
+            raise Exception(f"{copy_from} is not available; reconnect its storage and roll back again")
+        os.rename(staging, copy_from)
+    if journal:
+        journal.finish(move.id)
+    return "Rolled back unfinished move"
+
+def toggle_symlink(source_path, target_path, progress=None, journal=None, verify=False):
+    if not os.path.lexists(source_path) and find_archive(source_path):
+        return restore_folder(source_path, progress)
+    if is_symlink(source_path):
+        link_target = Path(os.readlink(source_path))
+        if not link_target.exists():
+            os.unlink(source_path)
+            return "Moved back to internal storage"
+        kind, target = "to_internal", link_target
+    else:
+        if not target_path:
+            raise Exception("No SD card detected!")
+        if not target_path.parent.exists():
+            target_path.parent.mkdir(parents=True)
+        if os.path.lexists(target_path):
+            raise Exception(f"{target_path} already exists!")
+        kind, target = "to_target", target_path
+    with trace_span("toggle_symlink", appid=source_path.name, direction=kind):
+        if journal:
+            move = journal.begin(kind, source_path, target)
+        else:
+            move = MoveRecord(None, kind, str(source_path), str(target), "copying", 0, 0)
+        return run_move(move, journal, progress, verify)
+
+class TransferCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, label, func, total_bytes=0, on_done=None):
+        self.label = label
+        self.func = func
+        self.total_bytes = total_bytes
+        self.on_done = on_done
+        self.done_bytes = 0
+        self.current_file = ""
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def progress(self, nbytes, path=""):
+        if self.cancel_event.is_set():
+            raise TransferCancelled()
+        with self.lock:
+            self.done_bytes += nbytes
+            self.current_file = path
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def fraction(self):
+        if not self.total_bytes:
+            return None
+        return min(self.done_bytes / self.total_bytes, 1.0)
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return self.done_bytes / elapsed if elapsed > 0 else 0
+
+    def eta(self):
+        rate = self.rate()
+        if not rate or not self.total_bytes:
+            return None
+        return max(self.total_bytes - self.done_bytes, 0) / rate
+
+    def run(self):
+        self.state = "running"
+        self.started = time.monotonic()
+        try:
+            self.result = self.func(self)
+            self.state = "done"
+        except TransferCancelled:
+            self.state = "cancelled"
+        except Exception as e:
+            self.error = e
+            self.state = "failed"
+        self.finished = time.monotonic()
+
+class JobQueue:
+    # Jobs run in submission order. The GUI polls running jobs for progress and
+    # gets on_done(job) from the worker thread once a job has finished.
+    def __init__(self, workers=JOB_WORKERS):
+        self.queue = queue.Queue()
+        self.jobs = []
+        self.lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs.append(job)
+        self.queue.put(job)
+        return job
+
+    def pending(self):
+        with self.lock:
+            return [job for job in self.jobs if job.state in ("queued", "running")]
+
+    def cancel_all(self):
+        for job in self.pending():
+            job.cancel()
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job.cancel_event.is_set():
+                job.state = "cancelled"
+            else:
+                job.run()
+            with self.lock:
+                self.jobs.remove(job)
+            if job.on_done:
+                job.on_done(job)
+
+def benchmark_transfer(source, target_dir):
+    # Moves two scratch copies of source into target_dir, one with shutil.move and
+    # one with the copy engine, and reports the throughput of each.
+    source = Path(source)
+    target_dir = Path(target_dir)
+    scratch = source.parent / ".sddm-bench"
+    results = {}
+    for name in ("shutil.move", "copy engine"):
+        sample = scratch / name.replace(" ", "-")
+        target = target_dir / f".sddm-bench-{name.replace(' ', '-')}"
+        shutil.rmtree(sample, ignore_errors=True)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, sample, symlinks=True)
+        os.sync()
+        start = time.monotonic()
+        if name == "shutil.move":
+            shutil.move(str(sample), str(target))
+        else:
+            transfer_tree(sample, target)
+            if sample.exists():
+                shutil.rmtree(sample)
+        os.sync()
+        seconds = time.monotonic() - start
+        moved = scan_tree(target)[0]
+        results[name] = TransferStats(moved.apparent, moved.files, seconds)
+        shutil.rmtree(target)
+    shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+def trash_dir_for(path):
+    # The trash lives in the steamapps folder that holds the compatdata or
+    # shadercache folder, so the rename never crosses a filesystem boundary.
+    trash_root = path.parent.parent
+    try:
+        if os.stat(trash_root).st_dev != os.lstat(path).st_dev:
+            trash_root = path.parent
+    except OSError:
+        trash_root = path.parent
+    return trash_root / TRASH_DIRNAME
+
+def trash_tree(path):
+    trash_dir = trash_dir_for(path)
+    trash_dir.mkdir(exist_ok=True)
+    trashed = trash_dir / f"{path.name}-{time.time_ns()}"
+    os.rename(path, trashed)
+    get_reclaimer().submit(trashed)
+    return trashed
+
+def get_trash_roots():
+    roots = {}
+    for root in [COMPATDATA_PATH.parent] + get_steam_library_paths():
+        trash_dir = root / TRASH_DIRNAME
+        if trash_dir.exists():
+            roots.setdefault(os.path.realpath(trash_dir), trash_dir)
+    return list(roots.values())
+
+def unlink_files(paths):
+    freed = 0
+    for path in paths:
+        try:
+            st = os.lstat(path)
+            os.unlink(path)
+        except OSError:
+            continue
+        if st.st_nlink == 1:
+            freed += st.st_blocks * 512
+    return freed
+
+def reclaim_tree(path, workers=RECLAIM_WORKERS):
+    # Unlinks each directory's files as one task on a thread pool, then removes
+    # the emptied directories deepest first. Returns the bytes actually freed.
+    scheduler = get_io_scheduler(path)
+    freed = 0
+    directories = []
+
+    def unlink_scheduled(files):
+        with scheduler.slot():
+            return unlink_files(files)
+
+    stack = [str(path)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        while stack:
+            dirpath = stack.pop()
+            directories.append(dirpath)
+            files = []
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            files.append(entry.path)
+            except OSError:
+                continue
+            if files:
+                futures.append(pool.submit(unlink_scheduled, files))
+        for future in futures:
+            freed += future.result()
+    for dirpath in reversed(directories):
+        try:
+            freed += os.lstat(dirpath).st_blocks * 512
+            os.rmdir(dirpath)
+        except OSError:
+            pass
+    return freed
+
+class TrashReclaimer:
+    # Deletes trashed folders in the background. Everything in a trash folder is
+    # already unreachable, so after a restart resume() just queues it again.
+    def __init__(self, workers=RECLAIM_WORKERS):
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.freed_bytes = 0
+        self.listeners = []
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, path):
+        with self.lock:
+            if str(path) in self.queued:
+                return
+            self.queued.add(str(path))
+        self.queue.put(path)
+
+    def resume(self, trash_dirs=None):
+        for trash_dir in trash_dirs if trash_dirs is not None else get_trash_roots():
+            try:
+                entries = list(os.scandir(trash_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                self.submit(Path(entry.path))
+
+    def pending(self):
+        with self.lock:
+            return len(self.queued)
+
+    def wait(self):
+        self.queue.join()
+
+    def _worker(self):
+        while True:
+            path = self.queue.get()
+            with trace_span("reclaim", appid=re.match(r"\d*", Path(path).name).group() or Path(path).name, path=str(path)) as span:
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        freed = reclaim_tree(path, self.workers)
+                    else:
+                        freed = unlink_files([path])
+                except Exception as e:
+                    print(f"Failed to reclaim {path}: {e}")
+                    freed = 0
+                span["bytes"] = freed
+            with self.lock:
+                self.queued.discard(str(path))
+                self.freed_bytes += freed
+                listeners = list(self.listeners)
+            for listener in listeners:
+                listener(path, freed)
+            self.queue.task_done()
+
+_reclaimer = None
+_reclaimer_lock = threading.Lock()
+
+def get_reclaimer():
+    global _reclaimer
+    with _reclaimer_lock:
+        if _reclaimer is None:
+            _reclaimer = TrashReclaimer()
+        return _reclaimer
+
+def delete_folder(path):
+    # The folder is renamed into the trash right away and deleted in the background.
+    with trace_span("delete_folder", appid=path.name):
+        if is_symlink(path):
+            link_target = Path(os.readlink(path))
+            remove_hash_manifest(link_target)
+            if not link_target.exists():
+                os.unlink(path)
+                return "Dangling symlink removed"
+            trash_tree(link_target)
+            os.unlink(path)
+            return "Symlink and target folder deleted"
+        elif path.exists():
+            trash_tree(path)
+            remove_hash_manifest(path)
+            return "Folder deleted"
+        return "Nothing to delete"
+
+# Cold storage. A prefix or shader cache can be packed into a .tar.xz on the
+# microSD card and unpacked again on demand. Compression runs on a thread pool:
+# the tar stream is cut into blocks that are compressed as independent xz
+# streams, which xz and lzma.open read back as one file.
+
+ArchiveStats = namedtuple("ArchiveStats", "raw_bytes compressed_bytes files seconds")
+EXTRACT_ARGS = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+
+class ParallelCompressor:
+    # Write-only file object for tarfile. Blocks are written in order, and at most
+    # two per worker are in flight so memory use stays bounded.
+    def __init__(self, fileobj, workers=ARCHIVE_WORKERS, preset=ARCHIVE_PRESET):
+        self.fileobj = fileobj
+        self.preset = preset
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = workers * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.blocks = []
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.raw_bytes += len(data)
+        while len(self.buffer) >= ARCHIVE_BLOCK:
+            self.submit(bytes(self.buffer[:ARCHIVE_BLOCK]))
+            del self.buffer[:ARCHIVE_BLOCK]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(lzma.compress, block, preset=self.preset))
+        while len(self.pending) > self.max_pending:
+            self.write_block()
+
+    def write_block(self):
+        data = self.pending.popleft().result()
+        self.fileobj.write(data)
+        self.blocks.append(len(data))
+        self.compressed_bytes += len(data)
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.write_block()
+        self.pool.shutdown()
+
+    def abort(self):
+        self.pool.shutdown(cancel_futures=True)
+
+class ParallelDecompressor:
+    # Read-only file object for tarfile. With the block sizes recorded in the
+    # archive manifest the xz streams are decompressed in parallel and handed on
+    # in order; without them the archive is read as one ordinary .tar.xz.
+    def __init__(self, fileobj, blocks=None, workers=ARCHIVE_WORKERS):
+        self.fileobj = fileobj
+        self.stream = None if blocks else lzma.LZMAFile(fileobj)
+        self.blocks = iter(blocks or [])
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = workers * 2
+        self.pending = deque()
+        self.block = b""
+        self.offset = 0
+
+    def read(self, size=-1):
+        if self.stream:
+            return self.stream.read(size)
+        parts = []
+        while size < 0 or size > 0:
+            if self.offset == len(self.block):
+                while len(self.pending) < self.max_pending:
+                    block_size = next(self.blocks, None)
+                    if block_size is None:
+                        break
+                    self.pending.append(self.pool.submit(lzma.decompress, self.fileobj.read(block_size)))
+                if not self.pending:
+                    break
+                self.block, self.offset = self.pending.popleft().result(), 0
+            end = len(self.block) if size < 0 else min(self.offset + size, len(self.block))
+            parts.append(self.block[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b"".join(parts)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+def archive_path_for(path, library):
+    return library / ARCHIVE_DIRNAME / path.parent.name / f"{path.name}.tar.xz"
+
+def find_archive(path):
+    for library in get_steam_library_paths() + [INTERNAL_LIBRARY]:
+        archive = archive_path_for(path, library)
+        if archive.exists():
+            return archive
+    return None
+
+def archived_appids(kind_dir):
+    appids = set()
+    for library in get_steam_library_paths() + [INTERNAL_LIBRARY]:
+        try:
+            names = os.listdir(library / ARCHIVE_DIRNAME / kind_dir)
+        except OSError:
+            continue
+        appids.update(name[:-len(".tar.xz")] for name in names if name.endswith(".tar.xz"))
+    return appids
+
+def read_archive_manifest(archive):
+    try:
+        with open(f"{archive}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def archived_size(path):
+    # Uncompressed bytes of path's archive, which is what restore_folder reports progress in.
+    archive = find_archive(path)
+    return read_archive_manifest(archive).get("raw_bytes", 0) if archive else 0
+
+def format_archive_stats(verb, stats):
+    ratio = stats.raw_bytes / stats.compressed_bytes if stats.compressed_bytes else 0
+    rate = stats.raw_bytes / stats.seconds if stats.seconds else 0
+    return (f"{verb} {stats.files} files, {format_size(stats.raw_bytes)} as {format_size(stats.compressed_bytes)} "
+            f"({ratio:.1f}x) at {format_size(rate)}/s")
+
+def archive_folder(path, progress=None, workers=ARCHIVE_WORKERS, preset=ARCHIVE_PRESET):
+    # The archive is written under a temporary name and renamed into place once it
+    # is complete and synced; only then is the original folder trashed.
+    source = Path(os.readlink(path)) if is_symlink(path) else path
+    if not source.exists():
+        raise Exception(f"{path} does not exist!")
+    microsd_path = get_microsd_path()
+    if not microsd_path:
+        raise Exception("No SD card detected!")
+    archive = archive_path_for(path, microsd_path)
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    staging = partial_path(archive)
+    start = time.monotonic()
+    files = 0
+
+    def add_member(member):
+        nonlocal files
+        if progress:
+            progress(member.size if member.isfile() else 0, member.name)
+        files += member.isfile()
+        return member
+
+    with trace_span("archive", appid=path.name) as span:
+        with open(staging, "wb") as f:
+            compressor = ParallelCompressor(f, workers, preset)
+            try:
+                with tarfile.open(fileobj=compressor, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    tar.add(source, arcname=path.name, filter=add_member)
+                compressor.close()
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                compressor.abort()
+                staging.unlink()
+                raise
+        stats = ArchiveStats(compressor.raw_bytes, compressor.compressed_bytes, files, time.monotonic() - start)
+        manifest = {"source": str(path), "created": int(time.time()), "raw_bytes": stats.raw_bytes,
+                    "compressed_bytes": stats.compressed_bytes, "files": files, "blocks": compressor.blocks}
+        with open(f"{staging}.json", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{staging}.json", f"{archive}.json")
+        os.replace(staging, archive)
+        if is_symlink(path):
+            trash_tree(source)
+            os.unlink(path)
+        else:
+            trash_tree(path)
+        remove_hash_manifest(source)
+        span.update(bytes=stats.raw_bytes, files=files)
+    return format_archive_stats("Archived", stats)
+
+def restore_folder(path, progress=None, workers=ARCHIVE_WORKERS):
+    # Streams the archive back through a staging folder next to path, so a failed
+    # restore never leaves a half-filled prefix behind. The archive goes once the
+    # folder is back in place.
+    archive = find_archive(path)
+    if not archive:
+        raise Exception(f"No archive found for {path}")
+    if os.path.lexists(path):
+        raise Exception(f"{path} already exists!")
+    manifest = read_archive_manifest(archive)
+    staging = partial_path(path)
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    start = time.monotonic()
+    files = 0
+
+    def members(tar):
+        nonlocal files
+        for member in tar:
+            if progress:
+                progress(member.size if member.isfile() else 0, member.name)
+            files += member.isfile()
+            yield member
+
+    with trace_span("restore", appid=path.name) as span:
+        try:
+            with open(archive, "rb") as f:
+                reader = ParallelDecompressor(f, manifest.get("blocks"), workers)
+                try:
+                    with tarfile.open(fileobj=reader, mode="r|") as tar:
+                        tar.extractall(staging, members(tar), **EXTRACT_ARGS)
+                finally:
+                    reader.close()
+            os.rename(staging / path.name, path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        stats = ArchiveStats(manifest.get("raw_bytes", 0), os.path.getsize(archive), files, time.monotonic() - start)
+        os.unlink(archive)
+        if os.path.exists(f"{archive}.json"):
+            os.unlink(f"{archive}.json")
+        span.update(bytes=stats.raw_bytes, files=files)
+    return format_archive_stats("Restored", stats)
+
+def get_valid_app_folders():
+    app_folders = {}
+    installed_apps = get_manifest_index()
+    for folder in COMPATDATA_PATH.iterdir():
+        if folder.is_dir() and folder.name in installed_apps:
+            appid = folder.name
+            if appid not in app_folders:
+                app_folders[appid] = folder
+    # Archived prefixes keep their row so they can be restored from the list.
+    for appid in archived_appids(COMPATDATA_PATH.name):
+        if appid in installed_apps:
+            app_folders.setdefault(appid, COMPATDATA_PATH / appid)
+    return app_folders
+
+# Deduplication. Identical files in the prefixes on one device are found by
+# size first, then by a content hash cached per inode, and made to share their data.
+
+FIDEDUPERANGE = 0xC0189436
+FILE_DEDUPE_RANGE_DIFFERS = 1
+DEDUPE_RANGE_HEADER = struct.Struct("QQHHI")
+DEDUPE_RANGE_INFO = struct.Struct("qQQiI")
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.EXDEV, errno.ENOSYS)
+
+DedupStats = namedtuple("DedupStats", "files hashed_bytes duplicates saved_bytes skipped seconds")
+
+def get_dedup_links(path):
+    # Hardlinks made by dedup_prefixes are split when a tree is copied to another
+    # device, so the copy ends up with independent files as it had before dedup.
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return set()
+    cache = open_size_cache()
+    if not cache:
+        return set()
+    with contextlib.closing(cache):
+        return cache.load_dedup_links(dev)
+
+def walk_dedup_candidates(roots, min_size):
+    # Regular files of at least min_size grouped by device and size. Each inode is
+    # listed once, so files that already share their data are not counted again.
+    by_size = {}
+    seen = set()
+    for root in roots:
+        stack = [os.path.realpath(root)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(entry.path)
+                elif stat.S_ISREG(st.st_mode) and st.st_size >= min_size and (st.st_dev, st.st_ino) not in seen:
+                    seen.add((st.st_dev, st.st_ino))
+                    by_size.setdefault((st.st_dev, st.st_size), []).append((entry.path, st))
+    return by_size
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+def hash_candidates(groups, cache=None, workers=DEDUP_WORKERS):
+    # Digests are cached by inode, size and mtime, so a re-run only reads files
+    # that changed since the last one. hashlib drops the GIL while hashing, so
+    # several files are read and hashed in parallel.
+    cached = {}
+    digests = []
+    to_hash = []
+    for files in groups:
+        for path, st in files:
+            if cache and st.st_dev not in cached:
+                cached[st.st_dev] = cache.load_hashes(st.st_dev)
+            hit = cached.get(st.st_dev, {}).get(st.st_ino)
+            if hit and hit[:2] == (st.st_size, st.st_mtime_ns):
+                digests.append((path, st, hit[2]))
+            else:
+                to_hash.append((path, st))
+    fresh = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(hash_file, path): (path, st) for path, st in to_hash}
+        for future in as_completed(futures):
+            path, st = futures[future]
+            try:
+                digest = future.result()
+            except OSError:
+                continue
+            digests.append((path, st, digest))
+            fresh.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest))
+    if cache and fresh:
+        cache.save_hashes(fresh)
+    return digests, sum(st.st_size for _, st in to_hash)
+
+def dedupe_range(src_path, dst_path, size):
+    # FIDEDUPERANGE makes the kernel compare both files and share the extents only
+    # if they are still identical, so a file that changed after hashing is left alone.
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        try:
+            dst_fd = os.open(dst_path, os.O_RDWR)
+        except PermissionError:
+            dst_fd = os.open(dst_path, os.O_RDONLY)
+        try:
+            offset = 0
+            while offset < size:
+                length = min(DEDUP_RANGE_CHUNK, size - offset)
+                request = bytearray(DEDUPE_RANGE_HEADER.pack(offset, length, 1, 0, 0) + DEDUPE_RANGE_INFO.pack(dst_fd, offset, 0, 0, 0))
+                fcntl.ioctl(src_fd, FIDEDUPERANGE, request)
+                _, _, deduped, status, _ = DEDUPE_RANGE_INFO.unpack_from(request, DEDUPE_RANGE_HEADER.size)
+                if status < 0:
+                    raise OSError(-status, os.strerror(-status), dst_path)
+                if status == FILE_DEDUPE_RANGE_DIFFERS or not deduped:
+                    return False
+                offset += deduped
+            return True
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+def unchanged(path, st):
+    current = os.lstat(path)
+    return (current.st_ino, current.st_size, current.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def hardlink_duplicate(keeper, keeper_st, path, st):
+    # The duplicate is swapped for the link with one rename, so it never goes missing.
+    if not (unchanged(keeper, keeper_st) and unchanged(path, st)):
+        return False
+    link_path = path + ".sddm-link"
+    os.link(keeper, link_path)
+    try:
+        os.replace(link_path, path)
+    except OSError:
+        os.unlink(link_path)
+        raise
+    return True
+
+def dedup_prefixes(roots, apply=False, hardlinks=False, min_size=DEDUP_MIN_SIZE, cache=None, workers=DEDUP_WORKERS):
+    # Without apply this only reports what could be saved. Reflinks (btrfs, XFS)
+    # keep every file independent: a later write only unshares the blocks it
+    # touches. Hardlinks also work on ext4 but make a write through one prefix
+    # show up in all of them, so they are only used when asked for.
+    start = time.monotonic()
+    by_size = walk_dedup_candidates(roots, min_size)
+    digests, hashed_bytes = hash_candidates([files for files in by_size.values() if len(files) > 1], cache, workers)
+    by_digest = {}
+    for path, st, digest in digests:
+        by_digest.setdefault((st.st_dev, st.st_size, digest), []).append((path, st))
+    reflinks = {}
+    links = []
+    duplicates = saved_bytes = skipped = 0
+    for files in by_digest.values():
+        if len(files) < 2:
+            continue
+        (keeper, keeper_st), *others = sorted(files)
+        for path, st in others:
+            done = not apply
+            try:
+                if not done and reflinks.get(st.st_dev, True):
+                    try:
+                        done = dedupe_range(keeper, path, st.st_size)
+                        reflinks[st.st_dev] = True
+                    except OSError as e:
+                        if e.errno not in REFLINK_UNSUPPORTED:
+                            raise
+                        reflinks[st.st_dev] = False
+                if not done and hardlinks and not reflinks[st.st_dev]:
+                    done = hardlink_duplicate(keeper, keeper_st, path, st)
+                    if done:
+                        links.append((st.st_dev, keeper_st.st_ino))
+            except OSError as e:
+                print(f"Skipping {path}: {e}")
+            if done:
+                duplicates += 1
+                saved_bytes += st.st_blocks * 512
+            elif apply and not reflinks.get(st.st_dev, True) and not hardlinks:
+                skipped += 1
+    if links and cache:
+        cache.add_dedup_links(links)
+    return DedupStats(sum(map(len, by_size.values())), hashed_bytes, duplicates, saved_bytes, skipped, time.monotonic() - start)
+
+# Orphans: folders get_valid_app_folders skips because no appmanifest claims
+# them, and symlinks whose microSD target is gone. Non-Steam shortcuts get
+# appids of 2^31 and up and never have a manifest, so they are left alone, as is
+# compatdata/0, which Steam keeps for itself. A removed card takes its manifests
+# with it, so a link into a library that is not mounted, or of an app any
+# library still lists, is never taken for an orphan.
+
+Orphan = namedtuple("Orphan", "appid kind path reason size")
+
+def get_library_registry():
+    # libraryfolders.vdf lists every library Steam knows, mounted or not, and the
+    # appids installed in each under "apps".
+    folders = read_vdf(LIBRARY_FOLDERS_VDF).get("libraryfolders", {})
+    unmounted, registered = [], set()
+    for entry in folders.values():
+        if not isinstance(entry, dict) or "path" not in entry:
+            continue
+        if isinstance(entry.get("apps"), dict):
+            registered.update(entry["apps"])
+        if not (Path(entry["path"]) / "steamapps").exists():
+            unmounted.append(Path(entry["path"]))
+    return unmounted, registered
+
+def find_orphans():
+    unmounted, registered = get_library_registry()
+    installed = registered | set(get_manifest_index())
+    roots = [("prefix", COMPATDATA_PATH), ("shader", SHADERCACHE_PATH)]
+    for library in get_steam_library_paths():
+        roots += [("prefix", library / "compatdata"), ("shader", library / "shadercache")]
+    orphans = []
+    seen = set()
+    for kind, root in roots:
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.name.isdigit() or not 0 < int(entry.name) < ORPHAN_MAX_APPID:
+                continue
+            # Internal roots come first, so the target of an orphaned symlink is
+            # reported once, through the link.
+            real = os.path.realpath(entry.path)
+            if real in seen:
+                continue
+            if entry.is_symlink():
+                if not os.path.exists(entry.path):
+                    target = Path(os.path.normpath(os.path.join(root, os.readlink(entry.path))))
+                    if entry.name in installed or any(target.is_relative_to(library) for library in unmounted):
+                        continue
+                    reason = "dangling symlink"
+                elif entry.name not in installed:
+                    reason = "uninstalled"
+                else:
+                    continue
+            elif entry.is_dir(follow_symlinks=False) and entry.name not in installed:
+                reason = "uninstalled"
+            else:
+                continue
+            seen.add(real)
+            orphans.append(Orphan(entry.name, kind, Path(entry.path), reason, EMPTY_TREE))
+    return orphans
+
+def size_orphans(orphans, workers=SCAN_WORKERS):
+    # Same parallel walk as scan_apps; results are yielded as they finish.
+    def size_one(orphan):
+        with trace_span("scan_orphan", appid=orphan.appid):
+            return orphan._replace(size=scan_tree(orphan.path)[0] if orphan.path.exists() else EMPTY_TREE)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(size_one, orphan) for orphan in orphans]
+        for future in as_completed(futures):
+            yield future.result()
+
+def orphan_job(orphan):
+    label = f"Delete {orphan.reason} {orphan.kind} {orphan.appid}"
+    return Job(label, lambda job: delete_folder(orphan.path))
+
+# Shader cache breakdown. shadercache/<appid> mixes caches with very different
+# value: Fossilize pipeline archives (fozpipelinesv*) and DXVK/VKD3D state
+# caches let the driver rebuild everything, while Mesa's compiled blobs are only
+# its output and are rebuilt from those. Pruning therefore only touches Mesa
+# data that has not been used for a while.
+
+SHADER_COMPONENTS = {"fossilize": "Fossilize", "dxvk": "DXVK", "vkd3d": "VKD3D", "mesa": "Mesa", "other": "Other"}
+SHADER_AGE_LABELS = ("< 7 days", "< 30 days", "< 90 days", "older")
+ShaderComponent = namedtuple("ShaderComponent", "bytes files newest ages")
+
+def shader_component(rel):
+    top = rel.split(os.sep, 1)[0].lower()
+    if top.startswith(("fozpipelines", "fozmedia")):
+        return "fossilize"
+    if top.startswith("dxvk") or top.endswith(".dxvk-cache"):
+        return "dxvk"
+    if top.startswith("vkd3d"):
+        return "vkd3d"
+    if top.startswith("mesa_shader_cache"):
+        return "mesa"
+    return "other"
+
+def last_used(st):
+    # Mesa touches atime when it loads a blob; mtime covers noatime mounts.
+    return max(st.st_atime, st.st_mtime)
+
+def walk_shader_cache(path):
+    root = os.path.realpath(path)
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            file_path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(file_path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield os.path.relpath(file_path, root), file_path, st
+
+def analyze_shader_cache(path, now=None):
+    now = now or time.time()
+    totals = {}
+    for rel, _, st in walk_shader_cache(path):
+        component = shader_component(rel)
+        size, files, newest, ages = totals.get(component) or (0, 0, 0, [0] * len(SHADER_AGE_LABELS))
+        ages[bisect.bisect_right(SHADER_AGE_DAYS, (now - last_used(st)) / 86400)] += st.st_size
+        totals[component] = (size + st.st_size, files + 1, max(newest, last_used(st)), ages)
+    return {component: ShaderComponent(*values) for component, values in totals.items()}
+
+def analyze_shader_caches(appids, stale_days=SHADER_STALE_DAYS, workers=SCAN_WORKERS):
+    # Yields (appid, {component: ShaderComponent}, prunable bytes) as each cache is walked.
+    def analyze(appid):
+        path = SHADERCACHE_PATH / appid
+        with trace_span("analyze_shader", appid=appid):
+            return appid, analyze_shader_cache(path), prune_shader_cache(path, stale_days, dry_run=True)[1]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze, appid) for appid in appids if os.path.exists(SHADERCACHE_PATH / appid)]
+        for future in as_completed(futures):
+            yield future.result()
+
+def prune_shader_cache(path, stale_days=SHADER_STALE_DAYS, dry_run=False, now=None):
+    # Mesa's multi-file cache (mesa_shader_cache) holds one blob per file, so
+    # stale files go one by one; its index is only a size estimate Mesa fixes up
+    # itself. The single-file caches (mesa_shader_cache_sf, _db) keep many blobs
+    # in one database, so such a directory only goes once all of it is stale.
+    now = now or time.time()
+    cutoff = now - stale_days * 86400
+    units = {}
+    for rel, file_path, st in walk_shader_cache(path):
+        parts = rel.split(os.sep)
+        if shader_component(rel) != "mesa" or len(parts) == 1:
+            continue
+        if parts[0].lower() != "mesa_shader_cache":
+            units.setdefault(os.path.dirname(file_path), []).append((file_path, st))
+        elif parts[-1] != "index":
+            units[file_path] = [(file_path, st)]
+    pruned_files = pruned_bytes = 0
+    for unit, files in units.items():
+        if any(last_used(st) > cutoff for _, st in files):
+            continue
+        for file_path, st in files:
+            if not dry_run:
+                try:
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    continue
+            pruned_files += 1
+            pruned_bytes += st.st_size
+        if not dry_run and unit != files[0][0]:
+            with contextlib.suppress(OSError):
+                os.rmdir(unit)
+    return pruned_files, pruned_bytes
+
+# Space planner. Picks the prefix and shader cache moves that free the
+# requested amount of internal storage while copying as few bytes as possible.
+
+PlanItem = namedtuple("PlanItem", "appid kind path apparent allocated last_played library")
+SpacePlan = namedtuple("SpacePlan", "moves copy_bytes freed_bytes need internal_free sd_free sd_reserve")
+
+def parse_size(text):
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"invalid size: {text}")
+    return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2).upper() or " "))
+
+def plan_candidates(sizes):
+    # sizes maps appid -> (prefix TreeSize, shader TreeSize). Only folders that
+    # are still on internal storage can be moved off it.
+    manifests = get_manifest_index()
+    candidates = []
+    for appid, (prefix, shader) in sizes.items():
+        manifest = manifests.get(appid)
+        last_played = manifest.last_played if manifest else 0
+        for kind, path, tree in (("prefix", COMPATDATA_PATH / appid, prefix), ("shader", SHADERCACHE_PATH / appid, shader)):
+            if tree.allocated and get_path_state(path)[0] == "Internal":
+                candidates.append(PlanItem(appid, kind, path, tree.apparent, tree.allocated, last_played, None))
+    return candidates
+
+def plan_cost(item, weight_recent, now):
+    # Bytes copied, optionally inflated for games played in the last PLAN_RECENT_DAYS
+    # so the solver prefers to move games that have not been touched in a while.
+    if not weight_recent or not item.last_played:
+        return item.apparent
+    age_days = max(now - item.last_played, 0) / 86400
+    return item.apparent * (1 + PLAN_RECENT_WEIGHT * max(1 - age_days / PLAN_RECENT_DAYS, 0))
+
+def solve_space_plan(candidates, need, capacity, weight_recent=False):
+    # Min-cost knapsack cover over the freed bytes, bucketed into at most
+    # PLAN_BUCKETS steps. Sizes are rounded up so the microSD capacity is never
+    # exceeded. Without a target (need is None) as much as fits is freed.
+    # An optimal cover overshoots the target by less than its largest item, so the
+    # table only has to reach need + the largest item.
+    candidates = [item for item in candidates if item.allocated <= capacity]
+    if need is not None and need <= 0:
+        return []
+    if not candidates:
+        return [] if need is None else None
+    limit = capacity if need is None else min(capacity, need + max(item.allocated for item in candidates))
+    bucket = max(-(-limit // PLAN_BUCKETS), 1)
+    slots = limit // bucket + 1
+    now = time.time()
+    inf = float("inf")
+    costs = [0.0] + [inf] * (slots - 1)
+    taken = []
+    for item in candidates:
+        # Each item is folded into the table with whole-list operations so the
+        # inner loop runs in C; hundreds of apps take a fraction of a second.
+        width = -(-item.allocated // bucket)
+        cost = plan_cost(item, weight_recent, now)
+        shifted = [inf] * width + [value + cost for value in costs[:slots - width]]
+        taken.append(bytes(map(operator.lt, shifted, costs)))
+        costs = [old if old <= new else new for old, new in zip(costs, shifted)]
+
+    def pick(slot):
+        chosen = []
+        for index in range(len(candidates) - 1, -1, -1):
+            if taken[index][slot]:
+                chosen.append(candidates[index])
+                slot -= -(-candidates[index].allocated // bucket)
+        return chosen[::-1]
+
+    reachable = [slot for slot in range(slots) if costs[slot] < inf]
+    if need is None:
+        return pick(max(reachable))
+    # Rounding can make a slot look bigger than its items, so the real sum is checked.
+    for slot in sorted((slot for slot in reachable if slot * bucket >= need), key=costs.__getitem__):
+        chosen = pick(slot)
+        if sum(item.allocated for item in chosen) >= need:
+            return chosen
+    return None
+
+def plan_space(sizes, free_bytes=None, sd_reserve=0, weight_recent=False):
+    # free_bytes is how much internal space to free; without it the plan fills
+    # every external library down to sd_reserve. moves is None when the goal
+    # cannot be met. Libraries are filled in the order choose_target prefers
+    # them: the first one that can cover what is left of the goal on its own
+    # gets the cheapest cover, the ones before it are filled as far as they go.
+    targets = get_library_targets()
+    if not targets:
+        raise FileNotFoundError("No SD card detected in Steam library")
+    internal_free = shutil.disk_usage(COMPATDATA_PATH).free
+    candidates = plan_candidates(sizes)
+    moves, need = [], free_bytes
+    for target in rank_targets(targets):
+        capacity = max(target.free - sd_reserve, 0)
+        chosen = solve_space_plan(candidates, need, capacity, weight_recent)
+        if chosen is None:
+            chosen = solve_space_plan(candidates, None, capacity, weight_recent)
+        moves += [item._replace(library=target.library) for item in chosen]
+        taken = {(item.appid, item.kind) for item in chosen}
+        candidates = [item for item in candidates if (item.appid, item.kind) not in taken]
+        if need is not None:
+            need -= sum(item.allocated for item in chosen)
+            if need <= 0:
+                break
+    if need is not None and need > 0:
+        moves = None
+    return SpacePlan(moves, sum(item.apparent for item in moves or []), sum(item.allocated for item in moves or []),
+                     free_bytes, internal_free, sum(target.free for target in targets), sd_reserve)
+
+def plan_job(item, journal=None):
+    target_path = get_library_dir(item.library, item.kind) / item.appid
+    label = f"Move {item.kind} {get_game_name(item.appid)} ({item.appid}) to {get_device_label(item.library)}"
+    return Job(label, lambda job: toggle_symlink(item.path, target_path, job.progress, journal), item.apparent)
+
+# Storage tiering. The most recently played games keep their prefixes and shader
+# caches on internal storage and the rest live on microSD. Recency comes from
+# LastPlayed, or LastUpdated for games that were installed but never started.
+
+TierMove = namedtuple("TierMove", "appid kind path direction bytes recency library")
+TierPlan = namedtuple("TierPlan", "moves kept internal_free sd_free skipped")
+DeviceSpeed = namedtuple("DeviceSpeed", "seq_read random_iops measured")
+
+def measure_device_speed(library, size=SPEED_TEST_SIZE):
+    # Writes a scratch file and reads it back, first sequentially and then in
+    # SPEED_TEST_READS random 4 KiB blocks. O_DIRECT keeps the page cache out of
+    # the measurement; filesystems without it get the cache dropped instead.
+    path = Path(library) / ".sddm-speedtest"
+    buffer = mmap.mmap(-1, SPEED_TEST_BLOCK)
+    buffer.write(os.urandom(SPEED_TEST_BLOCK))
+    view = memoryview(buffer)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            for _ in range(size // SPEED_TEST_BLOCK):
+                os.write(fd, view)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECT", 0))
+        except OSError:
+            fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            start = time.perf_counter()
+            while os.readv(fd, [view]):
+                pass
+            seq_read = size / (time.perf_counter() - start)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            rng = random.Random(0)
+            start = time.perf_counter()
+            for _ in range(SPEED_TEST_READS):
+                os.preadv(fd, [view[:4096]], rng.randrange(size // 4096) * 4096)
+            random_iops = SPEED_TEST_READS / (time.perf_counter() - start)
+        finally:
+            os.close(fd)
+    finally:
+        view.release()
+        buffer.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return DeviceSpeed(seq_read, random_iops, time.time())
+
+def load_device_speeds():
+    try:
+        with open(DEVICE_SPEEDS) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_device_speeds(refresh=False):
+    # Measurements are cached per library and redone when the library is on
+    # another device than before (a different card) or the result is old.
+    cached = load_device_speeds()
+    speeds = {}
+    for library in [INTERNAL_LIBRARY] + get_steam_library_paths():
+        entry = cached.get(str(library))
+        dev = device_of(library)
+        if refresh or not entry or entry["dev"] != dev or time.time() - entry["measured"] > SPEED_TEST_MAX_AGE:
+            try:
+                speed = measure_device_speed(library)
+            except OSError as e:
+                print(f"Could not measure {library}: {e}", file=sys.stderr)
+                continue
+            entry = cached[str(library)] = dict(speed._asdict(), dev=dev)
+        speeds[library] = DeviceSpeed(entry["seq_read"], entry["random_iops"], entry["measured"])
+    DEVICE_SPEEDS.parent.mkdir(parents=True, exist_ok=True)
+    with open(DEVICE_SPEEDS, "w") as f:
+        json.dump(cached, f, indent=2)
+    return speeds
+
+def app_recency(manifest):
+    return manifest.last_played or manifest.last_updated
+
+def plan_tiering(sizes, keep, internal_min_free=0, sd_reserve=0, max_bytes=None, hysteresis=TIER_HYSTERESIS):
+    # Games ranked below keep are promoted back to internal storage and games
+    # ranked at keep + hysteresis or later are demoted, so a game hovering around
+    # the cut-off is not moved back and forth on every pass. Demotions go first,
+    # oldest first, so they free space for the promotions; a move is skipped when
+    # it would take a device below its free-space threshold or the pass over
+    # max_bytes.
+    targets = {target.library: target for target in get_library_targets()}
+    if not targets:
+        raise FileNotFoundError("No SD card detected in Steam library")
+    manifests = get_manifest_index()
+    ranked = sorted(sizes, key=lambda appid: app_recency(manifests[appid]) if appid in manifests else 0, reverse=True)
+    demotions, promotions = [], []
+    for rank, appid in enumerate(ranked):
+        recency = app_recency(manifests[appid]) if appid in manifests else 0
+        for kind, path, tree in (("prefix", COMPATDATA_PATH / appid, sizes[appid][0]),
+                                 ("shader", SHADERCACHE_PATH / appid, sizes[appid][1])):
+            state = get_path_state(path)[0]
+            if rank < keep and state == "microSD":
+                promotions.append(TierMove(appid, kind, path, "internal", tree.apparent, recency, get_library_of(path)))
+            elif rank >= keep + hysteresis and state == "Internal" and tree.apparent:
+                demotions.append(TierMove(appid, kind, path, "microSD", tree.apparent, recency, None))
+    demotions.sort(key=operator.attrgetter("recency"))
+    internal_free = shutil.disk_usage(COMPATDATA_PATH).free
+    sd_free = sum(target.free for target in targets.values())
+    budget = max_bytes if max_bytes is not None else math.inf
+    moves, skipped = [], []
+    internal_left = internal_free
+    for move in demotions + promotions:
+        target = choose_target(move.bytes, targets.values(), sd_reserve) if move.direction == "microSD" else None
+        if move.bytes > budget:
+            skipped.append((move, "over the byte budget"))
+        elif move.direction == "microSD" and (not target or target.free - move.bytes < sd_reserve):
+            skipped.append((move, "every external library would drop below its reserve"))
+        elif move.direction == "internal" and internal_left - move.bytes < internal_min_free:
+            skipped.append((move, "internal storage would drop below its minimum"))
+        else:
+            if target:
+                move = move._replace(library=target.library)
+                targets[target.library] = target._replace(free=target.free - move.bytes)
+                internal_left += move.bytes
+            else:
+                internal_left -= move.bytes
+                if move.library in targets:
+                    targets[move.library] = targets[move.library]._replace(free=targets[move.library].free + move.bytes)
+            moves.append(move)
+            budget -= move.bytes
+    return TierPlan(moves, ranked[:keep], internal_free, sd_free, skipped)
+
+def tier_job(move, journal=None):
+    target_path = get_library_dir(move.library, move.kind) / move.appid if move.direction == "microSD" else None
+    label = f"Move {move.kind} {get_game_name(move.appid)} ({move.appid}) to {move.direction}"
+    return Job(label, lambda job: toggle_symlink(move.path, target_path, job.progress, journal), move.bytes)
+
+# Live updates. The kernel reports changes through inotify; ctypes is used so
+# no extra package is needed.
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+TREE_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+TOP_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+LIBRARY_EVENTS = TOP_EVENTS | IN_CLOSE_WRITE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), str(path))
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        events = []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return events
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+def get_watch_budget():
+    # Steam and other programs need watches too, so only part of the per-user limit is used.
+    try:
+        with open("/proc/sys/fs/inotify/max_user_watches") as f:
+            return int(int(f.read()) * WATCH_BUDGET_FRACTION)
+    except (OSError, ValueError):
+        return 8192
+
+class WatchedTree:
+    def __init__(self, root, records):
+        self.root = str(root)
+        self.records = records
+        self.totals = tree_totals(records)
+        self.wds = {}
+        self.dirty = set()
+
+class TreeWatcher:
+    # Keeps prefix and shader cache sizes current without rescanning. Every
+    # directory of a watched tree has its own watch, and an event only marks that
+    # directory dirty. Once writes settle for WATCH_DEBOUNCE seconds (or after
+    # WATCH_MAX_DELAY during a long burst) the dirty directories are listed again
+    # and the totals are recomputed from the in-memory records.
+    # compatdata, shadercache and the library folders are watched as well, so
+    # installs, uninstalls, moves and new prefixes add, refresh or remove apps.
+    # on_update(appid, prefix, shader) and on_remove(appid) run on the watcher thread.
+    def __init__(self, on_update, on_remove, cache=None):
+        self.on_update = on_update
+        self.on_remove = on_remove
+        self.cache = cache
+        self.inotify = Inotify()
+        self.budget = get_watch_budget()
+        self.apps = {}
+        self.watches = {}
+        self.top_watches = {}
+        self.dirty_apps = set()
+        self.resync = set()
+        self.manifests = set()
+        self.first_event = None
+        self.last_event = None
+        self.initial_apps = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self, appids):
+        self.initial_apps = list(appids)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=2)
+
+    def run(self):
+        for path in (COMPATDATA_PATH, SHADERCACHE_PATH):
+            self.add_top_watch(path, TOP_EVENTS)
+        for lib_path in get_steam_library_paths() + [INTERNAL_LIBRARY]:
+            self.add_top_watch(lib_path, LIBRARY_EVENTS)
+        for appid in self.initial_apps:
+            self.watch_app(appid, report=False)
+        while not self.stop_event.is_set():
+            timeout = 0.5
+            if self.last_event is not None:
+                deadline = min(self.last_event + WATCH_DEBOUNCE, self.first_event + WATCH_MAX_DELAY)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    self.flush()
+                    continue
+            for wd, mask, name in self.inotify.read(timeout):
+                self.handle_event(wd, mask, name)
+        self.inotify.close()
+
+    def add_top_watch(self, path, mask):
+        try:
+            self.top_watches[self.inotify.add_watch(path, mask)] = path
+        except OSError as e:
+            print(f"Cannot watch {path}: {e}")
+
+    def add_tree_watch(self, appid, kind, tree, rel):
+        if len(self.watches) >= self.budget:
+            return
+        path = os.path.join(tree.root, rel) if rel else tree.root
+        try:
+            wd = self.inotify.add_watch(path, TREE_EVENTS | (IN_DONT_FOLLOW if rel else 0))
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # Out of watches: folders past this point only update on a rescan.
+                print(f"inotify watch limit reached after {len(self.watches)} folders")
+                self.budget = len(self.watches)
+            return
+        self.watches[wd] = (appid, kind, rel)
+        tree.wds[rel] = wd
+
+    def remove_tree_watch(self, appid, kind, tree, rel):
+        wd = tree.wds.pop(rel, None)
+        if wd is not None and self.watches.get(wd) == (appid, kind, rel):
+            del self.watches[wd]
+            self.inotify.rm_watch(wd)
+
+    def watch_tree(self, appid, kind, path, cached):
+        tree = WatchedTree(path, scan_tree(path, cached)[1])
+        for rel in tree.records:
+            self.add_tree_watch(appid, kind, tree, rel)
+        return tree
+
+    def watch_app(self, appid, report=True):
+        # (Re)builds both trees of an app. The old records are reused, so only
+        # directories that actually changed are listed again.
+        old = self.apps.pop(appid, None)
+        for kind, tree in (old or {}).items():
+            for rel in list(tree.wds) if tree else []:
+                self.remove_tree_watch(appid, kind, tree, rel)
+        if appid not in get_manifest_index():
+            if old and report:
+                self.on_remove(appid)
+            return
+        prefix_path = COMPATDATA_PATH / appid
+        if old is None and not prefix_path.is_dir():
+            return
+        trees = {}
+        for kind, path in (("prefix", prefix_path), ("shader", SHADERCACHE_PATH / appid)):
+            if old and old[kind]:
+                cached = old[kind].records
+            elif kind == "prefix" and self.cache:
+                cached = self.cache.load_tree(str(path))
+            else:
+                cached = None
+            trees[kind] = self.watch_tree(appid, kind, path, cached) if path.is_dir() else None
+        self.apps[appid] = trees
+        if report:
+            self.report(appid)
+
+    def report(self, appid):
+        trees = self.apps[appid]
+        self.on_update(appid, *[trees[kind].totals if trees[kind] else EMPTY_TREE for kind in ("prefix", "shader")])
+
+    def mark(self):
+        now = time.monotonic()
+        if self.last_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, so every watched directory is listed again.
+            for appid, trees in self.apps.items():
+                for tree in trees.values():
+                    if tree:
+                        tree.dirty.update(tree.records)
+                self.dirty_apps.add(appid)
+            self.mark()
+        elif wd in self.top_watches:
+            parent = self.top_watches[wd]
+            if parent in (COMPATDATA_PATH, SHADERCACHE_PATH):
+                if name.isdigit():
+                    self.resync.add(name)
+                    self.mark()
+            elif is_manifest_name(name):
+                self.manifests.add((parent, name))
+                self.mark()
+        elif wd in self.watches:
+            appid, kind, rel = self.watches[wd]
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                return
+            tree = self.apps.get(appid, {}).get(kind)
+            if tree:
+                tree.dirty.add(rel)
+                self.dirty_apps.add(appid)
+                self.mark()
+
+    def flush(self):
+        self.first_event = self.last_event = None
+        for lib_path, name in self.manifests:
+            self.resync.add(update_manifest_index(lib_path, name))
+        self.manifests.clear()
+        for appid in self.resync:
+            self.watch_app(appid)
+        for appid in self.dirty_apps - self.resync:
+            trees = self.apps.get(appid)
+            if trees and [self.refresh(appid, kind, tree) for kind, tree in trees.items() if tree].count(True):
+                self.report(appid)
+        self.resync.clear()
+        self.dirty_apps.clear()
+
+    def refresh(self, appid, kind, tree):
+        # Parents are listed before their children. Vanished subdirectories are
+        # dropped before new ones are walked, so a folder moved inside the tree
+        # keeps its watch under the new name.
+        dirty, tree.dirty = sorted(tree.dirty), set()
+        added = []
+        for rel in dirty:
+            if rel not in tree.records:
+                continue
+            path = os.path.join(tree.root, rel) if rel else tree.root
+            try:
+                record = scan_directory(path, os.stat(path))
+            except OSError:
+                continue
+            old_subdirs = set(tree.records[rel].subdirs)
+            tree.records[rel] = record
+            for name in old_subdirs - set(record.subdirs):
+                self.drop_subtree(appid, kind, tree, os.path.join(rel, name) if rel else name)
+            added.extend(os.path.join(rel, name) if rel else name for name in record.subdirs if name not in old_subdirs)
+        for child in added:
+            if child in tree.records:
+                continue
+            for rel, record in scan_tree(os.path.join(tree.root, child))[1].items():
+                full_rel = os.path.join(child, rel) if rel else child
+                tree.records[full_rel] = record
+                self.add_tree_watch(appid, kind, tree, full_rel)
+        totals = tree_totals(tree.records)
+        if totals == tree.totals:
+            return False
+        tree.totals = totals
+        if kind == "prefix" and self.cache:
+            self.cache.save_tree(tree.root, tree.records)
+        return True
+
+    def drop_subtree(self, appid, kind, tree, rel):
+        for child in [child for child in tree.records if child == rel or child.startswith(rel + os.sep)]:
+            del tree.records[child]
+            self.remove_tree_watch(appid, kind, tree, child)
+
+# Synthetic Steam trees and the benchmark suite that runs against them.
+
+def tiny_png():
+    # A valid 1x1 PNG so icon lookups and thumbnailing find a real image.
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"\0\0\0\0\0")) + chunk(b"IEND", b""))
+
+def write_filler(path, size, block):
+    with open(path, "wb") as f:
+        for offset in range(0, size, len(block)):
+            f.write(block[:min(len(block), size - offset)])
+
+def generate_steam_tree(home, sd_root, apps=50, dirs=20, files=10, file_size=64 * 1024, size_sigma=1.5, moved=0.25, seed=0):
+    # Builds the Steam layout the rest of the script expects under home, plus a
+    # second library at sd_root standing in for the microSD card. File sizes are
+    # log-normal around file_size; a share of the prefixes (moved) already lives on
+    # the card behind a symlink. The same seed always builds the same tree.
+    rng = random.Random(seed)
+    home, sd_root = Path(home).absolute(), Path(sd_root).absolute()
+    steam_root = home / ".local/share/Steam"
+    steamapps = steam_root / "steamapps"
+    sd_steamapps = sd_root / "steamapps"
+    for path in (steamapps / "compatdata", steamapps / "shadercache", sd_steamapps / "compatdata",
+                 steam_root / "appcache/librarycache", home / ".steam"):
+        path.mkdir(parents=True, exist_ok=True)
+    if not os.path.lexists(home / ".steam/steam"):
+        (home / ".steam/steam").symlink_to(steam_root)
+    with open(steamapps / "libraryfolders.vdf", "w") as f:
+        f.write(f'"libraryfolders"\n{{\n\t"0"\n\t{{\n\t\t"path"\t\t"{steam_root}"\n\t}}\n'
+                f'\t"1"\n\t{{\n\t\t"path"\t\t"{sd_root}"\n\t}}\n}}\n')
+    block = rng.randbytes(COPY_CHUNK)
+    icon = tiny_png()
+    now = int(time.time())
+    total_files = total_bytes = 0
+    for index in range(apps):
+        appid = str(GENERATED_FIRST_APPID + index * 10)
+        app_bytes = 0
+        prefix_root = (sd_steamapps if rng.random() < moved else steamapps) / "compatdata" / appid
+        for dir_index in range(dirs):
+            dir_path = prefix_root / "pfx/drive_c/users/steamuser" / f"dir{dir_index // 10}" / f"sub{dir_index}"
+            dir_path.mkdir(parents=True, exist_ok=True)
+            for file_index in range(files):
+                size = min(int(rng.lognormvariate(math.log(file_size), size_sigma)), file_size * 100)
+                write_filler(dir_path / f"file{file_index}.bin", size, block)
+                app_bytes += size
+        shader_path = steamapps / "shadercache" / appid / "fozpipelinesv6"
+        shader_path.mkdir(parents=True, exist_ok=True)
+        for file_index in range(max(files // 2, 1)):
+            size = min(int(rng.lognormvariate(math.log(file_size), size_sigma)), file_size * 100)
+            write_filler(shader_path / f"steamapp_pipeline_cache.{file_index}.foz", size, block)
+            app_bytes += size
+        if prefix_root.parent.parent != steamapps:
+            (steamapps / "compatdata" / appid).symlink_to(prefix_root)
+        (steam_root / "appcache/librarycache" / appid).mkdir(exist_ok=True)
+        (steam_root / "appcache/librarycache" / appid / "logo.png").write_bytes(icon)
+        with open(steamapps / f"appmanifest_{appid}.acf", "w") as f:
+            f.write(f'"AppState"\n{{\n\t"appid"\t\t"{appid}"\n\t"name"\t\t"Generated Game {index}"\n'
+                    f'\t"installdir"\t\t"Generated Game {index}"\n\t"SizeOnDisk"\t\t"{app_bytes}"\n'
+                    f'\t"LastUpdated"\t\t"{now}"\n\t"LastPlayed"\t\t"{now - rng.randrange(365 * 86400)}"\n}}\n')
+        total_files += dirs * files + max(files // 2, 1)
+        total_bytes += app_bytes
+    summary = {"apps": apps, "files": total_files, "bytes": total_bytes, "seed": seed}
+    with open(home / GENERATED_MARKER, "w") as f:
+        json.dump(summary, f)
+    return summary
+
+def time_best(func, repeat):
+    # Best of several runs; the minimum is the least noisy estimate of the cost.
+    best = result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run_benchmarks(repeat=3, moves=3):
+    # Times discovery, name and icon lookups, cold and cached scans and sorting
+    # against the current home. Moves only run on a tree built by gen-tree,
+    # since they toggle real prefixes to the card and back.
+    timings = {}
+    throughput = {}
+
+    def discover():
+        get_steam_library_paths(refresh=True)
+        get_manifest_index(refresh=True)
+        return get_valid_app_folders()
+
+    timings["discovery"], app_folders = time_best(discover, repeat)
+    timings["game_names"], _ = time_best(lambda: [get_game_name(appid) for appid in app_folders], repeat)
+    timings["icon_lookup"], _ = time_best(lambda: [find_icon_source(appid) for appid in app_folders], repeat)
+    timings["scan"], scanned = time_best(lambda: list(scan_apps(app_folders)), repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SizeCache(Path(tmp) / "bench.sqlite3")
+        list(scan_apps(app_folders, cache=cache))
+        timings["scan_cached"], _ = time_best(lambda: list(scan_apps(app_folders, cache=cache)), repeat)
+    rows = [(appid, get_game_name(appid), prefix.apparent, shader.apparent, prefix.allocated + shader.allocated)
+            for appid, prefix, shader in scanned]
+    timings["sort"], _ = time_best(lambda: [sorted(rows, key=operator.itemgetter(column)) for column in range(5)], repeat)
+
+    target_dir = get_target_dir("prefix")
+    sizes = {appid: prefix for appid, prefix, shader in scanned}
+    cross_device = bool(target_dir) and device_of(COMPATDATA_PATH) != device_of(target_dir)
+    if moves and target_dir and (HOME / GENERATED_MARKER).exists():
+        journal = open_journal()
+        candidates = sorted((appid for appid in sizes if not is_symlink(COMPATDATA_PATH / appid)), key=lambda appid: -sizes[appid].apparent)
+        # The same prefixes go to the card and back twice, the second time with
+        # verification, so the difference is the cost of hashing and reading back.
+        # With the card on the same filesystem a move is a rename(), which is
+        # timed once under its own name so it never stands in for a copy.
+        passes = (("move", "", False), ("move", "_verified", True)) if cross_device else (("rename", "", False),)
+        for kind, suffix, verify in passes:
+            for direction in ("to_sd", "to_internal"):
+                moved_bytes = 0
+                start = time.perf_counter()
+                for appid in candidates[:moves]:
+                    toggle_symlink(COMPATDATA_PATH / appid, target_dir / appid, journal=journal, verify=verify)
+                    moved_bytes += sizes[appid].apparent
+                os.sync()
+                seconds = time.perf_counter() - start
+                timings[f"{kind}_{direction}{suffix}"] = seconds
+                throughput[f"{kind}_{direction}{suffix}"] = moved_bytes / seconds if seconds else 0.0
+                get_reclaimer().wait()
+
+    tree = {"apps": len(app_folders), "files": sum(prefix.files + shader.files for _, prefix, shader in scanned),
+            "bytes": sum(prefix.apparent + shader.apparent for _, prefix, shader in scanned)}
+    return {"schema": BENCH_SCHEMA, "created": int(time.time()), "home": str(HOME), "repeat": repeat, "tree": tree,
+            "cross_device": cross_device, "timings": timings, "throughput": throughput}
+
+def compare_benchmarks(current, baseline, threshold=0.2):
+    # A timing regresses when it is more than threshold slower than the baseline,
+    # a throughput when it is that much lower. Timings below BENCH_NOISE_FLOOR
+    # are mostly noise and are skipped.
+    regressions = []
+    for name, seconds in current["timings"].items():
+        base = baseline.get("timings", {}).get(name)
+        if base and max(base, seconds) >= BENCH_NOISE_FLOOR and seconds > base * (1 + threshold):
+            regressions.append((name, base, seconds))
+    for name, rate in current["throughput"].items():
+        base = baseline.get("throughput", {}).get(name)
+        if base and rate < base / (1 + threshold):
+            regressions.append((name, base, rate))
+    return regressions
+
+# Headless command line. Everything above this point only uses the standard
+# library, so the commands below run without GTK or pygame installed.
+
+def tree_json(tree):
+    return {"apparent": tree.apparent, "allocated": tree.allocated, "files": tree.files}
+
+def print_table(rows, headers, file=None):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip(), file=file)
+
+def cli_scan(args):
+    if not COMPATDATA_PATH.exists():
+        print(f"compatdata folder not found: {COMPATDATA_PATH}", file=sys.stderr)
+        return 1
+    cache = None if args.no_cache else open_size_cache()
+    app_folders = get_valid_app_folders()
+    results = []
+    for appid, prefix, shader in scan_apps(app_folders, cache=cache, full=args.full):
+        state = get_storage_state(appid)
+        if cache:
+            icon_path = find_icon_source(appid)
+            cache.save_app(appid, get_game_name(appid), str(icon_path) if icon_path else None,
+                           get_storage_location(appid, state), is_symlink(app_folders[appid]), prefix, shader)
+        results.append((appid, prefix, shader, state))
+    if cache:
+        cache.prune(app_folders)
+    results.sort(key=lambda result: result[1].apparent, reverse=True)
+    if args.json:
+        json.dump([{"appid": appid, "name": get_game_name(appid), "prefix": tree_json(prefix), "shader": tree_json(shader),
+                    "location": state._asdict()} for appid, prefix, shader, state in results], sys.stdout, indent=2)
+        print()
+    else:
+        print_table([[appid, get_game_name(appid), f"{prefix.apparent / 1024 ** 2:.2f}", f"{shader.apparent / 1024 ** 2:.2f}",
+                      f"{(prefix.allocated + shader.allocated) / 1024 ** 2:.2f}", state.prefix_state, state.shader_state]
+                     for appid, prefix, shader, state in results],
+                    ["AppID", "Game Name", "Size (MB)", "Shader (MB)", "On Disk (MB)", "Prefix", "Shader"])
+    return 0
+
+def run_cli_job(job):
+    # Runs a job on the calling thread and redraws a one-line progress report on stderr.
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(0.5):
+            fraction = job.fraction()
+            percent = f"{fraction * 100:5.1f}% " if fraction is not None else ""
+            sys.stderr.write(f"\r{job.label}: {percent}{format_size(job.done_bytes)} at {format_size(job.rate())}/s   ")
+            sys.stderr.flush()
+
+    if sys.stderr.isatty():
+        threading.Thread(target=report, daemon=True).start()
+    try:
+        job.run()
+    finally:
+        stop.set()
+        if sys.stderr.isatty():
+            sys.stderr.write("\r\033[K")
+    if job.state == "done":
+        print(f"{job.label}: {job.result}")
+        return True
+    print(f"{job.label}: {job.state}{f' ({job.error})' if job.error else ''}", file=sys.stderr)
+    return False
+
+def selected_paths(args):
+    for appid in args.prefix or []:
+        yield appid, "prefix", COMPATDATA_PATH / appid
+    for appid in args.shader or []:
+        yield appid, "shader", SHADERCACHE_PATH / appid
+
+def cli_move(args):
+    cache = open_size_cache()
+    cached_apps = cache.load_apps() if cache else {}
+    journal = open_journal()
+    ok = True
+    for appid, kind, source_path in selected_paths(args):
+        archived = not os.path.lexists(source_path) and find_archive(source_path)
+        if not os.path.lexists(source_path) and not archived:
+            print(f"{kind} {appid}: {source_path} does not exist", file=sys.stderr)
+            ok = False
+            continue
+        on_target = is_symlink(source_path) or bool(archived)
+        if args.to and (args.to == "sd") == on_target:
+            print(f"{kind} {appid}: already on {args.to}")
+            continue
+        cached = cached_apps.get(appid)
+        total_bytes = (cached.prefix if kind == "prefix" else cached.shader).apparent if cached else 0
+        target_path = None
+        if not on_target:
+            target_path = get_target_path(kind, appid, total_bytes)
+            if not target_path:
+                print(f"{kind} {appid}: No SD card detected!", file=sys.stderr)
+                ok = False
+                continue
+        label = f"Move {kind} {get_game_name(appid)} ({appid}) {'back to internal' if on_target else f'to {target_path}'}"
+        if archived:
+            label = f"Restore {kind} {get_game_name(appid)} ({appid}) from archive"
+            total_bytes = read_archive_manifest(archived).get("raw_bytes", 0)
+        job = Job(label, lambda job, source_path=source_path, target_path=target_path:
+                  toggle_symlink(source_path, target_path, job.progress, journal, args.verify), total_bytes)
+        ok = run_cli_job(job) and ok
+    get_reclaimer().wait()
+    return 0 if ok else 1
+
+def cli_delete(args):
+    targets = list(selected_paths(args))
+    if not args.yes:
+        if not sys.stdin.isatty():
+            print("Refusing to delete without --yes when not running interactively", file=sys.stderr)
+            return 2
+        for appid, kind, source_path in targets:
+            print(f"{get_game_name(appid)} ({appid}): delete {kind} {source_path}")
+        if input("Delete these folders? [y/N] ").strip().lower() != "y":
+            return 1
+    ok = True
+    for appid, kind, source_path in targets:
+        job = Job(f"Delete {kind} {get_game_name(appid)} ({appid})", lambda job, path=source_path: delete_folder(path))
+        ok = run_cli_job(job) and ok
+    reclaimer = get_reclaimer()
+    reclaimer.wait()
+    print(f"Freed {format_size(reclaimer.freed_bytes)}")
+    return 0 if ok else 1
+
+def cli_verify(args):
+    ok = True
+    for appid, kind, source_path in selected_paths(args):
+        label = f"{kind} {get_game_name(appid)} ({appid})"
+        report = verify_folder(source_path)
+        if report is None:
+            print(f"{label}: no hash manifest, move it with --verify first", file=sys.stderr)
+            ok = False
+            continue
+        print(f"{label}: {report.checked} files checked, {len(report.corrupt)} corrupt, {len(report.modified)} modified since the move, "
+              f"{len(report.missing)} missing, {len(report.added)} added")
+        for rel in report.corrupt:
+            print(f"  corrupt: {rel}")
+        if args.verbose:
+            for status, paths in (("modified", report.modified), ("missing", report.missing), ("added", report.added)):
+                for rel in paths:
+                    print(f"  {status}: {rel}")
+        ok = ok and not report.corrupt
+    return 0 if ok else 1
+
+def cli_orphans(args):
+    orphans = sorted(size_orphans(find_orphans()), key=lambda orphan: orphan.size.allocated, reverse=True)
+    if args.json:
+        json.dump([{"appid": orphan.appid, "kind": orphan.kind, "path": str(orphan.path), "reason": orphan.reason,
+                    "size": tree_json(orphan.size)} for orphan in orphans], sys.stdout, indent=2)
+        print()
+    else:
+        print_table([[orphan.appid, orphan.kind, orphan.reason, f"{orphan.size.allocated / 1024 ** 2:.2f}", orphan.path]
+                     for orphan in orphans], ["AppID", "Folder", "Reason", "On Disk (MB)", "Path"])
+        print(f"{len(orphans)} orphans, {format_size(sum(orphan.size.allocated for orphan in orphans))} on disk")
+    if not args.delete or not orphans:
+        return 0
+    if not args.yes:
+        if not sys.stdin.isatty():
+            print("Refusing to delete without --yes when not running interactively", file=sys.stderr)
+            return 2
+        if input("Delete all of these? [y/N] ").strip().lower() != "y":
+            return 1
+    ok = True
+    for orphan in orphans:
+        ok = run_cli_job(orphan_job(orphan)) and ok
+    reclaimer = get_reclaimer()
+    reclaimer.wait()
+    print(f"Freed {format_size(reclaimer.freed_bytes)}")
+    return 0 if ok else 1
+
+def cli_shaders(args):
+    if args.appid:
+        appids = args.appid
+    else:
+        appids = sorted(os.listdir(SHADERCACHE_PATH)) if SHADERCACHE_PATH.exists() else []
+    results = sorted(analyze_shader_caches(appids, args.older_than),
+                     key=lambda result: sum(item.bytes for item in result[1].values()), reverse=True)
+    if args.json:
+        json.dump([{"appid": appid, "name": get_game_name(appid), "prunable": prunable,
+                    "components": {component: dict(item._asdict(), ages=dict(zip(SHADER_AGE_LABELS, item.ages)))
+                                   for component, item in breakdown.items()}}
+                   for appid, breakdown, prunable in results], sys.stdout, indent=2)
+        print()
+    else:
+        def mb(breakdown, component):
+            item = breakdown.get(component)
+            return f"{item.bytes / 1024 ** 2:.2f}" if item else ""
+
+        print_table([[appid, get_game_name(appid)] + [mb(breakdown, component) for component in SHADER_COMPONENTS] +
+                     [f"{prunable / 1024 ** 2:.2f}"] for appid, breakdown, prunable in results],
+                    ["AppID", "Game Name"] + [f"{name} (MB)" for name in SHADER_COMPONENTS.values()] + ["Prunable (MB)"])
+        print()
+        rows = []
+        for component, name in SHADER_COMPONENTS.items():
+            items = [breakdown[component] for _, breakdown, _ in results if component in breakdown]
+            if items:
+                rows.append([name, sum(item.files for item in items), format_size(sum(item.bytes for item in items))] +
+                            [format_size(sum(item.ages[i] for item in items)) for i in range(len(SHADER_AGE_LABELS))])
+        print_table(rows, ["Component", "Files", "Total"] + [f"Used {label}" for label in SHADER_AGE_LABELS])
+    prunable = sum(result[2] for result in results)
+    if not args.prune:
+        if not args.json:
+            print(f"{format_size(prunable)} of Mesa blobs unused for {args.older_than} days, prune them with --prune")
+        return 0
+    freed_files = freed_bytes = 0
+    for appid, _, size in results:
+        if size:
+            files, size = prune_shader_cache(SHADERCACHE_PATH / appid, args.older_than)
+            freed_files += files
+            freed_bytes += size
+    print(f"Pruned {freed_files} files, freed {format_size(freed_bytes)}", file=sys.stderr if args.json else None)
+    return 0
+
+def cli_recover(args):
+    journal = open_journal()
+    moves = journal.unfinished() if journal else []
+    if not moves:
+        print("No unfinished moves")
+        return 0
+    ok = True
+    for move in moves:
+        if args.rollback:
+            job = Job(f"Roll back {move.source} -> {move.target}", lambda job, move=move: rollback_move(move, journal))
+        else:
+            job = Job(f"Resume {move.source} -> {move.target}", lambda job, move=move: run_move(move, journal, job.progress, args.verify))
+        ok = run_cli_job(job) and ok
+    get_reclaimer().wait()
+    return 0 if ok else 1
+
+def cli_plan(args):
+    if not COMPATDATA_PATH.exists():
+        print(f"compatdata folder not found: {COMPATDATA_PATH}", file=sys.stderr)
+        return 1
+    cache = open_size_cache()
+    try:
+        sizes = {appid: (prefix, shader) for appid, prefix, shader in scan_apps(get_valid_app_folders(), cache=cache)}
+    finally:
+        if cache:
+            cache.close()
+    try:
+        plan = plan_space(sizes, args.free, args.sd_reserve, args.prefer_stale)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if plan.moves is None:
+        print(f"Cannot free {format_size(plan.need)} with {format_size(plan.sd_free)} free on external libraries "
+              f"({format_size(plan.sd_reserve)} kept free on each)", file=sys.stderr)
+        return 1
+    if args.json:
+        json.dump({"moves": [{"appid": item.appid, "kind": item.kind, "path": str(item.path), "apparent": item.apparent,
+                              "allocated": item.allocated, "library": str(item.library)} for item in plan.moves],
+                   "copy_bytes": plan.copy_bytes, "freed_bytes": plan.freed_bytes,
+                   "internal_free": plan.internal_free, "sd_free": plan.sd_free}, sys.stdout, indent=2)
+        print()
+    else:
+        print_table([[item.appid, get_game_name(item.appid), item.kind, f"{item.allocated / 1024 ** 2:.2f}", get_device_label(item.library)]
+                     for item in plan.moves], ["AppID", "Game Name", "Folder", "Frees (MB)", "Move to"])
+        print(f"Frees {format_size(plan.freed_bytes)} of internal storage by copying {format_size(plan.copy_bytes)} "
+              f"({format_size(plan.internal_free)} free now, {format_size(plan.sd_free)} free on external libraries)")
+    if not args.apply or not plan.moves:
+        return 0
+    journal = open_journal()
+    ok = True
+    try:
+        for item in plan.moves:
+            ok = run_cli_job(plan_job(item, journal)) and ok
+        get_reclaimer().wait()
+    finally:
+        if journal:
+            journal.close()
+    return 0 if ok else 1
+
+def run_tier_pass(args, cache, journal):
+    sizes = {appid: (prefix, shader) for appid, prefix, shader in scan_apps(get_valid_app_folders(), cache=cache)}
+    speeds = get_device_speeds(refresh=args.measure)
+    max_bytes = args.max_bytes
+    if args.max_minutes is not None and speeds:
+        # The slower side of a move sets its pace.
+        slowest = min(speed.seq_read for speed in speeds.values())
+        max_bytes = min(max_bytes if max_bytes is not None else math.inf, args.max_minutes * 60 * slowest)
+    plan = plan_tiering(sizes, args.keep, args.internal_min_free, args.sd_reserve, max_bytes)
+    moved_bytes = sum(move.bytes for move in plan.moves)
+    slowest = min((speed.seq_read for speed in speeds.values()), default=0)
+    if args.json:
+        json.dump({"speeds": {str(library): speed._asdict() for library, speed in speeds.items()}, "kept": plan.kept,
+                   "moves": [{"appid": move.appid, "kind": move.kind, "to": move.direction, "bytes": move.bytes,
+                              "library": str(move.library) if move.library else None} for move in plan.moves],
+                   "skipped": [{"appid": move.appid, "kind": move.kind, "to": move.direction, "reason": reason}
+                               for move, reason in plan.skipped]}, sys.stdout, indent=2)
+        print()
+    else:
+        print_table([[library, f"{format_size(speed.seq_read)}/s", f"{speed.random_iops:.0f}"] for library, speed in speeds.items()],
+                    ["Library", "Sequential read", "Random 4K reads/s"])
+        print()
+        print_table([[move.appid, get_game_name(move.appid), move.kind,
+                      get_device_label(move.library) if move.direction == "microSD" else move.direction, f"{move.bytes / 1024 ** 2:.2f}",
+                      time.strftime("%Y-%m-%d", time.localtime(move.recency)) if move.recency else "never"]
+                     for move in plan.moves], ["AppID", "Game Name", "Folder", "Move to", "Size (MB)", "Last played"])
+        for move, reason in plan.skipped:
+            print(f"Skipped {move.kind} {get_game_name(move.appid)} ({move.appid}): {reason}")
+        estimate = f", about {moved_bytes / slowest / 60:.1f} min" if slowest else ""
+        print(f"Keeping the {len(plan.kept)} most recently played games on internal storage: "
+              f"{len(plan.moves)} moves, {format_size(moved_bytes)}{estimate}")
+    if not args.apply:
+        return True
+    ok = True
+    for move in plan.moves:
+        ok = run_cli_job(tier_job(move, journal)) and ok
+    get_reclaimer().wait()
+    return ok
+
+def cli_tier(args):
+    if not COMPATDATA_PATH.exists():
+        print(f"compatdata folder not found: {COMPATDATA_PATH}", file=sys.stderr)
+        return 1
+    # Opened once, so the unattended loop reuses the same connections every pass.
+    cache = open_size_cache()
+    journal = open_journal() if args.apply else None
+    try:
+        if not args.every:
+            return 0 if run_tier_pass(args, cache, journal) else 1
+        # Unattended mode: one pass per interval, skipped while a game is running.
+        # A failed pass is logged and the next one tries again.
+        while True:
+            users = find_prefix_users(0)
+            if users:
+                print(f"Skipping this pass, {users[0][1]} ({users[0][0]}) has a prefix open", file=sys.stderr)
+            else:
+                try:
+                    get_manifest_index(refresh=True)
+                    run_tier_pass(args, cache, journal)
+                except (OSError, sqlite3.Error, VerifyError) as e:
+                    print(f"Tier pass failed: {e}", file=sys.stderr)
+            time.sleep(args.every * 3600)
+    except (OSError, sqlite3.Error, VerifyError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        for db in (cache, journal):
+            if db:
+                db.close()
+
+def cli_dedup(args):
+    if not COMPATDATA_PATH.exists():
+        print(f"compatdata folder not found: {COMPATDATA_PATH}", file=sys.stderr)
+        return 1
+    stats = dedup_prefixes(get_valid_app_folders().values(), args.apply, args.hardlinks, args.min_size, open_size_cache())
+    print(f"Checked {stats.files} files, hashed {format_size(stats.hashed_bytes)} in {stats.seconds:.1f}s")
+    print(f"{'Saved' if args.apply else 'Could save'} {format_size(stats.saved_bytes)} by sharing {stats.duplicates} duplicate files")
+    if stats.skipped:
+        print(f"Left {stats.skipped} duplicates alone: the filesystem has no reflink support, --hardlinks links them instead",
+              file=sys.stderr)
+    return 0
+
+def cli_archive(args):
+    cache = open_size_cache()
+    cached_apps = cache.load_apps() if cache else {}
+    ok = True
+    for appid, kind, source_path in selected_paths(args):
+        if not os.path.lexists(source_path):
+            print(f"{kind} {appid}: {source_path} does not exist", file=sys.stderr)
+            ok = False
+            continue
+        cached = cached_apps.get(appid)
+        total_bytes = (cached.prefix if kind == "prefix" else cached.shader).apparent if cached else 0
+        job = Job(f"Archive {kind} {get_game_name(appid)} ({appid})",
+                  lambda job, path=source_path: archive_folder(path, job.progress, args.workers, args.level), total_bytes)
+        ok = run_cli_job(job) and ok
+    get_reclaimer().wait()
+    return 0 if ok else 1
+
+def cli_restore(args):
+    ok = True
+    for appid, kind, source_path in selected_paths(args):
+        archive = find_archive(source_path)
+        if not archive:
+            print(f"{kind} {appid}: no archive found", file=sys.stderr)
+            ok = False
+            continue
+        job = Job(f"Restore {kind} {get_game_name(appid)} ({appid})",
+                  lambda job, path=source_path: restore_folder(path, job.progress, args.workers),
+                  read_archive_manifest(archive).get("raw_bytes", 0))
+        ok = run_cli_job(job) and ok
+    return 0 if ok else 1
+
+def find_library(path):
+    # Accepts a library folder as listed in Steam or its steamapps subfolder.
+    path = Path(path)
+    for library in [INTERNAL_LIBRARY] + get_steam_library_paths():
+        if path in (library, library.parent):
+            return library
+    return None
+
+def cli_targets(args):
+    if args.measure:
+        get_device_speeds(refresh=True)
+    best = choose_target(args.size)
+    rows = [[target.library, target.device, format_size(target.free),
+             f"{format_size(target.seq_read)}/s" if target.seq_read else "not measured",
+             f"{target.random_iops:.0f}" if target.random_iops else "", "*" if best and target.library == best.library else ""]
+            for target in get_library_targets()]
+    print_table(rows, ["Library", "Device", "Free", "Sequential read", "Random 4K reads/s", "Chosen"])
+    return 0
+
+def cli_io(args):
+    config = load_io_config()
+    changes = {key: value for key, value in (("bandwidth", args.bandwidth), ("workers", args.workers),
+                                             ("idle", args.idle), ("pause", args.pause)) if value is not None}
+    if args.library:
+        library = find_library(args.library)
+        if library is None:
+            print(f"{args.library} is not a Steam library", file=sys.stderr)
+            return 1
+        if changes:
+            config[str(library)] = dict(config.get(str(library), {}), **changes)
+            save_io_config(config)
+        libraries = [library]
+    elif changes:
+        print("Name the library to change, e.g. io /run/media/mmcblk0p1 --bandwidth 40M", file=sys.stderr)
+        return 2
+    else:
+        libraries = [INTERNAL_LIBRARY] + get_steam_library_paths()
+    rows = []
+    for library in libraries:
+        settings = dict(IO_DEFAULTS, **config.get(str(library), {}))
+        rows.append([library, f"{format_size(settings['bandwidth'])}/s" if settings["bandwidth"] else "unlimited",
+                     settings["workers"], "idle" if settings["idle"] else "normal", "yes" if settings["pause"] else "no"])
+    print_table(rows, ["Library", "Bandwidth", "Workers", "I/O priority", "Pause for games"])
+    users = find_prefix_users(0)
+    if users:
+        print("Moves are paused, prefixes in use by: " + ", ".join(f"{command} ({pid})" for pid, command in users))
+    return 0
+
+def cli_bench_move(args):
+    for name, stats in benchmark_transfer(args.source, args.target_dir).items():
+        print(f"{name}: {stats.files} files, {format_rate(stats)} in {stats.seconds:.2f}s")
+    return 0
+
+def cli_gen_tree(args):
+    sd_root = Path(args.sd or Path(args.home_dir) / "run/media/mmcblk0p1")
+    summary = generate_steam_tree(args.home_dir, sd_root, args.apps, args.dirs, args.files, args.file_size,
+                                  args.size_sigma, args.moved, args.seed)
+    print(f"Generated {summary['apps']} apps, {summary['files']} files, {format_size(summary['bytes'])} "
+          f"in {args.home_dir} (microSD library: {sd_root})")
+    print(f"Use it with: --home {args.home_dir} or SDDM_HOME={args.home_dir}")
+    return 0
+
+def cli_bench(args):
+    if not COMPATDATA_PATH.exists():
+        print(f"compatdata folder not found: {COMPATDATA_PATH}", file=sys.stderr)
+        return 1
+    results = run_benchmarks(args.repeat, args.moves)
+    rows = [[name, f"{seconds * 1000:.1f}", f"{format_size(results['throughput'][name])}/s" if name in results["throughput"] else ""]
+            for name, seconds in results["timings"].items()]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_benchmarks(results, baseline, args.threshold)
+        for row in rows:
+            base = baseline.get("timings", {}).get(row[0])
+            row.append(f"{base * 1000:.1f}" if base else "")
+    tree = results["tree"]
+    print(f"{tree['apps']} apps, {tree['files']} files, {format_size(tree['bytes'])}, best of {args.repeat}")
+    print_table(rows, ["Benchmark", "ms", "Throughput"] + (["Baseline ms"] if args.baseline else []))
+    if any(name.startswith("rename_") for name in results["timings"]):
+        print("The microSD library is on the same filesystem, so moves were timed as renames; "
+              "build the tree with gen-tree --sd on another device to time copies")
+    # The overhead only means something when both runs really copied the data.
+    for direction in ("to_sd", "to_internal") if results["cross_device"] else ():
+        plain, verified = (results["timings"].get(f"move_{direction}{suffix}") for suffix in ("", "_verified"))
+        if plain and verified:
+            print(f"Verification overhead {direction}: {(verified / plain - 1) * 100:+.0f}%")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for name, base, value in regressions:
+        print(f"Regression: {name} went from {base:.4g} to {value:.4g}", file=sys.stderr)
+    return 1 if regressions else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="data-manager.py", description="Steam Deck Data Manager. Run without a command to open the GUI.")
+    parser.add_argument("--home", help="run against another home folder instead of /home/deck (also SDDM_HOME)")
+    parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace of scans, icon loads and moves to FILE (also SDDM_TRACE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="report prefix and shader cache sizes")
+    scan.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    scan.add_argument("--full", action="store_true", help="ignore cached directory fingerprints")
+    scan.add_argument("--no-cache", action="store_true", help="neither read nor update the size cache")
+    scan.set_defaults(func=cli_scan)
+
+    move = commands.add_parser("move", help="toggle prefixes or shader caches between internal storage and microSD")
+    move.add_argument("--prefix", nargs="+", metavar="APPID")
+    move.add_argument("--shader", nargs="+", metavar="APPID")
+    move.add_argument("--to", choices=("sd", "internal"), help="only move folders that are not already there")
+    move.add_argument("--verify", action="store_true", help="read the copy back and compare hashes before removing the source")
+    move.set_defaults(func=cli_move)
+
+    delete = commands.add_parser("delete", help="delete prefixes or shader caches")
+    delete.add_argument("--prefix", nargs="+", metavar="APPID")
+    delete.add_argument("--shader", nargs="+", metavar="APPID")
+    delete.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    delete.set_defaults(func=cli_delete)
+
+    orphans = commands.add_parser("orphans", help="find folders of uninstalled games and symlinks to missing microSD folders")
+    orphans.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    orphans.add_argument("--delete", action="store_true", help="delete everything found")
+    orphans.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    orphans.set_defaults(func=cli_orphans)
+
+    shaders = commands.add_parser("shaders", help="break shader caches down by component and age, prune stale Mesa blobs")
+    shaders.add_argument("--appid", nargs="+", metavar="APPID", help="only these games")
+    shaders.add_argument("--older-than", type=int, default=SHADER_STALE_DAYS, metavar="DAYS",
+                         help="Mesa blobs unused for this long can be pruned")
+    shaders.add_argument("--json", action="store_true", help="print JSON instead of tables")
+    shaders.add_argument("--prune", action="store_true", help="delete the stale Mesa blobs (Fossilize, DXVK and VKD3D caches are kept)")
+    shaders.set_defaults(func=cli_shaders)
+
+    recover = commands.add_parser("recover", help="resume or roll back moves that were interrupted")
+    recover.add_argument("--rollback", action="store_true", help="roll back moves that were still copying")
+    recover.add_argument("--verify", action="store_true", help="verify resumed copies before removing the source")
+    recover.set_defaults(func=cli_recover)
+
+    verify = commands.add_parser("verify", help="recheck moved folders against the hashes recorded by move --verify")
+    verify.add_argument("--prefix", nargs="+", metavar="APPID")
+    verify.add_argument("--shader", nargs="+", metavar="APPID")
+    verify.add_argument("--verbose", action="store_true", help="also list modified, missing and added files")
+    verify.set_defaults(func=cli_verify)
+
+    plan = commands.add_parser("plan", help="find the moves to microSD that free space while copying the fewest bytes")
+    plan.add_argument("--free", type=parse_size, metavar="SIZE", help="internal space to free, e.g. 20G (default: as much as fits)")
+    plan.add_argument("--sd-reserve", type=parse_size, default=0, metavar="SIZE", help="free space to keep on microSD")
+    plan.add_argument("--prefer-stale", action="store_true", help="keep recently played games on internal storage")
+    plan.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    plan.add_argument("--apply", action="store_true", help="run the planned moves")
+    plan.set_defaults(func=cli_plan)
+
+    tier = commands.add_parser("tier", help="keep recently played games on internal storage and the rest on microSD")
+    tier.add_argument("--keep", type=int, default=TIER_KEEP, help="games to keep on internal storage")
+    tier.add_argument("--internal-min-free", type=parse_size, default=0, metavar="SIZE", help="free space to keep on internal storage")
+    tier.add_argument("--sd-reserve", type=parse_size, default=0, metavar="SIZE", help="free space to keep on microSD")
+    tier.add_argument("--max-bytes", type=parse_size, metavar="SIZE", help="move at most this much per pass")
+    tier.add_argument("--max-minutes", type=float, help="move at most what the slowest device copies in this time")
+    tier.add_argument("--measure", action="store_true", help="measure device speeds again instead of using cached results")
+    tier.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    tier.add_argument("--apply", action="store_true", help="run the moves instead of only listing them")
+    tier.add_argument("--every", type=float, metavar="HOURS", help="keep running and make a pass every HOURS")
+    tier.set_defaults(func=cli_tier)
+
+    dedup = commands.add_parser("dedup", help="share identical files between prefixes on the same device")
+    dedup.add_argument("--apply", action="store_true", help="deduplicate instead of only reporting the savings")
+    dedup.add_argument("--hardlinks", action="store_true",
+                       help="hardlink duplicates where reflinks are unsupported (a write through one prefix then changes all of them)")
+    dedup.add_argument("--min-size", type=parse_size, default=DEDUP_MIN_SIZE, metavar="SIZE", help="skip smaller files")
+    dedup.set_defaults(func=cli_dedup)
+
+    archive = commands.add_parser("archive", help="pack prefixes or shader caches into compressed archives on microSD")
+    archive.add_argument("--prefix", nargs="+", metavar="APPID")
+    archive.add_argument("--shader", nargs="+", metavar="APPID")
+    archive.add_argument("--level", type=int, choices=range(10), default=ARCHIVE_PRESET, metavar="0-9", help="xz preset")
+    archive.add_argument("--workers", type=int, default=ARCHIVE_WORKERS, help="compression threads")
+    archive.set_defaults(func=cli_archive)
+
+    restore = commands.add_parser("restore", help="unpack archived prefixes or shader caches back to internal storage")
+    restore.add_argument("--prefix", nargs="+", metavar="APPID")
+    restore.add_argument("--shader", nargs="+", metavar="APPID")
+    restore.add_argument("--workers", type=int, default=ARCHIVE_WORKERS, help="decompression threads")
+    restore.set_defaults(func=cli_restore)
+
+    targets = commands.add_parser("targets", help="list the libraries moves can go to and which one is picked")
+    targets.add_argument("--size", type=parse_size, default=0, metavar="SIZE", help="pick a library for a folder of this size")
+    targets.add_argument("--measure", action="store_true", help="measure device speeds again")
+    targets.set_defaults(func=cli_targets)
+
+    io = commands.add_parser("io", help="show or change how moves and deletes share a library's device")
+    io.add_argument("library", nargs="?", help="library folder to change")
+    io.add_argument("--bandwidth", type=parse_size, metavar="SIZE", help="bytes per second, e.g. 40M (0 = unlimited)")
+    io.add_argument("--workers", type=int, help="most files copied or deleted at once")
+    io.add_argument("--idle", action=argparse.BooleanOptionalAction, help="run at idle I/O priority")
+    io.add_argument("--pause", action=argparse.BooleanOptionalAction, help="pause while a game has a prefix open")
+    io.set_defaults(func=cli_io)
+
+    bench_move = commands.add_parser("bench-move", help="compare the copy engine against shutil.move")
+    bench_move.add_argument("source", help="folder to copy as sample data")
+    bench_move.add_argument("target_dir", help="folder on the destination device")
+    bench_move.set_defaults(func=cli_bench_move)
+
+    gen_tree = commands.add_parser("gen-tree", help="build a synthetic Steam install for benchmarking")
+    gen_tree.add_argument("home_dir", metavar="HOME", help="folder to build the fake home in")
+    gen_tree.add_argument("--sd", metavar="DIR", help="fake microSD library (default: HOME/run/media/mmcblk0p1)")
+    gen_tree.add_argument("--apps", type=int, default=50, help="number of games")
+    gen_tree.add_argument("--dirs", type=int, default=20, help="folders per prefix")
+    gen_tree.add_argument("--files", type=int, default=10, help="files per folder")
+    gen_tree.add_argument("--file-size", type=parse_size, default=64 * 1024, metavar="SIZE", help="median file size")
+    gen_tree.add_argument("--size-sigma", type=float, default=1.5, help="spread of the log-normal file sizes")
+    gen_tree.add_argument("--moved", type=float, default=0.25, help="share of prefixes already on microSD")
+    gen_tree.add_argument("--seed", type=int, default=0)
+    gen_tree.set_defaults(func=cli_gen_tree)
+
+    bench = commands.add_parser("bench", help="time discovery, scanning, sorting and moves")
+    bench.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best one counts")
+    bench.add_argument("--moves", type=int, default=3, help="prefixes to move each way (generated trees only)")
+    bench.add_argument("--output", metavar="FILE", help="write the results as JSON")
+    bench.add_argument("--baseline", metavar="FILE", help="compare against earlier results and fail on regressions")
+    bench.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a result counts as a regression")
+    bench.set_defaults(func=cli_bench)
+    return parser
+
+def run_cli(argv):
+    args = build_parser().parse_args(argv)
+    if args.home:
+        set_home(args.home)
+    if args.trace:
+        enable_tracing(args.trace)
+    return args.func(args)
+
+def parse_global_options(argv):
+    # --home, --trace and --profile-startup apply to the GUI as well as to every
+    # command, so they are taken off first; whatever is left picks the command.
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--home")
+    parser.add_argument("--trace")
+    parser.add_argument("--profile-startup", action="store_true")
+    return parser.parse_known_args(argv)
+
+if __name__ == "__main__":
+    GLOBAL_OPTIONS, COMMAND_ARGV = parse_global_options(sys.argv[1:])
+    if GLOBAL_OPTIONS.home:
+        set_home(GLOBAL_OPTIONS.home)
+    if GLOBAL_OPTIONS.trace:
+        enable_tracing(GLOBAL_OPTIONS.trace)
+    if COMMAND_ARGV:
+        sys.exit(run_cli(COMMAND_ARGV))
+
+# Everything above needs only the standard library; the tests load just that part.
+STARTUP_MARKS.append(("core definitions", time.perf_counter()))
 import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GLib, GdkPixbuf, Pango
-import pygame
-from pathlib import Path
+STARTUP_MARKS.append(("gtk import", time.perf_counter()))
 
-LIBRARY_FOLDERS_VDF = Path("/home/deck/.local/share/Steam/steamapps/libraryfolders.vdf")
-COMPATDATA_PATH = Path("/home/deck/.steam/steam/steamapps/compatdata")
-SHADERCACHE_PATH = Path("/home/deck/.steam/steam/steamapps/shadercache")
+# pygame is imported lazily by the gamepad input thread once the window is on screen.
+pygame = None
+PROFILE_STARTUP = False
+GAMEPAD_AXIS_THRESHOLD = 0.6
+GAMEPAD_REPEAT_DELAY = 0.35
+GAMEPAD_REPEAT_INTERVAL = 0.12
+GAMEPAD_REPEAT_MIN_INTERVAL = 0.03
+GAMEPAD_REPEAT_ACCELERATION = 0.85
+GAMEPAD_FAST_STEP_AFTER = 15
+GAMEPAD_FAST_STEP = 5
+ROW_FLUSH_INTERVAL = 33  # ms, about 30 model updates per second
+ROW_DETACH_MIN = 32
 
-def get_steam_library_paths():
-    if not LIBRARY_FOLDERS_VDF.exists():
-        return []
-    with LIBRARY_FOLDERS_VDF.open("r") as f:
-        content = f.read()
-    paths = re.findall(r'"path"\s*"([^"]+)"', content)
-    external_paths = [Path(p) / "steamapps" for p in paths if not p.startswith("/home/deck/.local/share/Steam")]
-    return [p for p in external_paths if p.exists()]
+def mark_startup(name):
+    STARTUP_MARKS.append((name, time.perf_counter()))
 
-MICROSD_PATHS = get_steam_library_paths()
-MICROSD_PATH = MICROSD_PATHS[0] if MICROSD_PATHS else None
-TARGET_COMPATDATA_DIR = MICROSD_PATH / "compatdata" if MICROSD_PATH else None
-TARGET_SHADERCACHE_DIR = MICROSD_PATH / "shadercache" if MICROSD_PATH else None
+def startup_report():
+    lines = ["Startup profile (ms since previous step / since process start):"]
+    previous = STARTUP_T0
+    for name, when in sorted(STARTUP_MARKS, key=lambda mark: mark[1]):
+        lines.append(f"  {name:<22}{(when - previous) * 1000:9.1f}{(when - STARTUP_T0) * 1000:10.1f}")
+        previous = when
+    return "\n".join(lines)
 
-def get_game_name(appid):
+def load_icon(icon_path):
+    # Scaled icons are kept in THUMBNAIL_DIR keyed by source path and mtime,
+    # so each original header image is only decoded once.
+    if not icon_path:
+        return None
     try:
-        for lib_path in get_steam_library_paths() + [Path("/home/deck/.local/share/Steam/steamapps")]:
-            acf_path = lib_path / f"appmanifest_{appid}.acf"
-            if acf_path.exists():
-                with acf_path.open("r") as f:
-                    for line in f:
-                        if '"name"' in line:
-                            return line.split('"')[3].strip()
-        if LIBRARY_FOLDERS_VDF.exists():
-            with LIBRARY_FOLDERS_VDF.open("r") as f:
-                content = f.read()
-                match = re.search(rf'"{appid}"\s*{{[^}}]*"name"\s*"([^"]+)"', content, re.DOTALL)
-                if match:
-                    return match.group(1)
-        return "Unknown Game"
+        thumb = thumbnail_path(icon_path)
+        if thumb.exists():
+            return GdkPixbuf.Pixbuf.new_from_file(str(thumb))
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(str(icon_path), -1, ICON_HEIGHT, True)  # Уменьшено до 48
     except Exception:
-        return "Unknown Game"
-
-def get_folder_size(path):
-    total_size = 0
-    for dirpath, _, filenames in os.walk(path, followlinks=False):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.islink(fp) and not os.path.exists(fp):
-                continue
-            try:
-                total_size += os.path.getsize(fp)
-            except (FileNotFoundError, PermissionError, OSError):
-                continue
-    return total_size / (1024 * 1024)
+        return None
+    try:
+        THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_thumb = thumb.with_suffix(f".{threading.get_ident()}.tmp")
+        pixbuf.savev(str(tmp_thumb), "png", [], [])
+        os.replace(tmp_thumb, thumb)
+    except Exception:
+        pass
+    return pixbuf
 
-def get_shader_size(appid):
-    shader_path = SHADERCACHE_PATH / appid
-    if shader_path.exists():
-        return get_folder_size(shader_path)
-    return 0.0
+(COL_SELECTED, COL_APPID, COL_NAME, COL_SIZE, COL_SHADER_SIZE, COL_SYMLINK, COL_ICON, COL_ALLOCATED,
+ COL_PREFIX_STATE, COL_PREFIX_TARGET, COL_SHADER_STATE, COL_SHADER_TARGET, COL_LOCATION, COL_LOCATION_MARKUP,
+ COL_ICON_PATH) = range(15)
+LOCATION_COLORS = {"Internal": "red", "microSD": "green", "Archived": "blue"}
 
-def get_game_icon(appid):
-    base_path = Path(f"/home/deck/.steam/steam/appcache/librarycache/{appid}")
-    preferred_files = ["header.jpg", "logo.png", "library_header.png"]
-    
-    for filename in preferred_files:
-        icon_path = base_path / filename
-        if icon_path.exists():
-            try:
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(str(icon_path), -1, 48, True)  # Уменьшено до 48
-                return pixbuf
-            except Exception:
-                pass
+def format_location_markup(state):
+    lines = []
+    for label, location, target in (("Prefix", state.prefix_state, state.prefix_target),
+                                    ("Shader", state.shader_state, state.shader_target)):
+        line = GLib.markup_escape_text(f"{label}: {target} ({describe_location(location, target)})")
+        color = LOCATION_COLORS.get(location)
+        lines.append(f'<span foreground="{color}">{line}</span>' if color else line)
+    return "\n".join(lines)
 
-    if base_path.exists():
-        for file in base_path.iterdir():
-            if file.is_file() and file.suffix.lower() in [".jpg", ".png"]:
-                try:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(str(file), -1, 48, True)  # Уменьшено до 48
-                    return pixbuf
-                except Exception:
-                    pass
-    
-    return None
+class GamepadInput:
+    # Reads pygame joystick events on its own thread and posts ("move", rows),
+    # ("activate", 0) and ("back", 0) actions to the GTK main loop. Holding a
+    # direction repeats after GAMEPAD_REPEAT_DELAY, speeds up with every repeat
+    # and eventually jumps GAMEPAD_FAST_STEP rows at a time.
+    def __init__(self, on_action):
+        self.on_action = on_action
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
 
-def is_symlink(path):
-    return os.path.islink(path)
+    def start(self):
+        self.thread.start()
 
-def get_storage_location(appid):
-    prefix_path = COMPATDATA_PATH / appid
-    shader_path = SHADERCACHE_PATH / appid
-    prefix_loc = str(prefix_path) if not is_symlink(prefix_path) else os.readlink(prefix_path)
-    shader_loc = str(shader_path) if not is_symlink(shader_path) else os.readlink(shader_path) if shader_path.exists() else "N/A"
-    prefix_label = f"Prefix: {prefix_loc} ({'Internal' if not is_symlink(prefix_path) else 'microSD'})"
-    shader_label = f"Shader: {shader_loc} ({'Internal' if not is_symlink(shader_path) else 'microSD' if shader_path.exists() else 'N/A'})"
-    return f"{prefix_label}\n{shader_label}"
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1)
 
-def toggle_symlink(source_path, target_path):
-    if not target_path:
-        raise Exception("No SD card detected!")
-    if is_symlink(source_path):
-        link_target = Path(os.readlink(source_path))
-        os.unlink(source_path)
-        if link_target.exists():
-            shutil.move(link_target, source_path)
-        return "Moved back to internal storage"
-    else:
-        if not target_path.parent.exists():
-            target_path.parent.mkdir(parents=True)
-        shutil.move(source_path, target_path)
-        os.symlink(target_path, source_path)
-        return "Moved to target with symlink"
+    def post(self, action, amount=0):
+        GLib.idle_add(self.on_action, action, amount)
 
-def delete_folder(path):
-    if is_symlink(path):
-        link_target = Path(os.readlink(path))
-        os.unlink(path)
-        if link_target.exists():
-            shutil.rmtree(link_target)
-        return "Symlink and target folder deleted"
-    elif path.exists():
-        shutil.rmtree(path)
-        return "Folder deleted"
-    return "Nothing to delete"
+    def run(self):
+        # Only the joystick subsystem is started. SDL still needs a video driver
+        # for its event queue, so the dummy driver is used instead of a real one.
+        global pygame
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        try:
+            import pygame
+            pygame.display.init()
+            pygame.joystick.init()
+        except Exception as e:
+            print(f"Gamepad support disabled: {e}")
+            return
+        joysticks = {}
+        for index in range(pygame.joystick.get_count()):
+            joystick = pygame.joystick.Joystick(index)
+            joystick.init()
+            joysticks[joystick.get_instance_id()] = joystick
+            print(f"Joystick detected: {joystick.get_name()}")
+        mark_startup("gamepad init")
 
-def get_valid_app_folders():
-    app_folders = {}
-    all_libs = get_steam_library_paths() + [Path("/home/deck/.local/share/Steam/steamapps")]
-    installed_apps = set()
-    for lib_path in all_libs:
-        for acf in lib_path.glob("appmanifest_*.acf"):
-            appid = acf.stem.split("_")[1]
-            installed_apps.add(appid)
-    for folder in COMPATDATA_PATH.iterdir():
-        if folder.is_dir() and folder.name in installed_apps:
-            appid = folder.name
-            if appid not in app_folders:
-                app_folders[appid] = folder
-    return app_folders
+        hat_y = 0
+        axis_y = 0.0
+        direction = 0
+        next_repeat = None
+        interval = GAMEPAD_REPEAT_INTERVAL
+        repeats = 0
+        while not self.stop_event.is_set():
+            timeout = 0.25 if next_repeat is None else max(next_repeat - time.monotonic(), 0)
+            event = pygame.event.wait(int(timeout * 1000))
+            events = [event] + pygame.event.get() if event.type != pygame.NOEVENT else []
+            for event in events:
+                if event.type == pygame.JOYDEVICEADDED:
+                    joystick = pygame.joystick.Joystick(event.device_index)
+                    joystick.init()
+                    joysticks[joystick.get_instance_id()] = joystick
+                elif event.type == pygame.JOYDEVICEREMOVED:
+                    joysticks.pop(event.instance_id, None)
+                elif event.type == pygame.JOYBUTTONDOWN:
+                    if event.button == 0:
+                        self.post("activate")
+                    elif event.button == 1:
+                        self.post("back")
+                elif event.type == pygame.JOYHATMOTION and event.hat == 0:
+                    hat_y = event.value[1]
+                elif event.type == pygame.JOYAXISMOTION and event.axis == 1:
+                    axis_y = event.value
+
+            new_direction = 0
+            if hat_y == 1 or axis_y < -GAMEPAD_AXIS_THRESHOLD:
+                new_direction = -1
+            elif hat_y == -1 or axis_y > GAMEPAD_AXIS_THRESHOLD:
+                new_direction = 1
+            now = time.monotonic()
+            if new_direction != direction:
+                direction = new_direction
+                next_repeat = now + GAMEPAD_REPEAT_DELAY if direction else None
+                interval = GAMEPAD_REPEAT_INTERVAL
+                repeats = 0
+                if direction:
+                    self.post("move", direction)
+            elif direction and now >= next_repeat:
+                repeats += 1
+                step = GAMEPAD_FAST_STEP if repeats > GAMEPAD_FAST_STEP_AFTER else 1
+                self.post("move", direction * step)
+                interval = max(interval * GAMEPAD_REPEAT_ACCELERATION, GAMEPAD_REPEAT_MIN_INTERVAL)
+                next_repeat = now + interval
+        pygame.quit()
 
 class ProtonManagerWindow(Gtk.Window):
     def __init__(self):
         super().__init__(title="Steam Deck Data Manager")
         self.set_default_size(1280, 800)  # Фиксированный размер для Steam Deck
 
-        pygame.init()
-        pygame.joystick.init()
-        self.joystick = None
-        if pygame.joystick.get_count() > 0:
-            self.joystick = pygame.joystick.Joystick(0)
-            self.joystick.init()
-            print(f"Joystick detected: {self.joystick.get_name()}")
-
-        if not COMPATDATA_PATH.exists():
-            self.show_error("compatdata folder not found!")
-            return
-        if not MICROSD_PATH:
-            self.show_error("No SD card detected in Steam library!")
-            return
-
-        self.app_folders = get_valid_app_folders()
-        if not self.app_folders:
-            self.show_error("No valid Proton prefixes found in compatdata!")
-            return
+        # Only widgets are built here. Library discovery, the size cache and the
+        # gamepad are started once the first frame has been drawn.
+        self.gamepad = None
+        self.watcher = None
+        self.dialogs = []
+        self.app_folders = {}
+        self.cache = None
+        self.first_rows_shown = False
+        self.rows = {}
+        # Scan threads queue rows and progress here; flush_rows applies them in batches.
+        self.row_lock = threading.Lock()
+        self.pending_rows = {}
+        self.pending_status = None
+        self.flush_pending = False
+        # Icons are decoded off the main thread, and only for rows near the viewport.
+        self.placeholder_icon = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 100, ICON_HEIGHT)
+        self.placeholder_icon.fill(0)
+        self.icon_pool = ThreadPoolExecutor(max_workers=ICON_WORKERS)
+        self.icons_requested = set()
+        self.icon_update_pending = False
 
         vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)  # Уменьшено spacing
         self.add(vbox)
 
-        label = Gtk.Label(label=f"Using SD card: {MICROSD_PATH}")
-        label.set_margin_top(5)
-        label.set_margin_bottom(5)
-        vbox.pack_start(label, False, False, 0)
+        self.library_label = Gtk.Label(label="Discovering Steam libraries...")
+        self.library_label.set_margin_top(5)
+        self.library_label.set_margin_bottom(5)
+        vbox.pack_start(self.library_label, False, False, 0)
 
         self.progress = Gtk.ProgressBar()
         self.progress_label = Gtk.Label(label="Loading games...")
         vbox.pack_start(self.progress_label, False, False, 0)
         vbox.pack_start(self.progress, False, False, 0)
 
-        self.store = Gtk.ListStore(bool, str, str, float, float, bool, GdkPixbuf.Pixbuf)
+        self.store = Gtk.ListStore(bool, str, str, float, float, bool, GdkPixbuf.Pixbuf, float,
+                                   str, str, str, str, str, str, str)
         self.treeview = Gtk.TreeView(model=self.store)
         self.treeview.set_fixed_height_mode(True)
         
         renderer_toggle = Gtk.CellRendererToggle()
         renderer_toggle.connect("toggled", self.on_toggle_selection)
-        column_toggle = Gtk.TreeViewColumn("Select", renderer_toggle, active=0)
+        column_toggle = Gtk.TreeViewColumn("Select", renderer_toggle, active=COL_SELECTED)
         column_toggle.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         column_toggle.set_fixed_width(40)  # Уменьшено с 50
         self.treeview.append_column(column_toggle)
 
         renderer_icon = Gtk.CellRendererPixbuf()
         renderer_icon.set_padding(0, 0)
-        column_icon = Gtk.TreeViewColumn("Icon", renderer_icon, pixbuf=6)
+        column_icon = Gtk.TreeViewColumn("Icon", renderer_icon, pixbuf=COL_ICON)
         column_icon.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         column_icon.set_fixed_width(150)  # Уменьшено с 200
         self.treeview.append_column(column_icon)
 
-        columns = ["AppID", "Game Name", "Size\n(MB)", "Shader\nSize (MB)", "Location"]
-        for i, column_title in enumerate(columns):
+        # Every column sorts on a plain model column with the native comparator,
+        # so sorting never calls back into Python or touches the filesystem.
+        columns = [("AppID", COL_APPID), ("Game Name", COL_NAME), ("Size\n(MB)", COL_SIZE),
+                   ("Shader\nSize (MB)", COL_SHADER_SIZE), ("On Disk\n(MB)", COL_ALLOCATED), ("Location", COL_LOCATION)]
+        for column_title, model_column in columns:
             renderer = Gtk.CellRendererText()
             renderer.set_padding(0, 0)
             renderer.set_fixed_height_from_font(1)
@@ -208,35 +3749,25 @@ class ProtonManagerWindow(Gtk.Window):
             if column_title == "Location":
                 renderer.set_property("wrap-width", 250)  # Уменьшено с 300
                 renderer.set_property("wrap-mode", Pango.WrapMode.WORD)
-                column = Gtk.TreeViewColumn(column_title, renderer, markup=i + 1)
-                column.set_cell_data_func(renderer, self.format_location)
+                column = Gtk.TreeViewColumn(column_title, renderer, markup=COL_LOCATION_MARKUP)
             elif column_title == "Game Name":
                 renderer.set_property("wrap-width", 150)  # Уменьшено с 200
                 renderer.set_property("wrap-mode", Pango.WrapMode.WORD)
-                column = Gtk.TreeViewColumn(column_title, renderer, text=i + 1)
+                column = Gtk.TreeViewColumn(column_title, renderer, text=model_column)
             else:
-                column = Gtk.TreeViewColumn(column_title, renderer, text=i + 1)
+                column = Gtk.TreeViewColumn(column_title, renderer, text=model_column)
             column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
-            column.set_sort_column_id(i + 1)
+            column.set_sort_column_id(model_column)
             if column_title == "AppID":
                 column.set_fixed_width(80)  # Уменьшено с 100
-                self.store.set_sort_func(1, self.string_sort_func, None)
             elif column_title == "Game Name":
                 column.set_fixed_width(150)  # Уменьшено с 200
-                self.store.set_sort_func(2, self.string_sort_func, None)
-            elif column_title == "Size\n(MB)":
-                column.set_fixed_width(50)  # Уменьшено с 67
+            elif column_title in ("Size\n(MB)", "Shader\nSize (MB)", "On Disk\n(MB)"):
+                column.set_fixed_width(60 if column_title == "On Disk\n(MB)" else 50)  # Уменьшено с 67
                 renderer.set_property("xalign", 1.0)
-                column.set_cell_data_func(renderer, lambda col, cell, model, iter, data: cell.set_property("text", f"{model[iter][3]:.2f}"))
-                self.store.set_sort_func(3, self.size_sort_func, None)
-            elif column_title == "Shader\nSize (MB)":
-                column.set_fixed_width(50)  # Уменьшено с 67
-                renderer.set_property("xalign", 1.0)
-                column.set_cell_data_func(renderer, lambda col, cell, model, iter, data: cell.set_property("text", f"{model[iter][4]:.2f}"))
-                self.store.set_sort_func(4, self.shader_size_sort_func, None)
+                column.set_cell_data_func(renderer, self.format_size, model_column)
             elif column_title == "Location":
                 column.set_fixed_width(300)  # Уменьшено с 400
-                self.store.set_sort_func(5, self.string_sort_func, None)
             self.treeview.append_column(column)
 
         self.treeview.connect("row-activated", self.on_row_activated)
@@ -244,6 +3775,9 @@ class ProtonManagerWindow(Gtk.Window):
         scrolled_window = Gtk.ScrolledWindow()
         scrolled_window.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         scrolled_window.add(self.treeview)
+        scrolled_window.get_vadjustment().connect("value-changed", self.schedule_icon_update)
+        scrolled_window.get_vadjustment().connect("changed", self.schedule_icon_update)
+        self.store.connect("rows-reordered", self.schedule_icon_update)
         vbox.pack_start(scrolled_window, True, True, 0)
 
         hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)  # Уменьшено spacing
@@ -254,91 +3788,338 @@ class ProtonManagerWindow(Gtk.Window):
         toggle_shader_button = Gtk.Button(label="Toggle Selected Shader Caches")
         toggle_shader_button.connect("clicked", self.on_toggle_shader_clicked)
         hbox.pack_start(toggle_shader_button, True, True, 0)
+
+        self.verify_check = Gtk.CheckButton(label="Verify moves")
+        self.verify_check.set_tooltip_text("Read each copy back and compare hashes before the original is removed")
+        hbox.pack_start(self.verify_check, False, False, 0)
+
+        plan_button = Gtk.Button(label="Plan Space...")
+        plan_button.connect("clicked", self.on_plan_clicked)
+        hbox.pack_start(plan_button, False, False, 0)
+
+        orphans_button = Gtk.Button(label="Orphans...")
+        orphans_button.connect("clicked", self.on_orphans_clicked)
+        hbox.pack_start(orphans_button, False, False, 0)
+
+        rescan_button = Gtk.Button(label="Rescan Sizes")
+        rescan_button.connect("clicked", self.on_rescan_clicked)
+        hbox.pack_start(rescan_button, False, False, 0)
         vbox.pack_start(hbox, False, False, 5)  # Уменьшено padding
 
+        self.job_queue = JobQueue()
+        self.journal = open_journal()
+        self.job_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        self.job_label = Gtk.Label(xalign=0)
+        self.job_status = Gtk.Label(xalign=0)
+        self.job_status.set_ellipsize(Pango.EllipsizeMode.MIDDLE)
+        self.job_progress = Gtk.ProgressBar()
+        job_hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        job_hbox.pack_start(self.job_progress, True, True, 0)
+        cancel_button = Gtk.Button(label="Cancel")
+        cancel_button.connect("clicked", lambda button: self.job_queue.cancel_all())
+        job_hbox.pack_start(cancel_button, False, False, 0)
+        self.job_box.pack_start(self.job_label, False, False, 0)
+        self.job_box.pack_start(job_hbox, False, False, 0)
+        self.job_box.pack_start(self.job_status, False, False, 0)
+        self.job_box.set_no_show_all(True)
+        vbox.pack_start(self.job_box, False, False, 5)
+
+        self.reclaim_label = Gtk.Label(xalign=0)
+        self.reclaim_label.set_no_show_all(True)
+        vbox.pack_start(self.reclaim_label, False, False, 0)
+        get_reclaimer().listeners.append(lambda path, freed: GLib.idle_add(self.update_reclaim_status))
+
         self.treeview.set_cursor(Gtk.TreePath.new_first())
-        GLib.timeout_add(50, self.handle_gamepad)
-        GLib.timeout_add(100, self.populate_store_async)
-
-    def format_location(self, column, cell, model, iter, data):
-        appid = model[iter][1]
-        text = get_storage_location(appid)
-        lines = text.split("\n")
-        colored_text = ""
-        for line in lines:
-            if "(Internal)" in line:
-                colored_text += f'<span foreground="red">{line}</span>\n'
-            elif "(microSD)" in line:
-                colored_text += f'<span foreground="green">{line}</span>\n'
-            else:
-                colored_text += f"{line}\n"
-        cell.set_property("markup", colored_text.strip())
-
-    def string_sort_func(self, model, iter1, iter2, user_data):
-        column_idx = model.get_sort_column_id()[0]
-        val1 = model[iter1][column_idx]
-        val2 = model[iter2][column_idx]
-        if column_idx == 5:
-            val1 = get_storage_location(model[iter1][1])
-            val2 = get_storage_location(model[iter2][1])
-        return -1 if val1 > val2 else (1 if val1 < val2 else 0)
-
-    def size_sort_func(self, model, iter1, iter2, user_data):
-        size1 = model[iter1][3]
-        size2 = model[iter2][3]
-        return -1 if size1 > size2 else (1 if size1 < size2 else 0)
-
-    def shader_size_sort_func(self, model, iter1, iter2, user_data):
-        size1 = model[iter1][4]
-        size2 = model[iter2][4]
-        return -1 if size1 > size2 else (1 if size1 < size2 else 0)
-
-    def populate_store_async(self):
-        total_folders = len(self.app_folders)
-        seen_appids = set()
-        app_list = list(self.app_folders.items())
-        
-        def process_batch(start_idx):
-            if start_idx >= len(app_list):
-                GLib.idle_add(self.progress.set_fraction, 1.0)
-                GLib.idle_add(self.progress_label.set_text, "Loading complete")
-                GLib.timeout_add(500, lambda: self.progress.hide() or self.progress_label.hide())
-                GLib.idle_add(self.apply_initial_sort)
-                return False
-
-            end_idx = min(start_idx + 10, len(app_list))
-            batch = app_list[start_idx:end_idx]
-            for appid, folder in batch:
-                if appid in seen_appids:
-                    continue
-                name = get_game_name(appid)
-                GLib.idle_add(self.progress_label.set_text, f"Loading: {name}")
-                size = get_folder_size(folder)
-                shader_size = get_shader_size(appid)
-                symlink = is_symlink(folder)
-                icon = get_game_icon(appid)
-                GLib.idle_add(self.add_to_store, (False, appid, name, size, shader_size, symlink, icon))
-                seen_appids.add(appid)
-            
-            fraction = len(seen_appids) / total_folders
-            GLib.idle_add(self.progress.set_fraction, fraction)
-            GLib.timeout_add(50, process_batch, end_idx)
+        self.first_draw_handler = self.connect("draw", self.on_first_draw)
+        mark_startup("window built")
+
+    def on_first_draw(self, widget, cr):
+        self.disconnect(self.first_draw_handler)
+        mark_startup("first paint")
+        threading.Thread(target=self.discovery_worker, daemon=True).start()
+        GLib.idle_add(self.init_gamepad, priority=GLib.PRIORITY_LOW)
+        return False
+
+    def discovery_worker(self):
+        library_paths = get_steam_library_paths()
+        app_folders = get_valid_app_folders() if COMPATDATA_PATH.exists() else {}
+        cache = open_size_cache()
+        get_reclaimer().resume()
+        mark_startup("library discovery")
+        GLib.idle_add(self.discovery_done, library_paths, app_folders, cache)
+
+    def discovery_done(self, library_paths, app_folders, cache):
+        if not COMPATDATA_PATH.exists():
+            self.show_error("compatdata folder not found!")
+            return False
+        if not library_paths:
+            self.show_error("No SD card detected in Steam library!")
             return False
+        if not app_folders:
+            self.show_error("No valid Proton prefixes found in compatdata!")
+            return False
+        targets = ", ".join(f"{target.device} ({format_size(target.free)} free)" for target in get_library_targets())
+        self.library_label.set_text(f"Move targets: {targets}")
+        self.app_folders = app_folders
+        self.cache = cache
+        self.populate_store_async()
+        self.recover_moves()
+        return False
+
+    def init_gamepad(self):
+        self.gamepad = GamepadInput(self.on_gamepad_action)
+        self.gamepad.start()
+        return False
+
+    def shutdown(self):
+        if self.gamepad:
+            self.gamepad.stop()
+        if self.watcher:
+            self.watcher.stop()
+
+    def on_gamepad_action(self, action, amount):
+        # While a dialog is open, A answers yes/ok and B answers no/cancel.
+        if self.dialogs:
+            dialog, accept, reject = self.dialogs[-1]
+            if action == "activate":
+                dialog.response(accept)
+            elif action == "back":
+                dialog.response(reject)
+            return False
+        if action == "move" and len(self.store):
+            path = self.treeview.get_cursor()[0]
+            index = path.get_indices()[0] if path else 0
+            new_index = min(max(index + amount, 0), len(self.store) - 1)
+            self.treeview.set_cursor(Gtk.TreePath.new_from_indices([new_index]))
+        elif action == "activate":
+            model, treeiter = self.treeview.get_selection().get_selected()
+            if treeiter:
+                self.toggle_location([treeiter], "prefix")
+        return False
+
+    def run_dialog(self, dialog, accept, reject):
+        self.dialogs.append((dialog, accept, reject))
+        try:
+            dialog.show_all()
+            return dialog.run()
+        finally:
+            self.dialogs.pop()
+            dialog.destroy()
+
+    def format_size(self, column, cell, model, iter, model_column):
+        cell.set_property("text", f"{model[iter][model_column]:.2f}")
+
+    def populate_store_async(self, full=False):
+        threading.Thread(target=self.scan_worker, args=(dict(self.app_folders), full), daemon=True).start()
+        return False
+
+    def make_row(self, appid, name, icon_path, prefix, shader):
+        size = prefix.apparent / (1024 * 1024)
+        shader_size = shader.apparent / (1024 * 1024)
+        allocated = (prefix.allocated + shader.allocated) / (1024 * 1024)
+        row = [False, appid, name, size, shader_size, False, self.placeholder_icon, allocated] + [""] * 6
+        row.append(str(icon_path) if icon_path else "")
+        for column, value in zip(*self.location_columns(appid, get_storage_state(appid))):
+            row[column] = value
+        return row
 
-        GLib.timeout_add(50, process_batch, 0)
+    def location_columns(self, appid, state):
+        return ([COL_SYMLINK, COL_PREFIX_STATE, COL_PREFIX_TARGET, COL_SHADER_STATE, COL_SHADER_TARGET, COL_LOCATION, COL_LOCATION_MARKUP],
+                [is_symlink(COMPATDATA_PATH / appid), state.prefix_state, state.prefix_target, state.shader_state, state.shader_target,
+                 get_storage_location(appid, state), format_location_markup(state)])
+
+    def get_row_iter(self, appid):
+        ref = self.rows.get(appid)
+        if ref and ref.valid():
+            return self.store.get_iter(ref.get_path())
+        return None
+
+    def refresh_row_location(self, appid):
+        # Location columns are only recomputed when a move or delete touches the row.
+        treeiter = self.get_row_iter(appid)
+        if treeiter:
+            self.store.set(treeiter, *self.location_columns(appid, get_storage_state(appid)))
+
+    def rescan_rows(self, appids):
+        app_folders = {appid: COMPATDATA_PATH / appid for appid in appids}
+        threading.Thread(target=self.rescan_worker, args=(app_folders,), daemon=True).start()
+
+    def rescan_worker(self, app_folders):
+        for appid, prefix, shader in scan_apps(app_folders, cache=self.cache):
+            name = get_game_name(appid)
+            icon_path = find_icon_source(appid)
+            self.queue_rows([self.make_row(appid, name, icon_path, prefix, shader)])
+
+    def scan_worker(self, app_folders, full):
+        if self.cache and not full:
+            cached_apps = self.cache.load_apps()
+            cached_rows = [self.make_row(appid, app.name, app.icon_path, app.prefix, app.shader)
+                           for appid, app in cached_apps.items() if appid in app_folders]
+            if cached_rows:
+                self.queue_rows(cached_rows)
+
+        total_folders = len(app_folders)
+        for done, (appid, prefix, shader) in enumerate(scan_apps(app_folders, cache=self.cache, full=full), 1):
+            row = self.scanned_row(appid, prefix, shader)
+            self.queue_rows([row], (f"Loading: {row[COL_NAME]}", done / total_folders))
+        if self.cache:
+            self.cache.prune(app_folders)
+        if self.watcher is None:
+            self.start_watcher(app_folders)
+
+        self.queue_rows(status=("Loading complete", 1.0))
+        GLib.timeout_add(500, lambda: self.progress.hide() or self.progress_label.hide())
+
+    def scanned_row(self, appid, prefix, shader):
+        name = get_game_name(appid)
+        icon_path = find_icon_source(appid)
+        row = self.make_row(appid, name, icon_path, prefix, shader)
+        if self.cache:
+            self.cache.save_app(appid, name, str(icon_path) if icon_path else None, row[COL_LOCATION], row[COL_SYMLINK], prefix, shader)
+        return row
+
+    def start_watcher(self, app_folders):
+        try:
+            self.watcher = TreeWatcher(self.on_tree_changed, self.on_app_removed, self.cache)
+        except (OSError, AttributeError) as e:
+            print(f"Live updates disabled: {e}")
+            return
+        self.watcher.start(app_folders)
+
+    def on_tree_changed(self, appid, prefix, shader):
+        self.app_folders[appid] = COMPATDATA_PATH / appid
+        self.queue_rows([self.scanned_row(appid, prefix, shader)])
+
+    def on_app_removed(self, appid):
+        self.app_folders.pop(appid, None)
+        GLib.idle_add(self.remove_row, appid)
+
+    def remove_row(self, appid):
+        treeiter = self.get_row_iter(appid)
+        if treeiter:
+            self.store.remove(treeiter)
+        self.rows.pop(appid, None)
+        self.icons_requested.discard(appid)
+        return False
+
+    def note_first_rows(self):
+        if self.first_rows_shown:
+            return
+        self.first_rows_shown = True
+        mark_startup("first rows shown")
+        if PROFILE_STARTUP:
+            print(startup_report(), file=sys.stderr)
+
+    def queue_rows(self, rows=(), status=None):
+        # Safe to call from any thread. A later row for the same appid replaces
+        # an earlier one that has not been shown yet, and only the latest
+        # (label, fraction) progress status is kept.
+        with self.row_lock:
+            for row in rows:
+                self.pending_rows[row[COL_APPID]] = row
+            if status:
+                self.pending_status = status
+            if self.flush_pending:
+                return
+            self.flush_pending = True
+        GLib.timeout_add(ROW_FLUSH_INTERVAL, self.flush_rows)
+
+    def flush_rows(self):
+        with self.row_lock:
+            rows, self.pending_rows = self.pending_rows, {}
+            status, self.pending_status = self.pending_status, None
+            self.flush_pending = False
+        if status:
+            self.progress_label.set_text(status[0])
+            self.progress.set_fraction(status[1])
+        new_rows = []
+        for row in rows.values():
+            treeiter = self.get_row_iter(row[COL_APPID])
+            if treeiter:
+                self.update_row(treeiter, row)
+            else:
+                new_rows.append(row)
+        if new_rows:
+            self.insert_rows(new_rows)
         return False
 
-    def apply_initial_sort(self):
-        self.store.set_sort_column_id(3, Gtk.SortType.ASCENDING)
+    def update_row(self, treeiter, data):
+        appid = data[COL_APPID]
+        with trace_span("update_row", appid=appid):
+            columns = list(range(COL_APPID, len(data)))
+            if self.store[treeiter][COL_ICON_PATH] == data[COL_ICON_PATH]:
+                columns.remove(COL_ICON)
+            else:
+                self.icons_requested.discard(appid)
+            self.store.set(treeiter, columns, [data[column] for column in columns])
+
+    def insert_rows(self, rows):
+        # Appending to a sorted, attached store resorts and redraws once per row.
+        # Sorting is switched off while the batch goes in and the view is detached
+        # for large batches, so the whole batch costs one sort and one redraw.
+        self.note_first_rows()
+        with trace_span("insert_rows", rows=len(rows)):
+            sort_column, order = self.store.get_sort_column_id()
+            if sort_column is None:
+                sort_column, order = COL_SIZE, Gtk.SortType.DESCENDING
+            detach = len(rows) >= ROW_DETACH_MIN
+            if detach:
+                cursor = self.treeview.get_cursor()[0]
+                cursor_appid = self.store[cursor][COL_APPID] if cursor else None
+                self.treeview.set_model(None)
+            self.store.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+            for row in rows:
+                treeiter = self.store.append(row)
+                self.rows[row[COL_APPID]] = Gtk.TreeRowReference.new(self.store, self.store.get_path(treeiter))
+            self.store.set_sort_column_id(sort_column, order)
+            if detach:
+                self.treeview.set_model(self.store)
+                treeiter = self.get_row_iter(cursor_appid) if cursor_appid else None
+                self.treeview.set_cursor(self.store.get_path(treeiter) if treeiter else Gtk.TreePath.new_first())
+                self.schedule_icon_update()
+
+    def schedule_icon_update(self, *args):
+        if not self.icon_update_pending:
+            self.icon_update_pending = True
+            GLib.timeout_add(50, self.load_visible_icons)
+
+    def load_visible_icons(self):
+        self.icon_update_pending = False
+        visible = self.treeview.get_visible_range()
+        if not visible:
+            return False
+        start = max(visible[0].get_indices()[0] - ICON_PREFETCH_ROWS, 0)
+        end = min(visible[1].get_indices()[0] + ICON_PREFETCH_ROWS, len(self.store) - 1)
+        for index in range(start, end + 1):
+            appid, icon_path = self.store[index][COL_APPID], self.store[index][COL_ICON_PATH]
+            if icon_path and appid not in self.icons_requested:
+                self.icons_requested.add(appid)
+                self.icon_pool.submit(self.icon_worker, appid, icon_path)
         return False
 
-    def add_to_store(self, data):
-        selected, appid, name, size, shader_size, symlink, icon = data
-        self.store.append([selected, appid, name, size, shader_size, symlink, icon])
+    def icon_worker(self, appid, icon_path):
+        with trace_span("load_icon", appid=appid, path=icon_path):
+            pixbuf = load_icon(icon_path)
+        if pixbuf:
+            GLib.idle_add(self.set_row_icon, appid, pixbuf)
+
+    def set_row_icon(self, appid, pixbuf):
+        treeiter = self.get_row_iter(appid)
+        if treeiter:
+            self.store.set_value(treeiter, COL_ICON, pixbuf)
         return False
 
+    def on_rescan_clicked(self, button):
+        get_manifest_index(refresh=True)
+        self.app_folders = get_valid_app_folders()
+        self.progress.set_fraction(0.0)
+        self.progress_label.set_text("Rescanning...")
+        self.progress.show()
+        self.progress_label.show()
+        self.populate_store_async(full=True)
+
     def on_toggle_selection(self, widget, path):
-        self.store[path][0] = not self.store[path][0]
+        self.store[path][COL_SELECTED] = not self.store[path][COL_SELECTED]
 
     def on_row_activated(self, treeview, path, column):
         model = treeview.get_model()
@@ -352,8 +4133,8 @@ class ProtonManagerWindow(Gtk.Window):
             if path:
                 model = treeview.get_model()
                 treeiter = model.get_iter(path)
-                appid = model[treeiter][1]
-                game_name = model[treeiter][2]
+                appid = model[treeiter][COL_APPID]
+                game_name = model[treeiter][COL_NAME]
 
                 menu = Gtk.Menu()
                 move_prefix = Gtk.MenuItem(label="Move Prefix")
@@ -372,22 +4153,35 @@ class ProtonManagerWindow(Gtk.Window):
                 delete_shader.connect("activate", lambda w: self.delete_location([treeiter], "shader"))
                 menu.append(delete_shader)
 
+                archive_prefix = Gtk.MenuItem(label="Archive Prefix")
+                archive_prefix.connect("activate", lambda w: self.archive_location([treeiter], "prefix"))
+                menu.append(archive_prefix)
+
+                archive_shader = Gtk.MenuItem(label="Archive Shader Cache")
+                archive_shader.connect("activate", lambda w: self.archive_location([treeiter], "shader"))
+                menu.append(archive_shader)
+
+                analyze_shader = Gtk.MenuItem(label="Analyze Shader Cache...")
+                analyze_shader.connect("activate", lambda w: self.analyze_shader(appid, game_name))
+                menu.append(analyze_shader)
+
                 menu.show_all()
                 menu.popup(None, None, None, None, event.button, event.time)
                 return True
         return False
 
-    def show_error(self, message):
+    def show_error(self, message, fatal=True):
         dialog = Gtk.MessageDialog(
             transient_for=self, flags=0, message_type=Gtk.MessageType.ERROR,
             buttons=Gtk.ButtonsType.OK, text=message
         )
-        dialog.run()
-        dialog.destroy()
-        Gtk.main_quit()
+        self.run_dialog(dialog, Gtk.ResponseType.OK, Gtk.ResponseType.OK)
+        if fatal:
+            Gtk.main_quit()
+        return False
 
     def on_toggle_clicked(self, button):
-        selected_rows = [self.store.get_iter(row.path) for row in self.store if row[0]]
+        selected_rows = [self.store.get_iter(row.path) for row in self.store if row[COL_SELECTED]]
         if not selected_rows:
             selection = self.treeview.get_selection()
             model, treeiter = selection.get_selected()
@@ -397,7 +4191,7 @@ class ProtonManagerWindow(Gtk.Window):
             self.toggle_location(selected_rows, "prefix")
 
     def on_toggle_shader_clicked(self, button):
-        selected_rows = [self.store.get_iter(row.path) for row in self.store if row[0]]
+        selected_rows = [self.store.get_iter(row.path) for row in self.store if row[COL_SELECTED]]
         if not selected_rows:
             selection = self.treeview.get_selection()
             model, treeiter = selection.get_selected()
@@ -406,224 +4200,389 @@ class ProtonManagerWindow(Gtk.Window):
         else:
             self.toggle_location(selected_rows, "shader")
 
+    def confirm(self, message):
+        dialog = Gtk.MessageDialog(
+            transient_for=self, flags=0, message_type=Gtk.MessageType.QUESTION,
+            buttons=Gtk.ButtonsType.YES_NO, text=message
+        )
+        return self.run_dialog(dialog, Gtk.ResponseType.YES, Gtk.ResponseType.NO) == Gtk.ResponseType.YES
+
     def toggle_location(self, treeiters, location_type):
         actions = []
         for treeiter in treeiters:
-            appid = self.store[treeiter][1]
-            game_name = self.store[treeiter][2]
+            appid = self.store[treeiter][COL_APPID]
+            game_name = self.store[treeiter][COL_NAME]
             if location_type == "prefix":
                 source_path = COMPATDATA_PATH / appid
-                target_path = TARGET_COMPATDATA_DIR / appid
-                action = "Move prefix to microSD" if not is_symlink(source_path) else "Move prefix back to internal"
+                size = self.store[treeiter][COL_SIZE]
+                state = self.store[treeiter][COL_PREFIX_STATE]
+                noun = "prefix"
             elif location_type == "shader":
                 source_path = SHADERCACHE_PATH / appid
-                target_path = TARGET_SHADERCACHE_DIR / appid
-                action = "Move shader cache to microSD" if not is_symlink(source_path) else "Move shader cache back to internal"
-            actions.append((treeiter, appid, source_path, target_path, action, game_name))
+                size = self.store[treeiter][COL_SHADER_SIZE]
+                state = self.store[treeiter][COL_SHADER_STATE]
+                noun = "shader cache"
+            total_bytes = int(size * 1024 * 1024)
+            target_path = None
+            if state == "Archived":
+                action = f"Restore {noun} from archive"
+                total_bytes = archived_size(source_path)
+            elif is_symlink(source_path):
+                action = f"Move {noun} back to internal"
+            else:
+                target_path = get_target_path(location_type, appid, total_bytes)
+                if not target_path:
+                    self.show_error("No SD card detected!", fatal=False)
+                    return
+                action = f"Move {noun} to {get_device_label(target_path.parent.parent)}"
+            actions.append((appid, source_path, target_path, action, game_name, total_bytes))
 
         if not actions:
             return
 
         message = "Are you sure you want to perform the following actions?\n\n"
-        for _, appid, _, _, action, game_name in actions:
+        for appid, _, _, action, game_name, _ in actions:
             message += f"{game_name} ({appid}): {action}\n"
+        if not self.confirm(message):
+            return
 
-        dialog = Gtk.MessageDialog(
-            transient_for=self, flags=0, message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO, text=message
-        )
-        
-        response = None
-        dialog.show_all()
-        while response is None:
-            pygame.event.pump()
-            if self.joystick:
-                if self.joystick.get_button(0):
-                    response = Gtk.ResponseType.YES
-                    pygame.time.wait(200)
-                elif self.joystick.get_button(1):
-                    response = Gtk.ResponseType.NO
-                    pygame.time.wait(200)
-            Gtk.main_iteration_do(False)
-            if response is None:
-                response = dialog.run()
-        dialog.destroy()
-
-        if response == Gtk.ResponseType.YES:
-            process_dialog = Gtk.MessageDialog(
-                transient_for=self, flags=0, message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.NONE, text="Processing..."
-            )
-            progress_bar = Gtk.ProgressBar()
-            process_dialog.get_content_area().pack_start(progress_bar, True, True, 0)
-            process_dialog.show_all()
-
-            def update_progress(fraction, game_name, dialog, progress_bar):
-                progress_bar.set_fraction(fraction)
-                dialog.set_property("text", f"Processing: {game_name}")
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-                return False
-
-            def reset_checkboxes():
-                for row in self.store:
-                    row[0] = False
-                return False
-
-            def process_next_action(actions, index, total, dialog, progress_bar):
-                if index >= len(actions):
-                    GLib.idle_add(update_progress, 1.0, "Finishing...", dialog, progress_bar)
-                    GLib.timeout_add(500, dialog.destroy)
-                    GLib.idle_add(self.show_info, "Success: All actions completed")
-                    GLib.idle_add(reset_checkboxes)
-                    return False
-                
-                treeiter, appid, source_path, target_path, action, game_name = actions[index]
-                GLib.idle_add(update_progress, index / total, game_name, dialog, progress_bar)
-                GLib.timeout_add(50, lambda: perform_action(treeiter, source_path, target_path, actions, index, total, dialog, progress_bar))
-                return False
-
-            def perform_action(treeiter, source_path, target_path, actions, index, total, dialog, progress_bar):
-                try:
-                    toggle_symlink(source_path, target_path)
-                    self.store[treeiter][5] = is_symlink(COMPATDATA_PATH / self.store[treeiter][1])
-                except Exception as e:
-                    GLib.idle_add(dialog.destroy)
-                    GLib.idle_add(self.show_error, f"Error processing {self.store[treeiter][2]}: {str(e)}")
-                    return False
-                GLib.timeout_add(100, process_next_action, actions, index + 1, total, dialog, progress_bar)
-                return False
-
-            GLib.timeout_add(500, process_next_action, actions, 0, len(actions), process_dialog, progress_bar)
+        verify = self.verify_check.get_active()
+        jobs = [Job(f"{action}: {game_name}",
+                    lambda job, source_path=source_path, target_path=target_path:
+                        toggle_symlink(source_path, target_path, job.progress, self.journal, verify),
+                    total_bytes)
+                for appid, source_path, target_path, action, game_name, total_bytes in actions]
+        self.run_jobs(jobs, [appid for appid, *_ in actions])
 
     def delete_location(self, treeiters, location_type):
         actions = []
         for treeiter in treeiters:
-            appid = self.store[treeiter][1]
-            game_name = self.store[treeiter][2]
+            appid = self.store[treeiter][COL_APPID]
+            game_name = self.store[treeiter][COL_NAME]
             if location_type == "prefix":
                 path = COMPATDATA_PATH / appid
                 action = "Delete prefix"
             elif location_type == "shader":
                 path = SHADERCACHE_PATH / appid
                 action = "Delete shader cache"
-            actions.append((treeiter, appid, path, action, game_name))
+            actions.append((appid, path, action, game_name))
 
         if not actions:
             return
 
         message = "Are you sure you want to delete the following?\n\n"
-        for _, appid, _, action, game_name in actions:
+        for appid, _, action, game_name in actions:
             message += f"{game_name} ({appid}): {action}\n"
+        if not self.confirm(message):
+            return
 
-        dialog = Gtk.MessageDialog(
-            transient_for=self, flags=0, message_type=Gtk.MessageType.QUESTION,
-            buttons=Gtk.ButtonsType.YES_NO, text=message
-        )
-        
-        response = None
-        dialog.show_all()
-        while response is None:
-            pygame.event.pump()
-            if self.joystick:
-                if self.joystick.get_button(0):
-                    response = Gtk.ResponseType.YES
-                    pygame.time.wait(200)
-                elif self.joystick.get_button(1):
-                    response = Gtk.ResponseType.NO
-                    pygame.time.wait(200)
-            Gtk.main_iteration_do(False)
-            if response is None:
-                response = dialog.run()
-        dialog.destroy()
-
-        if response == Gtk.ResponseType.YES:
-            process_dialog = Gtk.MessageDialog(
-                transient_for=self, flags=0, message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.NONE, text="Processing..."
-            )
-            progress_bar = Gtk.ProgressBar()
-            process_dialog.get_content_area().pack_start(progress_bar, True, True, 0)
-            process_dialog.show_all()
-
-            def update_progress(fraction, game_name, dialog, progress_bar):
-                progress_bar.set_fraction(fraction)
-                dialog.set_property("text", f"Processing: {game_name}")
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-                return False
-
-            def process_next_action(actions, index, total, dialog, progress_bar):
-                if index >= len(actions):
-                    GLib.idle_add(update_progress, 1.0, "Finishing...", dialog, progress_bar)
-                    GLib.timeout_add(500, dialog.destroy)
-                    GLib.idle_add(self.show_info, "Success: All actions completed")
-                    return False
-                
-                treeiter, appid, path, action, game_name = actions[index]
-                GLib.idle_add(update_progress, index / total, game_name, dialog, progress_bar)
-                GLib.timeout_add(50, lambda: perform_action(treeiter, path, actions, index, total, dialog, progress_bar))
-                return False
+        jobs = [Job(f"{action}: {game_name}", lambda job, path=path: delete_folder(path))
+                for appid, path, action, game_name in actions]
+        self.run_jobs(jobs, [appid for appid, *_ in actions], rescan=True)
 
-            def perform_action(treeiter, path, actions, index, total, dialog, progress_bar):
-                try:
-                    delete_folder(path)
-                except Exception as e:
-                    GLib.idle_add(dialog.destroy)
-                    GLib.idle_add(self.show_error, f"Error processing {self.store[treeiter][2]}: {str(e)}")
-                    return False
-                GLib.timeout_add(100, process_next_action, actions, index + 1, total, dialog, progress_bar)
-                return False
+    def archive_location(self, treeiters, location_type):
+        actions = []
+        for treeiter in treeiters:
+            appid = self.store[treeiter][COL_APPID]
+            game_name = self.store[treeiter][COL_NAME]
+            if location_type == "prefix":
+                path = COMPATDATA_PATH / appid
+                size = self.store[treeiter][COL_SIZE]
+                action = "Archive prefix"
+            elif location_type == "shader":
+                path = SHADERCACHE_PATH / appid
+                size = self.store[treeiter][COL_SHADER_SIZE]
+                action = "Archive shader cache"
+            if os.path.lexists(path):
+                actions.append((appid, path, action, game_name, int(size * 1024 * 1024)))
+
+        if not actions:
+            return
+
+        message = "Pack the following into compressed archives on the microSD card?\n\n"
+        for appid, _, action, game_name, _ in actions:
+            message += f"{game_name} ({appid}): {action}\n"
+        message += "\nArchived folders have to be restored before the game can run."
+        if not self.confirm(message):
+            return
+
+        jobs = [Job(f"{action}: {game_name}", lambda job, path=path: archive_folder(path, job.progress), total_bytes)
+                for appid, path, action, game_name, total_bytes in actions]
+        self.run_jobs(jobs, [appid for appid, *_ in actions], rescan=True)
+
+    def on_plan_clicked(self, button):
+        dialog = Gtk.Dialog(title="Plan Space", transient_for=self, flags=0)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK)
+        grid = Gtk.Grid(column_spacing=10, row_spacing=5, margin=10)
+        free_spin = Gtk.SpinButton.new_with_range(0, 2048, 1)
+        reserve_spin = Gtk.SpinButton.new_with_range(0, 2048, 1)
+        recent_check = Gtk.CheckButton(label="Keep recently played games on internal storage")
+        grid.attach(Gtk.Label(label="Internal space to free (GB, 0 = as much as fits):", xalign=0), 0, 0, 1, 1)
+        grid.attach(free_spin, 1, 0, 1, 1)
+        grid.attach(Gtk.Label(label="Free space to keep on microSD (GB):", xalign=0), 0, 1, 1, 1)
+        grid.attach(reserve_spin, 1, 1, 1, 1)
+        grid.attach(recent_check, 0, 2, 2, 1)
+        dialog.get_content_area().add(grid)
+        values = {}
+        dialog.connect("response", lambda dialog, response: values.update(
+            free=int(free_spin.get_value() * 1024 ** 3), reserve=int(reserve_spin.get_value() * 1024 ** 3),
+            recent=recent_check.get_active()))
+        if self.run_dialog(dialog, Gtk.ResponseType.OK, Gtk.ResponseType.CANCEL) != Gtk.ResponseType.OK:
+            return
+        threading.Thread(target=self.plan_worker, args=(dict(self.app_folders), values["free"] or None, values["reserve"], values["recent"]),
+                         daemon=True).start()
+
+    def plan_worker(self, app_folders, free_bytes, sd_reserve, weight_recent):
+        sizes = {appid: (prefix, shader) for appid, prefix, shader in scan_apps(app_folders, cache=self.cache)}
+        try:
+            plan = plan_space(sizes, free_bytes, sd_reserve, weight_recent)
+        except OSError as e:
+            GLib.idle_add(self.show_error, str(e), False)
+            return
+        GLib.idle_add(self.show_plan, plan)
+
+    def show_plan(self, plan):
+        if plan.moves is None:
+            self.show_error(f"Cannot free {format_size(plan.need)} with {format_size(plan.sd_free)} free on external libraries "
+                            f"({format_size(plan.sd_reserve)} kept free on each)", fatal=False)
+            return False
+        if not plan.moves:
+            self.show_info("Nothing needs to be moved")
+            return False
+        message = (f"Moving these folders to external storage frees {format_size(plan.freed_bytes)} of internal storage "
+                   f"and copies {format_size(plan.copy_bytes)}:\n\n")
+        for item in plan.moves:
+            message += (f"{get_game_name(item.appid)} ({item.appid}): {item.kind}, {format_size(item.allocated)} "
+                        f"to {get_device_label(item.library)}\n")
+        if self.confirm(message):
+            self.run_jobs([plan_job(item, self.journal) for item in plan.moves], [item.appid for item in plan.moves])
+        return False
+
+    def analyze_shader(self, appid, game_name):
+        if not os.path.exists(SHADERCACHE_PATH / appid):
+            self.show_info(f"{game_name} has no shader cache on disk")
+            return
+        threading.Thread(target=self.analyze_shader_worker, args=(appid, game_name), daemon=True).start()
+
+    def analyze_shader_worker(self, appid, game_name):
+        for _, breakdown, prunable in analyze_shader_caches([appid]):
+            GLib.idle_add(self.show_shader_breakdown, appid, game_name, breakdown, prunable)
+
+    def show_shader_breakdown(self, appid, game_name, breakdown, prunable):
+        message = f"Shader cache of {game_name} ({appid}):\n\n"
+        for component, name in SHADER_COMPONENTS.items():
+            item = breakdown.get(component)
+            if item:
+                message += f"{name}: {format_size(item.bytes)} in {item.files} files, last used {(time.time() - item.newest) // 86400:.0f} days ago\n"
+        if not prunable:
+            self.show_info(message + f"\nNo Mesa blobs have gone unused for {SHADER_STALE_DAYS} days.")
+            return False
+        message += (f"\nPrune {format_size(prunable)} of Mesa blobs unused for {SHADER_STALE_DAYS} days? "
+                    "Fossilize, DXVK and VKD3D caches are kept, so the blobs are rebuilt from them when needed.")
+        if self.confirm(message):
+            def prune(job):
+                files, size = prune_shader_cache(SHADERCACHE_PATH / appid)
+                return f"Pruned {files} files, freed {format_size(size)}"
+            self.run_jobs([Job(f"Prune shader cache: {game_name}", prune)], [appid], rescan=True)
+        return False
+
+    def on_orphans_clicked(self, button):
+        OrphanWindow(self).show_all()
+
+    def recover_moves(self):
+        moves = self.journal.unfinished() if self.journal else []
+        if not moves:
+            return False
+        message = "Some moves did not finish last time:\n\n"
+        for move in moves:
+            message += f"{move.source} -> {move.target} ({move.phase}, {move.copied_files} files / {format_size(move.copied_bytes)} copied)\n"
+        message += "\nResume them? Choosing No rolls back moves that were still copying."
+        resume = self.confirm(message)
+        jobs = []
+        for move in moves:
+            if resume:
+                jobs.append(Job(f"Resume move: {Path(move.source).name}",
+                                lambda job, move=move: run_move(move, self.journal, job.progress)))
+            else:
+                jobs.append(Job(f"Roll back move: {Path(move.source).name}",
+                                lambda job, move=move: rollback_move(move, self.journal)))
+        self.run_jobs(jobs, [Path(move.source).name for move in moves])
+        return False
 
-            GLib.timeout_add(500, process_next_action, actions, 0, len(actions), process_dialog, progress_bar)
+    def run_jobs(self, jobs, appids, rescan=False, on_finished=None):
+        # Jobs run on the queue's worker thread. Each finished job refreshes its row,
+        # and the last one in the batch reports the outcome of the whole batch.
+        remaining = [len(jobs)]
+
+        def job_done(job, appid):
+            self.refresh_row_location(appid)
+            if rescan:
+                self.rescan_rows([appid])
+                self.update_reclaim_status()
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                if on_finished:
+                    on_finished(jobs)
+                failed = [batch_job for batch_job in jobs if batch_job.state == "failed"]
+                cancelled = [batch_job for batch_job in jobs if batch_job.state == "cancelled"]
+                if failed:
+                    errors = "\n".join(f"{batch_job.label}: {batch_job.error}" for batch_job in failed)
+                    self.show_error(f"Error processing:\n{errors}", fatal=False)
+                elif cancelled:
+                    self.show_info(f"Cancelled {len(cancelled)} of {len(jobs)} actions")
+                else:
+                    self.show_info("Success: All actions completed")
+                    for row in self.store:
+                        row[COL_SELECTED] = False
+            return False
+
+        for job, appid in zip(jobs, appids):
+            job.on_done = lambda job, appid=appid: GLib.idle_add(job_done, job, appid)
+            self.job_queue.submit(job)
+        if not self.job_box.get_visible():
+            self.job_box.set_no_show_all(False)
+            self.job_box.show_all()
+            GLib.timeout_add(200, self.update_job_progress)
+
+    def update_reclaim_status(self):
+        reclaimer = get_reclaimer()
+        pending = reclaimer.pending()
+        text = f"Freed {format_size(reclaimer.freed_bytes)} of deleted data"
+        if pending:
+            text += f", {pending} deleted folders still being reclaimed"
+        self.reclaim_label.set_text(text)
+        self.reclaim_label.show()
+        return False
+
+    def update_job_progress(self):
+        pending = self.job_queue.pending()
+        if not pending:
+            self.job_box.hide()
+            return False
+        job = pending[0]
+        queued = len(pending) - 1
+        self.job_label.set_text(job.label + (f" ({queued} more queued)" if queued else ""))
+        fraction = job.fraction()
+        if fraction is None:
+            self.job_progress.pulse()
+        else:
+            self.job_progress.set_fraction(fraction)
+        status = f"{format_size(job.done_bytes)}"
+        if job.total_bytes:
+            status += f" of {format_size(job.total_bytes)}"
+        if job.state == "running":
+            status += f" at {format_size(job.rate())}/s"
+            eta = job.eta()
+            if eta is not None:
+                status += f", {int(eta // 60)}:{int(eta % 60):02d} left"
+        if job.current_file:
+            status += f" - {job.current_file}"
+        self.job_status.set_text(status)
+        return True
 
     def show_info(self, message):
         dialog = Gtk.MessageDialog(
             transient_for=self, flags=0, message_type=Gtk.MessageType.INFO,
             buttons=Gtk.ButtonsType.OK, text=message
         )
-        dialog.run()
-        dialog.destroy()
+        self.run_dialog(dialog, Gtk.ResponseType.OK, Gtk.ResponseType.OK)
         return False
 
-    def handle_gamepad(self):
-        if not self.joystick:
-            return True
+class OrphanWindow(Gtk.Window):
+    # Separate view of the folders find_orphans reports. Deletes go through the
+    # main window's job queue, so they show up in its progress bar and run in
+    # the background like every other delete.
+    COLUMNS = (bool, str, str, str, float, str)
 
-        pygame.event.pump()
-        current_path = self.treeview.get_cursor()[0] or Gtk.TreePath.new_first()
-
-        if self.joystick.get_numhats() > 0:
-            hat_y = self.joystick.get_hat(0)[1]
-            if hat_y == 1 and current_path.get_indices()[0] > 0:
-                new_path = Gtk.TreePath.new_from_indices([current_path.get_indices()[0] - 1])
-                self.treeview.set_cursor(new_path)
-                pygame.time.wait(200)
-            elif hat_y == -1 and current_path.get_indices()[0] < len(self.store) - 1:
-                new_path = Gtk.TreePath.new_from_indices([current_path.get_indices()[0] + 1])
-                self.treeview.set_cursor(new_path)
-                pygame.time.wait(200)
-
-        y_axis = self.joystick.get_axis(1)
-        if y_axis < -0.95 and current_path.get_indices()[0] > 0:
-            new_path = Gtk.TreePath.new_from_indices([current_path.get_indices()[0] - 1])
-            self.treeview.set_cursor(new_path)
-            pygame.time.wait(200)
-        elif y_axis > 0.95 and current_path.get_indices()[0] < len(self.store) - 1:
-            new_path = Gtk.TreePath.new_from_indices([current_path.get_indices()[0] + 1])
-            self.treeview.set_cursor(new_path)
-            pygame.time.wait(200)
-
-        selection = self.treeview.get_selection()
-        model, treeiter = selection.get_selected()
-        if self.joystick.get_button(0) and treeiter:
-            self.toggle_location([treeiter], "prefix")
+    def __init__(self, parent):
+        super().__init__(title="Orphaned Prefixes and Shader Caches", transient_for=parent)
+        self.parent_window = parent
+        self.set_default_size(900, 500)
+        self.orphans = {}
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=5)
+        self.add(vbox)
+        self.status = Gtk.Label(label="Looking for orphans...", xalign=0)
+        vbox.pack_start(self.status, False, False, 5)
 
-        return True
+        self.store = Gtk.ListStore(*self.COLUMNS)
+        self.store.set_sort_column_id(4, Gtk.SortType.DESCENDING)
+        treeview = Gtk.TreeView(model=self.store)
+        renderer_toggle = Gtk.CellRendererToggle()
+        renderer_toggle.connect("toggled", self.on_toggled)
+        treeview.append_column(Gtk.TreeViewColumn("Select", renderer_toggle, active=0))
+        for index, title in enumerate(("AppID", "Folder", "Reason", "On Disk (MB)", "Path"), 1):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(title, renderer, text=index)
+            column.set_sort_column_id(index)
+            if index == 4:
+                renderer.set_property("xalign", 1.0)
+                column.set_cell_data_func(renderer, parent.format_size, index)
+            treeview.append_column(column)
+        scrolled_window = Gtk.ScrolledWindow()
+        scrolled_window.add(treeview)
+        vbox.pack_start(scrolled_window, True, True, 0)
+
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
+        select_all = Gtk.Button(label="Select All")
+        select_all.connect("clicked", self.on_select_all)
+        hbox.pack_start(select_all, False, False, 0)
+        delete_button = Gtk.Button(label="Delete Selected")
+        delete_button.connect("clicked", self.on_delete_clicked)
+        hbox.pack_start(delete_button, True, True, 0)
+        rescan_button = Gtk.Button(label="Rescan")
+        rescan_button.connect("clicked", lambda button: self.scan())
+        hbox.pack_start(rescan_button, False, False, 0)
+        vbox.pack_start(hbox, False, False, 5)
+        self.scan()
+
+    def scan(self):
+        self.store.clear()
+        self.orphans.clear()
+        self.status.set_text("Looking for orphans...")
+        threading.Thread(target=self.scan_worker, daemon=True).start()
+
+    def scan_worker(self):
+        orphans = find_orphans()
+        GLib.idle_add(self.status.set_text, f"Sizing {len(orphans)} orphans...")
+        for orphan in size_orphans(orphans):
+            GLib.idle_add(self.add_orphan, orphan)
+        GLib.idle_add(self.update_status)
+
+    def add_orphan(self, orphan):
+        self.orphans[str(orphan.path)] = orphan
+        self.store.append([False, orphan.appid, orphan.kind, orphan.reason, orphan.size.allocated / (1024 * 1024), str(orphan.path)])
+        return False
+
+    def update_status(self):
+        total = sum(orphan.size.allocated for orphan in self.orphans.values())
+        self.status.set_text(f"{len(self.orphans)} orphans, {format_size(total)} on disk")
+        return False
+
+    def on_toggled(self, widget, path):
+        self.store[path][0] = not self.store[path][0]
+
+    def on_select_all(self, button):
+        for row in self.store:
+            row[0] = True
+
+    def on_delete_clicked(self, button):
+        selected = [self.orphans[row[5]] for row in self.store if row[0]]
+        if not selected:
+            return
+        total = sum(orphan.size.allocated for orphan in selected)
+        if not self.parent_window.confirm(f"Delete {len(selected)} orphaned folders ({format_size(total)})?"):
+            return
+        self.parent_window.run_jobs([orphan_job(orphan) for orphan in selected], [orphan.appid for orphan in selected],
+                                    on_finished=self.on_deleted)
+
+    def on_deleted(self, jobs):
+        self.scan()
+        self.parent_window.update_reclaim_status()
 
 if __name__ == "__main__":
+    PROFILE_STARTUP = GLOBAL_OPTIONS.profile_startup
     win = ProtonManagerWindow()
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
     Gtk.main()
-    pygame.quit()
\ No newline at end of file
+    win.shutdown()
\ No newline at end of file
@@ -0,0 +1,28 @@
+import types
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "data-manager.py"
+GUI_BOUNDARY = 'STARTUP_MARKS.append(("core definitions"'
+
+
+@pytest.fixture(scope="session")
+def dm():
+    # The script's GUI half subclasses GTK widgets as it loads, so only the core
+    # above it is run; that part needs nothing beyond the standard library.
+    source = SCRIPT.read_text()
+    module = types.ModuleType("data_manager")
+    module.__file__ = str(SCRIPT)
+    exec(compile(source[:source.index(GUI_BOUNDARY)], str(SCRIPT), "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture
+def steam_tree(dm, tmp_path):
+    # A small gen-tree install: home with the internal library, sd with the card.
+    home, sd_root = tmp_path / "home", tmp_path / "sd"
+    dm.generate_steam_tree(home, sd_root, apps=6, dirs=4, files=5, file_size=4096, seed=1)
+    dm.set_home(home)
+    yield home, sd_root / "steamapps"
+    dm.get_reclaimer().wait()
@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import SCRIPT
+
+
+def test_cli_runs_against_generated_tree(tmp_path):
+    # Runs the script as CI would, so it needs no GTK: global options go before
+    # or after the command.
+    home = tmp_path / "home"
+    subprocess.run([sys.executable, SCRIPT, "gen-tree", str(home), "--sd", str(tmp_path / "sd"), "--apps", "4",
+                    "--dirs", "2", "--files", "3"], check=True, capture_output=True)
+    for argv in (["--home", str(home), "scan", "--json"], ["scan", "--json", "--home", str(home)]):
+        result = subprocess.run([sys.executable, SCRIPT] + argv, check=True, capture_output=True, text=True)
+        assert len(json.loads(result.stdout)) == 4
+
+
+def test_parse_vdf(dm):
+    parsed = dm.parse_vdf('''
+        // comment
+        "libraryfolders"
+        {
+            "0" { "path" "/home/deck/.local/share/Steam" "label" "" }
+            "1"
+            {
+                "path"    "/run/media/deck/Card \\"A\\""
+                bare      value
+                "apps" { "620" "123" }
+            }
+        }
+    ''')
+    folders = parsed["libraryfolders"]
+    assert folders["0"] == {"path": "/home/deck/.local/share/Steam", "label": ""}
+    assert folders["1"]["path"] == '/run/media/deck/Card "A"'
+    assert folders["1"]["bare"] == "value"
+    assert folders["1"]["apps"] == {"620": "123"}
+
+
+def snapshot(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def internal_prefixes(dm):
+    return sorted(appid for appid in os.listdir(dm.COMPATDATA_PATH) if not dm.is_symlink(dm.COMPATDATA_PATH / appid))
+
+
+def test_copy_tree_recreates_hardlinks_to_small_files(dm, tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    for index in range(50):
+        (src / f"file{index}").write_bytes(b"x" * 100)
+        os.link(src / f"file{index}", src / f"link{index}")
+
+    dm.copy_tree(src, dst)
+
+    for index in range(50):
+        first, second = os.stat(dst / f"file{index}"), os.stat(dst / f"link{index}")
+        assert (first.st_ino, first.st_nlink, first.st_size) == (second.st_ino, 2, 100)
+
+
+def test_resume_interrupted_move(dm, steam_tree, tmp_path):
+    _, sd_steamapps = steam_tree
+    appid = internal_prefixes(dm)[0]
+    source, target = dm.COMPATDATA_PATH / appid, sd_steamapps / "compatdata" / appid
+    expected = snapshot(source)
+    journal = dm.MoveJournal(tmp_path / "journal.sqlite3")
+    journal.begin("to_target", source, target)
+    # A crash halfway through the copy: some files are missing from staging and
+    # one was cut short.
+    staging = dm.partial_path(target)
+    shutil.copytree(source, staging)
+    files = sorted(path for path in staging.rglob("*") if path.is_file())
+    for path in files[::2]:
+        path.unlink()
+    with open(files[1], "r+b") as f:
+        f.truncate(1)
+
+    [move] = journal.unfinished()
+    assert move.phase == "copying" and 0 < move.copied_files < len(expected)
+    dm.run_move(move, journal)
+
+    assert dm.is_symlink(source) and os.readlink(source) == str(target)
+    assert snapshot(target) == expected
+    assert not staging.exists()
+    assert journal.unfinished() == []
+
+
+def test_resume_keeps_partial_copy_when_source_is_gone(dm, steam_tree, tmp_path):
+    # Moving a prefix back from the card, interrupted, then resumed with the card
+    # removed: the partial copy on internal storage must not be swapped in.
+    _, sd_steamapps = steam_tree
+    appid = next(appid for appid in sorted(os.listdir(dm.COMPATDATA_PATH)) if dm.is_symlink(dm.COMPATDATA_PATH / appid))
+    source = dm.COMPATDATA_PATH / appid
+    target = sd_steamapps / "compatdata" / appid
+    journal = dm.MoveJournal(tmp_path / "journal.sqlite3")
+    journal.begin("to_internal", source, target)
+    staging = dm.partial_path(source)
+    shutil.copytree(target, staging)
+    files = sorted(path for path in staging.rglob("*") if path.is_file())
+    for path in files[::2]:
+        path.unlink()
+    shutil.rmtree(sd_steamapps)
+
+    [move] = journal.unfinished()
+    with pytest.raises(Exception, match="not available"):
+        dm.run_move(move, journal)
+    with pytest.raises(Exception, match="not available"):
+        dm.rollback_move(move, journal)
+
+    assert dm.is_symlink(source)
+    assert len(list_files(staging)) == len(files) - len(files[::2])
+    assert [move.id for move in journal.unfinished()] == [move.id]
+
+
+def test_rollback_restores_renamed_source(dm, steam_tree, tmp_path):
+    _, sd_steamapps = steam_tree
+    appid = internal_prefixes(dm)[0]
+    source, target = dm.COMPATDATA_PATH / appid, sd_steamapps / "compatdata" / appid
+    expected = snapshot(source)
+    journal = dm.MoveJournal(tmp_path / "journal.sqlite3")
+    journal.begin("to_target", source, target)
+    # On one filesystem the source is renamed straight into staging.
+    os.rename(source, dm.partial_path(target))
+
+    dm.rollback_move(journal.unfinished()[0], journal)
+
+    assert snapshot(source) == expected
+    assert not dm.partial_path(target).exists()
+    assert journal.unfinished() == []
+
+
+def plan_item(dm, appid, size):
+    return dm.PlanItem(appid, "prefix", None, size, size, 0, None)
+
+
+def test_solve_space_plan(dm):
+    items = [plan_item(dm, str(appid), size) for appid, size in enumerate((5, 4, 3, 2))]
+    cheapest = dm.solve_space_plan(items, 6, 100)
+    assert sorted(item.allocated for item in cheapest) == [2, 4]
+    assert sum(item.allocated for item in dm.solve_space_plan(items, None, 5)) == 5
+    assert dm.solve_space_plan(items, 20, 10) is None
+    assert dm.solve_space_plan(items, 0, 10) == []
+
+
+def test_verify_tree(dm, tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    (src / "a").mkdir(parents=True)
+    (src / "a/one.bin").write_bytes(b"1" * 5000)
+    (src / "two.bin").write_bytes(b"2" * 10)
+    shutil.copytree(src, dst)
+
+    verified = dm.verify_tree(src, dst)
+    assert sorted(verified) == [os.path.join("a", "one.bin"), "two.bin"]
+
+    with open(dst / "a/one.bin", "r+b") as f:
+        f.write(b"x")
+    with pytest.raises(dm.VerifyError):
+        dm.verify_tree(src, dst)
+    (dst / "a/one.bin").unlink()
+    with pytest.raises(dm.VerifyError):
+        dm.verify_tree(src, dst)
+
+
+def test_find_orphans(dm, steam_tree):
+    _, sd_steamapps = steam_tree
+    appids = sorted(os.listdir(dm.COMPATDATA_PATH))
+    internal = internal_prefixes(dm)
+    linked = [appid for appid in appids if appid not in internal]
+    assert internal and linked
+    (dm.INTERNAL_LIBRARY / f"appmanifest_{internal[0]}.acf").unlink()
+    shutil.rmtree(os.readlink(dm.COMPATDATA_PATH / linked[0]))
+    (dm.COMPATDATA_PATH / f"{internal[1]}.sddm-partial").mkdir()
+
+    def found():
+        dm.get_manifest_index(refresh=True)
+        return {(orphan.appid, orphan.kind, orphan.reason) for orphan in dm.find_orphans()}
+
+    uninstalled = {(internal[0], "prefix", "uninstalled"), (internal[0], "shader", "uninstalled")}
+    # linked[0] still has its manifest, so only its prefix is missing.
+    assert found() == uninstalled
+    (dm.INTERNAL_LIBRARY / f"appmanifest_{linked[0]}.acf").unlink()
+    assert found() == uninstalled | {(linked[0], "prefix", "dangling symlink"), (linked[0], "shader", "uninstalled")}
+
+    vdf = dm.LIBRARY_FOLDERS_VDF.read_text()
+    dm.LIBRARY_FOLDERS_VDF.write_text(vdf.replace(f'"path"\t\t"{sd_steamapps.parent}"',
+                                                  f'"path"\t\t"{sd_steamapps.parent}"\n\t\t"apps" {{ "{linked[0]}" "1" }}'))
+    assert found() == uninstalled
+    # With the card removed its prefixes all dangle, but none of them is an orphan.
+    dm.LIBRARY_FOLDERS_VDF.write_text(vdf)
+    shutil.rmtree(sd_steamapps)
+    assert found() == uninstalled | {(linked[0], "shader", "uninstalled")}
+
+
+def list_files(root):
+    # Names only: reading the files would refresh their atime.
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, _, filenames in os.walk(root) for name in filenames)
+
+
+def age(path, days):
+    stamp = time.time() - days * 86400
+    os.utime(path, (stamp, stamp))
+
+
+def test_prune_shader_cache(dm, tmp_path):
+    cache = tmp_path / "shadercache/620"
+    layout = {
+        "fozpipelinesv6/steamapp_pipeline_cache.foz": 100,
+        "DXVK_state_cache/game.dxvk-cache": 100,
+        "mesa_shader_cache/index": 100,
+        "mesa_shader_cache/ab/old": 10,
+        "mesa_shader_cache/ab/new": 20,
+        "mesa_shader_cache_sf/x/mesa_cache.db": 40,
+        "mesa_shader_cache_sf/x/mesa_cache.idx": 4,
+        "mesa_shader_cache_sf/y/mesa_cache.db": 80,
+        "mesa_shader_cache_sf/y/mesa_cache.idx": 8,
+    }
+    for rel, size in layout.items():
+        (cache / rel).parent.mkdir(parents=True, exist_ok=True)
+        (cache / rel).write_bytes(b"\0" * size)
+        if not rel.endswith(("new", "y/mesa_cache.idx")):
+            age(cache / rel, 100)
+
+    breakdown = dm.analyze_shader_cache(cache)
+    assert {component: item.bytes for component, item in breakdown.items()} == {
+        "fossilize": 100, "dxvk": 100, "mesa": 262}
+    assert breakdown["mesa"].ages[-1] == 100 + 10 + 40 + 4 + 80
+
+    # The index is Mesa's own bookkeeping and y still has a fresh file.
+    assert dm.prune_shader_cache(cache, dry_run=True) == (3, 54)
+    assert list_files(cache) == sorted(layout)
+    assert dm.prune_shader_cache(cache) == (3, 54)
+    assert list_files(cache) == sorted(rel for rel in layout if "/old" not in rel and "/x/" not in rel)
+    assert not (cache / "mesa_shader_cache_sf/x").exists()